@@ -0,0 +1,99 @@
+"""Benchmark throughput of `cleanup.cleanup_en` with a fake completion backend.
+
+Cleans up synthetic documents offline, with simulated latency, API errors and
+rate limit (429) responses, and reports chunks/sec, wall time and retries.
+
+Usage: python scripts/benchmark_cleanup.py [--n_docs 4] [--size_kb 200]
+"""
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from op_mt_tools.cleanup import (
+    cleanup_en,
+    get_chunk_store,
+    get_chunks,
+    get_cleanup_executor,
+)
+from op_mt_tools.fake_completion import FakeCompletionBackend
+
+WORDS = (
+    "the Buddha taught that all conditioned things are impermanent and that "
+    "suffering arises from craving [1] while the path of 8 practices leads to peace"
+).split()
+
+
+def make_document(size_kb: float, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    sents = []
+    size = 0
+    while size < size_kb * 1024:
+        sent = " ".join(rng.choices(WORDS, k=rng.randint(5, 40))).capitalize() + "."
+        sents.append(sent)
+        size += len(sent) + 1
+    return "\n".join(sents)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n_docs", type=int, default=4)
+    parser.add_argument("--size_kb", type=float, default=200)
+    parser.add_argument("--latency", type=float, default=0.5, help="secs per request")
+    parser.add_argument("--error_rate", type=float, default=0.01)
+    parser.add_argument("--rate_limit_rate", type=float, default=0.05)
+    parser.add_argument("--retry_after", type=float, default=1.0)
+    parser.add_argument("--max_in_flight", type=int, default=16)
+    parser.add_argument("--rpm", type=float, default=3500)
+    parser.add_argument("--tpm", type=float, default=90000)
+    args = parser.parse_args()
+
+    backend = FakeCompletionBackend(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+    )
+    executor = get_cleanup_executor(
+        max_in_flight=args.max_in_flight,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm,
+        completion_fn=backend,
+    )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        chunk_stores_path = Path(tmp_dir) / "chunk_stores"
+        fns = []
+        for doc_idx in range(args.n_docs):
+            fn = Path(tmp_dir) / f"text{doc_idx:02}" / f"text{doc_idx:02}.txt"
+            fn.parent.mkdir()
+            fn.write_text(make_document(args.size_kb, seed=doc_idx), encoding="utf-8")
+            fns.append(fn)
+
+        # split the documents beforehand, so that only the cleanup is timed
+        start = time.time()
+        n_chunks = 0
+        for fn in fns:
+            text = fn.read_text(encoding="utf-8")
+            store = get_chunk_store(fn, chunk_stores_path)
+            n_chunks += len(list(get_chunks(text, store)))
+        print(f"split: {time.time() - start:.2f}s, {n_chunks} chunks")
+
+        start = time.time()
+        failed_fns = []
+        for fn in fns:
+            try:
+                cleanup_en(fn, executor=executor, chunk_stores_path=chunk_stores_path)
+            except RuntimeError as e:
+                print(f"[ERROR] {e}")
+                failed_fns.append(fn)
+        wall_time = time.time() - start
+
+    print(f"wall time: {wall_time:.2f}s")
+    print(f"throughput: {n_chunks / wall_time:.2f} chunks/sec")
+    print(
+        f"requests: {executor.n_requests}, retries: {executor.n_retries} "
+        f"({backend.n_rate_limited} rate limited, {backend.n_errors} errors)"
+    )
+    print(f"failed texts: {len(failed_fns)}")
@@ -0,0 +1,68 @@
+"""Benchmark QC sentence encoding with length-sorted token-budget batches.
+
+Encodes the bo and en sentences of TMs with `qc.tm.get_embedding` and with the
+fixed-size batches of `model.encode`, and reports the speedup and the largest
+difference between the embeddings.
+
+Usage: python scripts/benchmark_qc_encoding.py <tm_path> [<tm_path> ...]
+"""
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+from op_mt_tools.qc.tm import (
+    MAX_BATCH_TOKENS,
+    get_embedding,
+    get_model,
+    get_sentence_pairs,
+)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("tm_paths", type=Path, nargs="+")
+    parser.add_argument("--max_batch_tokens", type=int, default=MAX_BATCH_TOKENS)
+    parser.add_argument(
+        "--batch_size", type=int, default=32, help="batch size of model.encode"
+    )
+    args = parser.parse_args()
+
+    sentences = []
+    for tm_path in args.tm_paths:
+        bo_sents, en_sents = get_sentence_pairs(tm_path)
+        sentences += bo_sents + en_sents
+    model = get_model()
+    lengths = [
+        len(ids)
+        for ids in model.tokenizer(
+            sentences, truncation=True, max_length=model.max_seq_length
+        )["input_ids"]
+    ]
+    print(
+        f"{len(sentences)} sentences, tokens per sentence: "
+        f"median {np.median(lengths):.0f}, p90 {np.percentile(lengths, 90):.0f}, "
+        f"max {max(lengths)}"
+    )
+
+    start = time.time()
+    embeddings = model.encode(
+        sentences, batch_size=args.batch_size, show_progress_bar=False
+    )
+    baseline_secs = time.time() - start
+    print(
+        f"model.encode: {baseline_secs:.2f}s, "
+        f"{len(sentences) / baseline_secs:.1f} sentences/sec"
+    )
+
+    start = time.time()
+    token_budget_embeddings = get_embedding(sentences, args.max_batch_tokens)
+    token_budget_secs = time.time() - start
+    print(
+        f"get_embedding: {token_budget_secs:.2f}s, "
+        f"{len(sentences) / token_budget_secs:.1f} sentences/sec"
+    )
+
+    print(f"speedup: {baseline_secs / token_budget_secs:.2f}x")
+    max_diff = np.abs(embeddings - token_budget_embeddings).max()
+    print(f"max embedding difference: {max_diff:.2e}")
@@ -0,0 +1,73 @@
+"""Benchmark chunking of a large English document by `cleanup.split_document`.
+
+Compares the chunks and the time against the previous implementation, which
+re-encoded the whole chunk after each sentence.
+
+Usage: python scripts/benchmark_split_document.py [--size_mb 5]
+"""
+import argparse
+import random
+import time
+from typing import List
+
+from op_mt_tools.cleanup import (
+    CHUNK_MAX_TOKENS,
+    chunk_sentences,
+    num_tokens_from_messages,
+)
+from op_mt_tools.tokenizers import en_sent_tokenizer
+
+WORDS = (
+    "the Buddha taught that all conditioned things are impermanent and that "
+    "suffering arises from craving [1] while the path of 8 practices leads to peace"
+).split()
+
+
+def make_document(size_mb: float, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    sents = []
+    size = 0
+    while size < size_mb * 1024 * 1024:
+        sent = " ".join(rng.choices(WORDS, k=rng.randint(5, 40))).capitalize() + "."
+        sents.append(sent)
+        size += len(sent) + 1
+    return "\n".join(sents)
+
+
+def legacy_chunk_sentences(
+    sents: List[str], chunk_max_tokens=CHUNK_MAX_TOKENS
+) -> List[str]:
+    chunks = []
+    current_chunk = []
+    for sentence in sents:
+        current_chunk.append(sentence)
+        tokens = num_tokens_from_messages(" ".join(current_chunk))
+        if tokens > chunk_max_tokens:
+            current_chunk.pop()
+            chunks.append(" ".join(current_chunk))
+            current_chunk = [sentence]
+    if current_chunk:
+        chunks.append(" ".join(current_chunk))
+    return chunks
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size_mb", type=float, default=5)
+    args = parser.parse_args()
+
+    document = make_document(args.size_mb)
+    start = time.time()
+    sents = en_sent_tokenizer(document).splitlines()
+    print(f"sentence tokenizer: {time.time() - start:.2f}s, {len(sents)} sentences")
+
+    start = time.time()
+    chunks = chunk_sentences(sents)
+    print(f"chunk_sentences: {time.time() - start:.2f}s, {len(chunks)} chunks")
+
+    start = time.time()
+    legacy_chunks = legacy_chunk_sentences(sents)
+    print(f"legacy chunking: {time.time() - start:.2f}s, {len(legacy_chunks)} chunks")
+
+    assert chunks == legacy_chunks, "chunks differ from the legacy implementation"
+    print("chunks are identical")
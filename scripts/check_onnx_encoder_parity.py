@@ -0,0 +1,54 @@
+"""Compare QC scores of the int8 ONNX encoder with the PyTorch encoder.
+
+Scores the sentence pairs of a reference TM with both backends and reports the
+score drift, the sentence pairs whose QC rank changed, and the speedup.
+
+Usage: python scripts/check_onnx_encoder_parity.py <tm_path>
+"""
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+from op_mt_tools.qc.pipeline import SimilarityMetric
+from op_mt_tools.qc.tm import (
+    EncoderBackend,
+    get_model,
+    get_sentence_pairs,
+    get_similarity,
+    set_encoder_backend,
+)
+
+
+def score(backend: str, bo_sents, en_sents):
+    set_encoder_backend(backend)
+    # load, or export, the model before timing
+    get_model()
+    start = time.time()
+    sim_scores = get_similarity(bo_sents, en_sents, use_cache=False)
+    return sim_scores, time.time() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("tm_path", type=Path)
+    args = parser.parse_args()
+
+    bo_sents, en_sents = get_sentence_pairs(args.tm_path)
+    torch_scores, torch_secs = score(EncoderBackend.TORCH, bo_sents, en_sents)
+    onnx_scores, onnx_secs = score(EncoderBackend.ONNX, bo_sents, en_sents)
+
+    drift = np.abs(torch_scores - onnx_scores)
+    metric = SimilarityMetric()
+    torch_ranks, torch_tm_rank, _ = metric.rank(torch_scores)
+    onnx_ranks, onnx_tm_rank, _ = metric.rank(onnx_scores)
+    n_rank_changes = sum(a != b for a, b in zip(torch_ranks, onnx_ranks))
+
+    print(f"{len(bo_sents)} sentence pairs")
+    print(f"score drift: mean {drift.mean():.4f}, max {drift.max():.4f}")
+    print(
+        f"rank changes: {n_rank_changes} pairs, TM rank {torch_tm_rank} -> {onnx_tm_rank}"
+    )
+    print(f"torch: {torch_secs:.2f}s, onnx int8: {onnx_secs:.2f}s")
+    print(f"speedup: {torch_secs / onnx_secs:.2f}x")
@@ -0,0 +1,246 @@
+import csv
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import requests
+from tinydb import Query, TinyDB
+
+from . import config
+from . import types as t
+from .alignment_cache import AlignmentCache, get_text_pair_hash
+from .tm import ALIGNERS_VERSION, CACHED_STATUS, AlignersEnum, create_TMs
+
+JOBS_DB_PATH = config.DATA_PATH / "aligner_jobs.json"
+
+
+class AlignerJobStatus:
+    PENDING = "pending"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    TIMEOUT = "timeout"
+
+
+def check_tm_repo(tm_id: str, org: str, token: str) -> Optional[bool]:
+    """Check that the TM repo exists and has its bo and en files.
+
+    Returns:
+        None if the repo is not created yet, otherwise whether it has the TM files.
+    """
+    url = f"https://api.github.com/repos/{org}/{tm_id}/contents"
+    headers = {
+        "Authorization": f"token {token}",
+        "Accept": "application/vnd.github.v3+json",
+    }
+    response = requests.get(url, headers=headers, timeout=30)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    fns = [item["name"] for item in response.json()]
+    return all(
+        any(fn.endswith(f"-{lang_code}.txt") for fn in fns)
+        for lang_code in ["bo", "en"]
+    )
+
+
+class AlignerJobTracker:
+    """Status table of the aligner jobs, one row per text id.
+
+    The remote aligner publishes the TM repo once the job is done, so the submitted
+    jobs stay pending until their TM repo is validated by `collect`, or until they
+    time out.
+
+    Args:
+        db_path: Path to the TinyDB file.
+        timeout_secs: Seconds after submission before a pending job times out.
+    """
+
+    def __init__(self, db_path: Path = JOBS_DB_PATH, timeout_secs: float = 6 * 3600):
+        self._db = TinyDB(db_path)
+        self.timeout_secs = timeout_secs
+        self.query = Query()
+
+    def record_submissions(
+        self,
+        text_pairs_view_path: Dict[str, t.TEXT_PAIR_VIEW_PATH],
+        tms_status: Dict[str, str],
+        aligner: str = AlignersEnum.REMOTE,
+    ):
+        """Record the jobs submitted by `create_TMs` with their returned status."""
+        now = time.time()
+        for text_id, submit_status in tms_status.items():
+            row = self._db.get(self.query.text_id == text_id)
+            error = None
+            if submit_status.startswith("FAILED"):
+                status, error = AlignerJobStatus.FAILED, submit_status
+            elif submit_status in ["ALIGNED", CACHED_STATUS]:
+                # local aligner publishes the TM before returning, and only the
+                # published TMs are cached
+                status = AlignerJobStatus.SUCCEEDED
+            else:
+                status = AlignerJobStatus.PENDING
+            text_pair_view_path = text_pairs_view_path[text_id]
+            cache_key = None
+            if all(Path(fn).is_file() for fn in text_pair_view_path.values()):
+                cache_key = get_text_pair_hash(
+                    text_pair_view_path, ALIGNERS_VERSION[aligner]
+                )
+            self._db.upsert(
+                {
+                    "text_id": text_id,
+                    "tm_id": f"TM{text_id}",
+                    "aligner": aligner,
+                    "view_path": {
+                        lang_code: str(view_path)
+                        for lang_code, view_path in text_pair_view_path.items()
+                    },
+                    "cache_key": cache_key,
+                    "status": status,
+                    "error": error,
+                    "attempts": (row["attempts"] if row else 0) + 1,
+                    "submitted_at": now,
+                    "checked_at": now,
+                },
+                self.query.text_id == text_id,
+            )
+
+    def update(self, text_id: str, status: str, error: Optional[str] = None):
+        self._db.update(
+            {"status": status, "error": error, "checked_at": time.time()},
+            self.query.text_id == text_id,
+        )
+
+    def get(self, text_id: str) -> Optional[dict]:
+        return self._db.get(self.query.text_id == text_id)
+
+    def jobs(self, statuses: Optional[List[str]] = None) -> List[dict]:
+        if statuses is None:
+            return self._db.all()
+        return self._db.search(self.query.status.one_of(statuses))
+
+    def stats(self) -> Dict[str, int]:
+        return dict(Counter(job["status"] for job in self._db.all()))
+
+    def to_csv(self, csv_path: Path):
+        fields = ["text_id", "tm_id", "aligner", "status", "attempts", "error"]
+        with open(csv_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+            writer.writeheader()
+            for job in sorted(self._db.all(), key=lambda job: job["text_id"]):
+                writer.writerow(job)
+
+
+def collect(
+    tracker: AlignerJobTracker,
+    max_concurrency: int = 8,
+    check_fn: Optional[Callable[[str], Optional[bool]]] = None,
+    cache: Optional[AlignmentCache] = None,
+) -> Dict[str, int]:
+    """Check the TM repos of the pending jobs with bounded concurrency.
+
+    Args:
+        tracker: status table of the aligner jobs.
+        max_concurrency: number of TM repos checked at a time.
+        check_fn: checks TM repo by its id, defaults to `check_tm_repo`.
+        cache: if provided, text pairs of the confirmed TMs are added to it.
+
+    Returns:
+        number of jobs in each status.
+    """
+    if check_fn is None:
+        org, token = os.environ["MAI_GITHUB_ORG"], os.environ["GITHUB_TOKEN"]
+        check_fn = partial(check_tm_repo, org=org, token=token)
+    check_tm = check_fn
+
+    def check_job(job: dict):
+        try:
+            return check_tm(job["tm_id"]), None
+        except Exception as e:
+            return None, str(e)
+
+    pending_jobs = tracker.jobs([AlignerJobStatus.PENDING])
+    print(f"[INFO] Checking {len(pending_jobs)} pending aligner jobs...")
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        results = list(executor.map(check_job, pending_jobs))
+
+    now = time.time()
+    for job, (is_valid, error) in zip(pending_jobs, results):
+        if is_valid:
+            tracker.update(job["text_id"], AlignerJobStatus.SUCCEEDED)
+            if cache is not None and job.get("cache_key"):
+                cache.put(job["cache_key"], job["text_id"])
+        elif now - job["submitted_at"] <= tracker.timeout_secs:
+            # the space creates the TM repo before pushing its files
+            continue
+        elif is_valid is False:
+            tracker.update(
+                job["text_id"], AlignerJobStatus.FAILED, "TM repo is missing files"
+            )
+        else:
+            tracker.update(job["text_id"], AlignerJobStatus.TIMEOUT, error)
+    return tracker.stats()
+
+
+def resubmit_failed(
+    tracker: AlignerJobTracker, max_attempts: int = 3, max_in_flight: int = 4
+) -> Dict[str, str]:
+    """Resubmit the failed and timed out jobs which have attempts left.
+
+    Returns:
+        submission status of each resubmitted text id.
+    """
+    jobs = [
+        job
+        for job in tracker.jobs([AlignerJobStatus.FAILED, AlignerJobStatus.TIMEOUT])
+        if job["attempts"] < max_attempts
+    ]
+    tms_status: Dict[str, str] = {}
+    for aligner in sorted({job["aligner"] for job in jobs}):
+        text_pairs_view_path = {
+            job["text_id"]: {
+                lang_code: Path(view_path)
+                for lang_code, view_path in job["view_path"].items()
+            }
+            for job in jobs
+            if job["aligner"] == aligner
+        }
+        print(f"[INFO] Resubmitting {len(text_pairs_view_path)} {aligner} jobs...")
+        aligner_tms_status = create_TMs(
+            text_pairs_view_path, max_in_flight=max_in_flight, aligner=aligner
+        )
+        tracker.record_submissions(text_pairs_view_path, aligner_tms_status, aligner)
+        tms_status.update(aligner_tms_status)
+    return tms_status
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Track aligner jobs")
+    parser.add_argument("command", choices=["collect", "status", "resubmit"])
+    parser.add_argument("--db", type=Path, default=JOBS_DB_PATH)
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        default=8,
+        help="number of TM repos checked at a time",
+    )
+    parser.add_argument("--max_attempts", type=int, default=3)
+    parser.add_argument("--csv", type=Path, help="write the status table to csv")
+    args = parser.parse_args()
+
+    tracker = AlignerJobTracker(db_path=args.db)
+    if args.command == "collect":
+        collect(tracker, max_concurrency=args.max_concurrency, cache=AlignmentCache())
+    elif args.command == "resubmit":
+        for text_id, status in resubmit_failed(tracker, args.max_attempts).items():
+            print(f"[INFO] TM{text_id}: {status}")
+    for status, count in tracker.stats().items():
+        print(f"{status}: {count}")
+    if args.csv:
+        tracker.to_csv(args.csv)
+        print(f"[INFO] Status table saved to {args.csv}")
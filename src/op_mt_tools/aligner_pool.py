@@ -0,0 +1,186 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from gradio_client import Client
+
+from .huggingface import start_aligner_service
+
+
+class SpaceState:
+    """Load and health of an aligner space."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.client: Optional[Client] = None
+        self.warming = False
+        self.in_flight = 0
+        self.latency = 0.0  # moving average of job start latency in seconds
+        self.failures = 0
+        self.cooldown_until = 0.0
+
+    def is_healthy(self, now: float) -> bool:
+        return self.client is not None and now >= self.cooldown_until
+
+
+class AlignerClientPool:
+    """Pool of aligner space clients routing each job to the least-loaded space.
+
+    Spaces are started in parallel in background threads, and the jobs are routed
+    to the spaces which are ready while the others are still starting. A space
+    failing `max_failures` times in a row is taken out of rotation for
+    `cooldown_secs`, and a space failing to start is started again after
+    `cooldown_secs`.
+
+    Args:
+        space_names: Hugging Face space ids of the aligner.
+        hf_token: Hugging Face token.
+        cooldown_secs: Seconds a failing space is kept out of rotation.
+        max_failures: Consecutive failures before a space is put in cooldown.
+    """
+
+    def __init__(
+        self,
+        space_names: List[str],
+        hf_token: str,
+        cooldown_secs: float = 300,
+        max_failures: int = 3,
+        start_space: Callable[[str], None] = start_aligner_service,
+        client_factory: Callable[..., Client] = Client,
+    ):
+        self.hf_token = hf_token
+        self.cooldown_secs = cooldown_secs
+        self.max_failures = max_failures
+        self._start_space = start_space
+        self._client_factory = client_factory
+        self._spaces: Dict[str, SpaceState] = {
+            name: SpaceState(name) for name in space_names
+        }
+        self._n_warming = 0
+        self._cond = threading.Condition()
+        self._warm_started = False
+
+    def warm(self) -> None:
+        """Start all the spaces in parallel without waiting for them."""
+        with self._cond:
+            if self._warm_started:
+                return
+            self._warm_started = True
+            for space in self._spaces.values():
+                space.warming = True
+            self._n_warming = len(self._spaces)
+        for space in self._spaces.values():
+            threading.Thread(
+                target=self._warm_space, args=(space,), daemon=True
+            ).start()
+
+    def _warm_space(self, space: SpaceState) -> None:
+        try:
+            self._start_space(space.name)
+            client = self._client_factory(space.name, hf_token=self.hf_token)
+        except Exception as e:
+            logging.error(
+                f"Failed to start aligner space {space.name}: {e}, "
+                f"retrying in {self.cooldown_secs}s"
+            )
+            client = None
+        with self._cond:
+            space.client = client
+            space.warming = False
+            if client is None:
+                space.cooldown_until = time.time() + self.cooldown_secs
+            self._n_warming -= 1
+            self._cond.notify_all()
+
+    def _rewarm_spaces(self) -> None:
+        """Start again the spaces which failed to start and are out of cooldown."""
+        now = time.time()
+        for space in self._spaces.values():
+            if space.client is None and not space.warming:
+                if now >= space.cooldown_until:
+                    space.warming = True
+                    self._n_warming += 1
+                    threading.Thread(
+                        target=self._warm_space, args=(space,), daemon=True
+                    ).start()
+
+    def _pick_space(self) -> Optional[SpaceState]:
+        now = time.time()
+        healthy_spaces = [s for s in self._spaces.values() if s.is_healthy(now)]
+        if not healthy_spaces:
+            return None
+        return min(healthy_spaces, key=lambda s: (s.in_flight, s.latency))
+
+    def acquire(self, timeout: Optional[float] = None) -> Client:
+        """Get client of the least-loaded healthy space.
+
+        Every acquired client must be given back with `release`.
+        """
+        self.warm()
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while True:
+                self._rewarm_spaces()
+                space = self._pick_space()
+                if space and space.client:
+                    space.in_flight += 1
+                    return space.client
+
+                started_spaces = [s for s in self._spaces.values() if s.client]
+                if not self._n_warming and not started_spaces:
+                    raise RuntimeError("None of the aligner spaces could be started")
+
+                wait_secs = 5.0
+                cooling_spaces = [s for s in self._spaces.values() if not s.warming]
+                if cooling_spaces:
+                    # all the started spaces, and the ones failed to start, are in
+                    # cooldown
+                    next_cooldown_end = min(s.cooldown_until for s in cooling_spaces)
+                    wait_secs = max(next_cooldown_end - time.time(), 0.1)
+                if deadline is not None:
+                    if time.time() >= deadline:
+                        raise TimeoutError("No aligner space available")
+                    wait_secs = min(wait_secs, deadline - time.time())
+                self._cond.wait(wait_secs)
+
+    def release(
+        self, client: Client, latency: Optional[float] = None, ok: bool = True
+    ) -> None:
+        """Give back `client` with the job start latency and whether the job failed."""
+        with self._cond:
+            space = next((s for s in self._spaces.values() if s.client is client), None)
+            if space is None:
+                return
+            space.in_flight = max(space.in_flight - 1, 0)
+            if ok:
+                space.failures = 0
+                if latency is not None:
+                    space.latency = (
+                        latency
+                        if not space.latency
+                        else 0.8 * space.latency + 0.2 * latency
+                    )
+            else:
+                space.failures += 1
+                if space.failures >= self.max_failures:
+                    logging.warning(
+                        f"Aligner space {space.name} failed {space.failures} times, "
+                        f"cooling down for {self.cooldown_secs}s"
+                    )
+                    space.failures = 0
+                    space.cooldown_until = time.time() + self.cooldown_secs
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, dict]:
+        with self._cond:
+            now = time.time()
+            return {
+                s.name: {
+                    "ready": s.client is not None,
+                    "healthy": s.is_healthy(now),
+                    "in_flight": s.in_flight,
+                    "latency": s.latency,
+                }
+                for s in self._spaces.values()
+            }
@@ -0,0 +1,135 @@
+import hashlib
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from tinydb import Query, TinyDB
+
+from . import config
+from . import types as t
+
+ALIGNMENT_CACHE_PATH = config.DATA_PATH / "alignment_cache"
+
+
+def get_text_pair_hash(
+    text_pair_view_path: t.TEXT_PAIR_VIEW_PATH, aligner_version: str
+) -> str:
+    """SHA-256 of the bo and en view contents and the aligner version."""
+    sha = hashlib.sha256()
+    for lang_code in sorted(text_pair_view_path):
+        sha.update(lang_code.encode())
+        sha.update(Path(text_pair_view_path[lang_code]).read_bytes())
+        sha.update(b"\0")
+    sha.update(aligner_version.encode())
+    return sha.hexdigest()
+
+
+class AlignmentCache:
+    """Cache of text pairs already aligned, keyed by `get_text_pair_hash`.
+
+    Only the TM files of the aligners which produce them locally are stored, for the
+    remote aligner an entry means its TM repo has been confirmed by
+    `aligner_jobs.collect`. Least recently used entries are evicted after
+    `max_entries`. Hits and misses are counted in memory until `flush_stats`.
+
+    Args:
+        path: Path to the cache directory.
+        max_entries: Number of entries to keep.
+    """
+
+    def __init__(self, path: Path = ALIGNMENT_CACHE_PATH, max_entries: int = 5000):
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self._db = TinyDB(self.path / "index.json")
+        self._entries = self._db.table("entries")
+        self._stats = self._db.table("stats")
+        self.query = Query()
+        self.hits = 0
+        self.misses = 0
+
+    def _outputs_path(self, key: str) -> Path:
+        return self.path / key
+
+    def _saved_stats(self) -> Dict[str, int]:
+        stats = self._stats.all()
+        return dict(stats[0]) if stats else {"hits": 0, "misses": 0}
+
+    def lookup(self, key: str, text_id: str) -> Optional[dict]:
+        """Get entry of the same text aligned with the same content."""
+        entry = self._entries.get(
+            (self.query.key == key) & (self.query.text_id == text_id)
+        )
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.update({"last_used_at": time.time()}, self.query.key == key)
+        return dict(entry)
+
+    def put(self, key: str, text_id: str, tm_path: Optional[Path] = None):
+        """Add entry, with the TM files in `tm_path` if provided."""
+        has_outputs = False
+        if tm_path and tm_path.is_dir():
+            outputs_path = self._outputs_path(key)
+            outputs_path.mkdir(exist_ok=True)
+            for tm_fn in tm_path.glob("*.txt"):
+                shutil.copy(tm_fn, outputs_path / tm_fn.name)
+            has_outputs = True
+        entry = {
+            "key": key,
+            "text_id": text_id,
+            "has_outputs": has_outputs,
+            "last_used_at": time.time(),
+        }
+        self._entries.upsert(entry, self.query.key == key)
+        self.evict()
+
+    def restore(self, key: str, tm_path: Path) -> bool:
+        """Copy the stored TM files to `tm_path`."""
+        outputs_path = self._outputs_path(key)
+        if not outputs_path.is_dir():
+            return False
+        tm_path.mkdir(parents=True, exist_ok=True)
+        for tm_fn in outputs_path.glob("*.txt"):
+            shutil.copy(tm_fn, tm_path / tm_fn.name)
+        return True
+
+    def remove(self, key: str):
+        self._entries.remove(self.query.key == key)
+        shutil.rmtree(self._outputs_path(key), ignore_errors=True)
+
+    def evict(self):
+        """Remove least recently used entries over `max_entries`."""
+        entries = self._entries.all()
+        n_to_evict = len(entries) - self.max_entries
+        if n_to_evict <= 0:
+            return
+        entries = sorted(entries, key=lambda entry: entry["last_used_at"])
+        for entry in entries[:n_to_evict]:
+            self.remove(entry["key"])
+
+    def flush_stats(self):
+        """Add hits and misses counted since the last flush to the saved stats."""
+        if not self.hits and not self.misses:
+            return
+        counts = self._saved_stats()
+        counts["hits"] += self.hits
+        counts["misses"] += self.misses
+        self._stats.truncate()
+        self._stats.insert(counts)
+        self.hits = self.misses = 0
+
+    def stats(self) -> Dict[str, float]:
+        """Saved hits and misses, with the ones not flushed yet."""
+        counts = self._saved_stats()
+        counts["hits"] += self.hits
+        counts["misses"] += self.misses
+        total = counts["hits"] + counts["misses"]
+        return {
+            "hits": counts["hits"],
+            "misses": counts["misses"],
+            "hit_rate": counts["hits"] / total if total else 0.0,
+            "entries": len(self._entries),
+        }
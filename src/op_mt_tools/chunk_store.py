@@ -0,0 +1,213 @@
+import sqlite3
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class ChunkStatus:
+    PENDING = "pending"
+    RUNNING = "running"
+    CLEANED = "cleaned"
+    FAILED = "failed"
+
+
+class ChunkStore:
+    """Chunks of a text file and their cleanup results in a single SQLite file.
+
+    Args:
+        db_path: Path to the SQLite db file.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self._create_tables()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(str(self.db_path), timeout=60, isolation_level=None)
+
+    def _create_tables(self):
+        conn = self._connect()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id INTEGER PRIMARY KEY,
+                text TEXT NOT NULL,
+                sents TEXT,
+                cleaned TEXT,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                overlap REAL,
+                started_at REAL,
+                finished_at REAL,
+                duration REAL
+            )
+            """
+        )
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(chunks)")]
+        if "sents" not in columns:
+            # stores created before sentence boundaries were saved
+            conn.execute("ALTER TABLE chunks ADD COLUMN sents TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS chunks_status ON chunks (status)")
+        conn.execute("CREATE INDEX IF NOT EXISTS chunks_overlap ON chunks (overlap)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        conn.close()
+
+    @property
+    def split_completed(self) -> bool:
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT value FROM meta WHERE key = 'split_completed'"
+        ).fetchone()
+        conn.close()
+        return row is not None
+
+    def add_chunks(
+        self, chunks: List[str], chunks_sents: Optional[List[List[str]]] = None
+    ):
+        """Save the chunks of the text, once it's completely split.
+
+        Args:
+            chunks: text of each chunk.
+            chunks_sents: sentences of each chunk, from splitting the text.
+        """
+        if chunks_sents is None:
+            sents_texts: List[Optional[str]] = [None] * len(chunks)
+        else:
+            sents_texts = ["\n".join(sents) for sents in chunks_sents]
+        conn = self._connect()
+        conn.execute("BEGIN")
+        conn.execute("DELETE FROM chunks")
+        conn.executemany(
+            "INSERT INTO chunks (chunk_id, text, sents, status) VALUES (?, ?, ?, ?)",
+            [
+                (chunk_id, chunk, sents_text, ChunkStatus.PENDING)
+                for chunk_id, (chunk, sents_text) in enumerate(
+                    zip(chunks, sents_texts), start=1
+                )
+            ],
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('split_completed', ?)",
+            (str(time.time()),),
+        )
+        conn.execute("COMMIT")
+        conn.close()
+
+    def __len__(self) -> int:
+        conn = self._connect()
+        (n_chunks,) = conn.execute("SELECT COUNT(*) FROM chunks").fetchone()
+        conn.close()
+        return n_chunks
+
+    def get_uncleaned_chunks(self) -> List[Tuple[int, str]]:
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT chunk_id, text FROM chunks WHERE status != ? ORDER BY chunk_id",
+            (ChunkStatus.CLEANED,),
+        ).fetchall()
+        conn.close()
+        return rows
+
+    def get_text(self, chunk_id: int) -> str:
+        conn = self._connect()
+        (text,) = conn.execute(
+            "SELECT text FROM chunks WHERE chunk_id = ?", (chunk_id,)
+        ).fetchone()
+        conn.close()
+        return text
+
+    def get_sents(self, chunk_id: int) -> Optional[List[str]]:
+        """Sentences of the chunk, None if they weren't saved when it was split."""
+        conn = self._connect()
+        (sents_text,) = conn.execute(
+            "SELECT sents FROM chunks WHERE chunk_id = ?", (chunk_id,)
+        ).fetchone()
+        conn.close()
+        if sents_text is None:
+            return None
+        return sents_text.split("\n") if sents_text else []
+
+    def start(self, chunk_id: int):
+        conn = self._connect()
+        conn.execute(
+            "UPDATE chunks SET status = ?, attempts = attempts + 1, started_at = ? "
+            "WHERE chunk_id = ?",
+            (ChunkStatus.RUNNING, time.time(), chunk_id),
+        )
+        conn.close()
+
+    def complete(self, chunk_id: int, cleaned: str, overlap: Optional[float] = None):
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "UPDATE chunks SET status = ?, cleaned = ?, overlap = ?, error = NULL, "
+            "finished_at = ?, duration = ? - started_at WHERE chunk_id = ?",
+            (ChunkStatus.CLEANED, cleaned, overlap, now, now, chunk_id),
+        )
+        conn.close()
+
+    def fail(self, chunk_id: int, error: str):
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "UPDATE chunks SET status = ?, error = ?, finished_at = ?, "
+            "duration = ? - started_at WHERE chunk_id = ?",
+            (ChunkStatus.FAILED, error, now, now, chunk_id),
+        )
+        conn.close()
+
+    def get_cleaned_texts(self) -> List[str]:
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT cleaned FROM chunks WHERE status = ? ORDER BY chunk_id",
+            (ChunkStatus.CLEANED,),
+        ).fetchall()
+        conn.close()
+        return [cleaned for (cleaned,) in rows]
+
+    def find_low_overlap_chunks(self, overlap: float) -> List[int]:
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT chunk_id FROM chunks WHERE overlap < ? ORDER BY chunk_id",
+            (overlap,),
+        ).fetchall()
+        conn.close()
+        return [chunk_id for (chunk_id,) in rows]
+
+    def stats(self) -> Dict[str, int]:
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT status, COUNT(*) FROM chunks GROUP BY status"
+        ).fetchall()
+        conn.close()
+        return dict(rows)
+
+    def import_chunk_files(
+        self,
+        chunks_dir: Path,
+        get_overlap: Optional[Callable[[str, str], float]] = None,
+    ) -> int:
+        """Import chunks saved as `NNNN_chunk.txt` files by the previous versions.
+
+        Args:
+            chunks_dir: dir of the chunk files and their cleaned files.
+            get_overlap: overlap of a cleaned chunk with the chunk, the cleaned
+                chunks are imported without overlap if not provided.
+
+        Returns:
+            number of chunks imported.
+        """
+        chunk_fns = sorted(chunks_dir.glob("*_chunk.txt"))
+        chunks = [fn.read_text(encoding="utf-8") for fn in chunk_fns]
+        self.add_chunks(chunks)
+        for chunk_id, (chunk_fn, chunk) in enumerate(zip(chunk_fns, chunks), start=1):
+            cleaned_fn = chunk_fn.parent / f"{chunk_fn.stem}_cleaned.txt"
+            if cleaned_fn.is_file():
+                cleaned = cleaned_fn.read_text(encoding="utf-8")
+                overlap = get_overlap(chunk, cleaned) if get_overlap else None
+                self.start(chunk_id)
+                self.complete(chunk_id, cleaned, overlap)
+        return len(chunk_fns)
@@ -1,34 +1,48 @@
+import asyncio
+import csv
 import os
 import re
 import time
+from collections import deque
 from collections.abc import Generator
-from concurrent.futures import ProcessPoolExecutor
-from functools import partial
+from functools import lru_cache, partial
 from pathlib import Path
-from typing import List, Tuple
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
 
 import backoff
 import openai
 import tiktoken
 
-from op_mt_tools.tokenizers import en_sent_tokenizer
+from op_mt_tools import config
+from op_mt_tools.chunk_store import ChunkStore
+from op_mt_tools.completion_cache import CompletionCache
+from op_mt_tools.completion_executor import CompletionExecutor
+from op_mt_tools.tokenizers import en_sent_tokenizer, join_sentences
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = "gpt-3.5-turbo-0301"
 CONTEXT_LENGTH = 4096
 CHUNK_MAX_TOKENS = 500  # smaller chunks give better result
+CHUNK_STORES_PATH = config.DATA_PATH / "chunk_stores"
+CLEANED_FILE_PREFIX = "[CLEANED]"
 
 # types
 STR_WITH_SENT_PER_LINE = str
 
 
-def num_tokens_from_messages(text, model=OPENAI_MODEL):
-    """Returns the number of tokens used by a list of messages."""
+@lru_cache(maxsize=None)
+def get_encoding(model=OPENAI_MODEL) -> tiktoken.Encoding:
+    """Returns the tokenizer of the model, loaded only once per model."""
     try:
-        encoding = tiktoken.encoding_for_model(model)
+        return tiktoken.encoding_for_model(model)
     except KeyError:
         print("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def num_tokens_from_messages(text, model=OPENAI_MODEL):
+    """Returns the number of tokens used by a list of messages."""
+    encoding = get_encoding(model)
 
     if model == "gpt-3.5-turbo":
         print(
@@ -72,30 +86,152 @@ Input Text:
 <{}>
 """
 
+# sent again for chunks whose cleaned text is much shorter than the chunk
+STRICT_CLEANUP_PROMPT = """
+Act as a text-cleaning pipeline. Strictly follow the cleaning steps below. Your input text is delimited by <>.
 
-def split_document(document: str, chunk_max_tokens=CHUNK_MAX_TOKENS) -> List[str]:
-    """Splits a document into chunks of text that are less than max_tokens long."""
+Cleaning Steps:
+1 - remove extra spaces.
+2 - remove only brackets and numbers.
+3 - fix spelling errors.
+4 - split text into sentences.
+5 - join sentence which are split over multiple lines.
+
+Keep every sentence of the input text, do not summarize, shorten or skip any part of it.
+Output each sentence on a new line.
+Do not report your steps and progress.
+
+Input Text:
+<{}>
+"""
+
+
+class ChunkProfile:
+    QUALITY = "quality"
+    THROUGHPUT = "throughput"
+
+
+# fraction of the context window taken by the prompt and the cleaned chunk,
+# smaller chunks give better result and bigger ones need fewer requests
+CHUNK_PROFILES_CONTEXT_FRACTION = {
+    ChunkProfile.QUALITY: 0.3,
+    ChunkProfile.THROUGHPUT: 0.9,
+}
+OUTPUT_TOKENS_RATIO = 1.1  # cleaned chunk is about as long as the chunk
+
+MIN_CHUNK_OVERLAP = 0.8  # cleaned chunks shorter than this are cleaned up again
+MAX_CHUNK_ATTEMPTS = 3
+
+
+def group_sentences(
+    sents: List[str], chunk_max_tokens=CHUNK_MAX_TOKENS
+) -> List[List[str]]:
+    """Groups consecutive sentences into chunks of less than max_tokens.
+
+    Each sentence is encoded once, as it is when starting a chunk and as it is when
+    appended to a chunk after the separating space, and the chunk size is tracked as
+    a running total of these counts.
+    """
+    encoding = get_encoding()
+    tokens_per_message = num_tokens_from_messages("")
+
+    def num_tokens(text: str) -> int:
+        return len(encoding.encode(text))
 
     chunks = []
-    current_chunk = []
-    sents = en_sent_tokenizer(document).splitlines()
+    current_chunk: List[str] = []
+    current_chunk_tokens = 0
     for sentence in sents:
-        current_chunk.append(sentence)
-        # Check if the current chunk has more tokens than the limit
-        tokens = num_tokens_from_messages(" ".join(current_chunk))
-        if tokens > chunk_max_tokens:
-            # If it exceeds the limit, remove the last added sentence and store the chunk
-            current_chunk.pop()
-            chunks.append(" ".join(current_chunk))
+        if current_chunk:
+            sentence_tokens = num_tokens(" " + sentence)
+        else:
+            sentence_tokens = num_tokens(sentence)
+        # Check if the current chunk would have more tokens than the limit
+        if (
+            current_chunk_tokens + sentence_tokens + tokens_per_message
+            > chunk_max_tokens
+        ):
+            # If it exceeds the limit, store the chunk without the sentence,
+            # a sentence over the limit at the start of the document gives an empty chunk
+            chunks.append(current_chunk)
             current_chunk = [sentence]
+            current_chunk_tokens = num_tokens(sentence)
+        else:
+            current_chunk.append(sentence)
+            current_chunk_tokens += sentence_tokens
 
     # Add the last chunk if it's not empty
     if current_chunk:
-        chunks.append(" ".join(current_chunk))
+        chunks.append(current_chunk)
 
     return chunks
 
 
+def chunk_sentences(sents: List[str], chunk_max_tokens=CHUNK_MAX_TOKENS) -> List[str]:
+    """Joins consecutive sentences into chunks of less than max_tokens."""
+    return [" ".join(group) for group in group_sentences(sents, chunk_max_tokens)]
+
+
+def split_document_sents(
+    document: str, chunk_max_tokens=CHUNK_MAX_TOKENS
+) -> List[List[str]]:
+    """Splits a document into sentences grouped by chunks of less than max_tokens."""
+    sents = en_sent_tokenizer(document).splitlines()
+    return group_sentences(sents, chunk_max_tokens)
+
+
+def split_document(document: str, chunk_max_tokens=CHUNK_MAX_TOKENS) -> List[str]:
+    """Splits a document into chunks of text that are less than max_tokens long."""
+    return [
+        " ".join(group) for group in split_document_sents(document, chunk_max_tokens)
+    ]
+
+
+def get_chunk_max_tokens(
+    context_fraction: float,
+    context_length: int = CONTEXT_LENGTH,
+    prompt_template: str = CLEANUP_PROMPT,
+) -> int:
+    """Max tokens of a chunk, so that its prompt and its cleaned text take
+    `context_fraction` of the context window.
+    """
+    prompt_tokens = num_tokens_from_messages(prompt_template.format("").strip())
+    budget = context_fraction * context_length - prompt_tokens
+    return max(1, int(budget / (1 + OUTPUT_TOKENS_RATIO)))
+
+
+def get_profile_chunk_max_tokens(profile: str = ChunkProfile.QUALITY) -> int:
+    return get_chunk_max_tokens(CHUNK_PROFILES_CONTEXT_FRACTION[profile])
+
+
+def get_chunks_stats(chunks: List[str]) -> Dict[str, int]:
+    """Number of requests and prompt tokens needed to clean up the chunks."""
+    return {
+        "requests": len(chunks),
+        "prompt_tokens": sum(
+            num_tokens_from_messages(get_cleanup_prompt(chunk)) for chunk in chunks
+        ),
+    }
+
+
+def plan_chunks(documents: List[str]) -> Dict[str, Dict[str, int]]:
+    """Number of requests and prompt tokens needed by each chunk profile.
+
+    Documents are split into sentences only once for all the profiles.
+    """
+    docs_sents = [en_sent_tokenizer(document).splitlines() for document in documents]
+    plan = {}
+    for profile in CHUNK_PROFILES_CONTEXT_FRACTION:
+        chunk_max_tokens = get_profile_chunk_max_tokens(profile)
+        chunks = [
+            chunk
+            for sents in docs_sents
+            for chunk in chunk_sentences(sents, chunk_max_tokens)
+        ]
+        plan[profile] = get_chunks_stats(chunks)
+    return plan
+
+
 @backoff.on_exception(backoff.expo, openai.OpenAIError)
 def get_completion(prompt: str, model=OPENAI_MODEL) -> str:
     messages = [{"role": "user", "content": prompt}]
@@ -108,109 +244,449 @@ def get_completion(prompt: str, model=OPENAI_MODEL) -> str:
     return response.choices[0].message["content"]
 
 
-def get_cleaned_sents(text: str, prompt_template=CLEANUP_PROMPT) -> List[str]:
-    def parser_response(response: STR_WITH_SENT_PER_LINE) -> List[str]:
-        return [sent.strip() for sent in response.splitlines() if sent]
+async def get_completion_async(
+    prompt: str, model=OPENAI_MODEL, api_base: Optional[str] = None
+) -> str:
+    messages = [{"role": "user", "content": prompt}]
+    response = await openai.ChatCompletion.acreate(
+        model=model,
+        messages=messages,
+        temperature=0,
+        api_base=api_base,
+    )
+    return response.choices[0].message["content"]
 
-    prompt = prompt_template.format(text).strip()
+
+def get_cleanup_executor(
+    max_in_flight: int = 16,
+    requests_per_minute: float = 3500,
+    tokens_per_minute: float = 90000,
+    api_base: Optional[str] = None,
+    cache: Optional[CompletionCache] = None,
+    completion_fn: Optional[Callable[[str], Awaitable[str]]] = None,
+) -> CompletionExecutor:
+    """Executor of cleanup requests.
+
+    `api_base` can point to a local fake server, and `completion_fn` replaces the
+    OpenAI API, eg: with `fake_completion.FakeCompletionBackend` to run offline.
+    """
+    if completion_fn is None:
+        completion_fn = partial(get_completion_async, api_base=api_base)
+    return CompletionExecutor(
+        completion_fn=completion_fn,
+        cache=cache,
+        model=OPENAI_MODEL,
+        temperature=0,
+        max_in_flight=max_in_flight,
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute,
+        # cleaned text is about as long as the input text
+        estimate_tokens=lambda prompt: 2 * num_tokens_from_messages(prompt),
+    )
+
+
+def parse_response(response: STR_WITH_SENT_PER_LINE) -> List[str]:
+    return [sent.strip() for sent in response.splitlines() if sent]
+
+
+def get_cleanup_prompt(text: str, prompt_template=CLEANUP_PROMPT) -> str:
+    return prompt_template.format(text).strip()
+
+
+def get_cleaned_sents(text: str, prompt_template=CLEANUP_PROMPT) -> List[str]:
+    prompt = get_cleanup_prompt(text, prompt_template)
     response = get_completion(prompt)
-    sents = parser_response(response)
+    sents = parse_response(response)
     return sents
 
 
+CHUNK = Tuple[int, int, str]  # chunk id, number of chunks and chunk text
+
+
+def get_text_fns(
+    text_dir: Path, cleaned_file_prefix: str = CLEANED_FILE_PREFIX
+) -> List[Path]:
+    """Text files of the text to clean up, without its cleaned files."""
+    return sorted(
+        fn
+        for fn in text_dir.glob("*.txt")
+        if not fn.name.startswith(f"{cleaned_file_prefix}_")
+    )
+
+
+def get_chunk_store(fn: Path, stores_path: Path = CHUNK_STORES_PATH) -> ChunkStore:
+    """Chunk store of a text file, with the chunks saved by the previous versions.
+
+    Each text file has its own store, kept out of the text repo so that it isn't
+    committed with the cleaned text. Chunk files of a text split by the previous
+    versions are imported on the first use of the store of its text file, so that
+    its cleaned chunks are kept and checked for overlap.
+    """
+    text_dir = fn.parent
+    db_path = stores_path / text_dir.name / f"{fn.stem}.sqlite"
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    store = ChunkStore(db_path)
+    legacy_chunks_dir = text_dir / "chunks"
+    if (
+        not store.split_completed
+        and (legacy_chunks_dir / "split_completed").is_file()
+        # chunk files of the previous versions don't say which file they are of
+        and get_text_fns(text_dir) == [fn]
+    ):
+        store.import_chunk_files(legacy_chunks_dir, get_overlap)
+    return store
+
+
 def get_chunks(
-    text: str, chunks_dir: Path
-) -> Generator[Tuple[int, int, str], None, None]:
-    chunks_dir.mkdir(exist_ok=True)
-    chunks_dir = chunks_dir.resolve()
-    split_completed_marker = chunks_dir / "split_completed"
-    if split_completed_marker.is_file():
-        chunks_fns = sorted(chunks_dir.glob("*_chunk.txt"))
-        for chunk_fn in chunks_fns:
-            chunk_cleaned_file = chunk_fn.parent / f"{chunk_fn.stem}_cleaned.txt"
-            if not chunk_cleaned_file.is_file():
-                chunk_id = int(chunk_fn.stem.split("_")[0])
-                yield chunk_id, len(chunks_fns), str(chunk_fn)
-    else:
-        chunks = split_document(text)
-        for chunk_id, chunk in enumerate(chunks, start=1):
-            chunk_fn = chunks_dir / f"{chunk_id:04}_chunk.txt"
-            chunk_fn.write_text(chunk, encoding="utf-8")
-            yield chunk_id, len(chunks), str(chunk_fn)
-        split_completed_marker.touch()
+    text: str, store: ChunkStore, chunk_max_tokens: int = CHUNK_MAX_TOKENS
+) -> Generator[CHUNK, None, None]:
+    """Get chunks of text left to clean up, splitting the text on the first run.
+
+    Text is split only once, later runs keep the chunks of the first run.
+    """
+    if not store.split_completed:
+        chunks_sents = split_document_sents(text, chunk_max_tokens)
+        chunks = [" ".join(sents) for sents in chunks_sents]
+        store.add_chunks(chunks, chunks_sents)
+    n_chunks = len(store)
+    for chunk_id, chunk_text in store.get_uncleaned_chunks():
+        yield chunk_id, n_chunks, chunk_text
 
 
-def combine_chunks(chunks_dir: Path, output_fn: Path):
+def combine_chunks(store: ChunkStore, output_fn: Path):
     text = ""
-    for chunk_fn in sorted(chunks_dir.glob("*_chunk_cleaned.txt")):
-        text += chunk_fn.read_text() + "\n"
+    for cleaned_text in store.get_cleaned_texts():
+        text += cleaned_text + "\n"
     output_fn.write_text(text)
 
 
-def cleanup_en_chunk(chunk: Tuple[int, int, str], chunks_dir: Path) -> None:
-    chunk_id, chunks_len, chunk_fn = chunk
+def get_overlap(chunk: str, chunk_cleaned: str) -> float:
+    """Char count overlap of cleaned chunk with the original chunk."""
+
+    def make_comparable(text: str) -> str:
+        text = re.sub(r"\s{2,}", "", text)
+        text = re.sub(r"\n", "", text)
+        return text
+
+    chunk_len = len(make_comparable(chunk))
+    if not chunk_len:
+        return 1.0
+    return len(make_comparable(chunk_cleaned)) / chunk_len
+
+
+def get_cleanup_parts(
+    chunk_text: str, attempt: int, sents: Optional[List[str]] = None
+) -> Tuple[str, List[str]]:
+    """Prompt template and parts of the chunk to clean up on the `attempt`.
+
+    The first attempt sends the whole chunk with the default prompt, the second one
+    with the strict prompt, and the next ones split the chunk into halves, quarters,
+    etc. which are sent with the strict prompt. The chunk is only split into
+    sentences again if its `sents` weren't saved.
+    """
+    if attempt <= 1:
+        return CLEANUP_PROMPT, [chunk_text]
+    if attempt == 2:
+        return STRICT_CLEANUP_PROMPT, [chunk_text]
+    if sents is None:
+        sents = en_sent_tokenizer(chunk_text).splitlines()
+    chunk_max_tokens = num_tokens_from_messages(chunk_text) // 2 ** (attempt - 2)
+    parts = [part for part in chunk_sentences(sents, chunk_max_tokens) if part]
+    return STRICT_CLEANUP_PROMPT, parts if parts else [chunk_text]
+
+
+async def cleanup_en_chunk(
+    chunk: CHUNK,
+    store: ChunkStore,
+    executor: CompletionExecutor,
+    attempt: int = 1,
+    min_overlap: float = MIN_CHUNK_OVERLAP,
+) -> float:
+    """Clean up the chunk and save it in the store.
+
+    Completions of a cleaned chunk below `min_overlap` are removed from the cache
+    of `executor`, so that a later run requests them again instead of replaying
+    the same failure.
+
+    Returns:
+        overlap of the cleaned chunk with the chunk.
+    """
+    chunk_id, chunks_len, chunk_text = chunk
     start = time.time()
-    print(f"\t- cleaning chunk {chunk_id}/{chunks_len} ...", end="")
-    chunk_text = open(chunk_fn).read()
-    sents = get_cleaned_sents(chunk_text)
-    chunk_cleaned_fn = chunks_dir / f"{chunk_id:04}_chunk_cleaned.txt"
-    chunk_cleaned_fn.write_text("\n".join(sents), encoding="utf-8")
+    store.start(chunk_id)
+    sents = store.get_sents(chunk_id) if attempt > 2 else None
+    prompt_template, parts = get_cleanup_parts(chunk_text, attempt, sents)
+    prompts = [get_cleanup_prompt(part, prompt_template) for part in parts]
+    try:
+        responses = await asyncio.gather(
+            *(executor.complete(prompt) for prompt in prompts)
+        )
+    except Exception as e:
+        store.fail(chunk_id, str(e))
+        raise
+    cleaned_text = "\n".join(
+        sent for response in responses for sent in parse_response(response)
+    )
+    overlap = get_overlap(chunk_text, cleaned_text)
+    if overlap < min_overlap:
+        for prompt in prompts:
+            executor.invalidate(prompt)
+    store.complete(chunk_id, cleaned_text, overlap)
     end = time.time()
     delta = end - start
-    print(f" {delta:.3f}s")
+    print(f"\t- cleaned chunk {chunk_id}/{chunks_len} {delta:.3f}s")
+    return overlap
 
 
 def cleanup_en(
-    fn: Path, cleaned_file_prefix: str = "[CLEANED]", verbose: bool = False
+    fn: Path,
+    cleaned_file_prefix: str = CLEANED_FILE_PREFIX,
+    verbose: bool = False,
+    executor: Optional[CompletionExecutor] = None,
+    chunk_stores_path: Path = CHUNK_STORES_PATH,
 ) -> Path:
-    """Clean up english text using GPT-3."""
-    chunks_dir = fn.parent / "chunks"
-    cleaned_fn = fn.parent / f"{cleaned_file_prefix}_{fn.stem}.txt"
-    text = fn.read_text(encoding="utf-8")
-    doc_chunks = list(get_chunks(text, chunks_dir=chunks_dir))
-    cleanup_en_chunk_dir_set = partial(cleanup_en_chunk, chunks_dir=chunks_dir)
-    with ProcessPoolExecutor() as pool:
-        _ = list(pool.map(cleanup_en_chunk_dir_set, doc_chunks))
-    combine_chunks(chunks_dir, cleaned_fn)
-    return cleaned_fn
-
-
-def find_failed_cleanup_chunks(text_path: Path, overlap: float = 0.8) -> List[int]:
-    """Find chunks that failed to clean up based on char count overlap
+    """Clean up english text using GPT-3.
+
+    Chunks are sent concurrently by `executor`, within the OpenAI rate limits.
+    """
+    executor = executor if executor else get_cleanup_executor()
+    scheduler = CleanupScheduler(
+        executor,
+        cleaned_file_prefix=cleaned_file_prefix,
+        chunk_stores_path=chunk_stores_path,
+    )
+    scheduler.add_text(fn.parent.name, [fn])
+    failures = scheduler.run()[fn.parent.name]
+    if failures:
+        # cleaned chunks are kept, so that the next run only resends the failed ones
+        failed_chunk_ids = [failure["chunk_id"] for failure in failures]
+        raise RuntimeError(f"Failed to clean up chunks {failed_chunk_ids} of {fn}")
+    return scheduler.texts[0].cleaned_fns[0]
+
+
+class TextCleanup:
+    """Chunks of the files of a text left to clean up."""
+
+    def __init__(
+        self,
+        text_id: str,
+        fns: List[Path],
+        cleaned_file_prefix: str,
+        chunk_max_tokens: int = CHUNK_MAX_TOKENS,
+        chunk_stores_path: Path = CHUNK_STORES_PATH,
+    ):
+        self.text_id = text_id
+        self.cleaned_fns: List[Path] = []
+        # chunks with their store and cleanup attempt
+        self.pending: Deque[Tuple[CHUNK, ChunkStore, int]] = deque()
+        self.stores: List[ChunkStore] = []
+        for fn in fns:
+            store = get_chunk_store(fn, chunk_stores_path)
+            text = fn.read_text(encoding="utf-8")
+            for chunk in get_chunks(text, store, chunk_max_tokens):
+                self.pending.append((chunk, store, 1))
+            self.stores.append(store)
+            self.cleaned_fns.append(fn.parent / f"{cleaned_file_prefix}_{fn.stem}.txt")
+        self.n_unfinished = len(self.pending)
+        self.failures: List[dict] = []
+
+
+class CleanupScheduler:
+    """Cleans up chunks of many texts with a single executor.
+
+    Chunks of the text closest to completion are sent first, and each text is
+    combined, and passed to `on_text_cleaned`, as soon as its last chunk is cleaned.
+
+    Overlap of each cleaned chunk is checked as soon as it's cleaned, chunks below
+    `min_overlap` are requeued with a stricter prompt, then split into smaller parts,
+    until `max_attempts`. Texts with failed chunks are not combined.
 
     Args:
-        fn (Path): path to text_path
-        overlap (float, optional): [description]. Defaults to 0.8.
+        executor: executor shared by all the texts.
+        on_text_cleaned: called with text id and its cleaned files, eg: to push them.
+        cleaned_file_prefix: prefix of the cleaned file names.
+        min_overlap: char count overlap of the cleaned chunk with the chunk.
+        max_attempts: number of times a chunk is cleaned up before it's failed.
+        chunk_max_tokens: max tokens of the chunks of the texts not split yet.
+        chunk_stores_path: directory of the chunk stores of the text files.
     """
 
-    def make_comparable(text: str) -> str:
-        text = re.sub(r"\s{2,}", "", text)
-        text = re.sub(r"\n", "", text)
-        return text
+    def __init__(
+        self,
+        executor: CompletionExecutor,
+        on_text_cleaned: Optional[Callable[[str, List[Path]], None]] = None,
+        cleaned_file_prefix: str = CLEANED_FILE_PREFIX,
+        min_overlap: float = MIN_CHUNK_OVERLAP,
+        max_attempts: int = MAX_CHUNK_ATTEMPTS,
+        chunk_max_tokens: int = CHUNK_MAX_TOKENS,
+        chunk_stores_path: Path = CHUNK_STORES_PATH,
+    ):
+        self.executor = executor
+        self.on_text_cleaned = on_text_cleaned
+        self.cleaned_file_prefix = cleaned_file_prefix
+        self.min_overlap = min_overlap
+        self.max_attempts = max_attempts
+        self.chunk_max_tokens = chunk_max_tokens
+        self.chunk_stores_path = chunk_stores_path
+        self.texts: List[TextCleanup] = []
+
+    def add_text(self, text_id: str, fns: List[Path]):
+        self.texts.append(
+            TextCleanup(
+                text_id,
+                fns,
+                self.cleaned_file_prefix,
+                self.chunk_max_tokens,
+                self.chunk_stores_path,
+            )
+        )
+
+    def get_pending_chunks_stats(self) -> Dict[str, int]:
+        """Number of requests and prompt tokens of the chunks left to clean up."""
+        return get_chunks_stats(
+            [chunk[2] for text in self.texts for chunk, _, _ in text.pending]
+        )
+
+    def _next_chunk(self) -> Optional[Tuple[TextCleanup, CHUNK, ChunkStore, int]]:
+        texts = [text for text in self.texts if text.pending]
+        if not texts:
+            return None
+        text = min(texts, key=lambda text: text.n_unfinished)
+        chunk, store, attempt = text.pending.popleft()
+        return text, chunk, store, attempt
+
+    def _fail_chunk(
+        self,
+        text: TextCleanup,
+        chunk: CHUNK,
+        store: ChunkStore,
+        attempt: int,
+        error: str,
+        overlap: Optional[float] = None,
+    ):
+        print(f"[ERROR] {text.text_id} chunk {chunk[0]} failed: {error}")
+        # chunks which raised are already failed by `cleanup_en_chunk`
+        if overlap is not None:
+            store.fail(chunk[0], error)
+        text.failures.append(
+            {
+                "text_id": text.text_id,
+                "chunk_id": chunk[0],
+                "attempts": attempt,
+                "overlap": overlap,
+                "error": error,
+            }
+        )
 
-    chunks_dir = text_path / "chunks"
-    chunks_fns = sorted(chunks_dir.glob("*_chunk.txt"))
-    failed_chunks = []
-    for chunk_fn in chunks_fns:
-        chunk_cleaned_fn = chunks_dir / f"{chunk_fn.stem}_cleaned.txt"
-        if chunk_cleaned_fn.is_file():
-            chunk = chunk_fn.read_text(encoding="utf-8")
-            chunk_cleaned = chunk_cleaned_fn.read_text(encoding="utf-8")
-            chunk_overlap = len(make_comparable(chunk_cleaned)) / len(
-                make_comparable(chunk)
+    async def _finish_text(self, text: TextCleanup):
+        if text.failures:
+            failed_chunk_ids = sorted(failure["chunk_id"] for failure in text.failures)
+            print(
+                f"[ERROR] {text.text_id} not combined, chunks {failed_chunk_ids} failed"
             )
-            if chunk_overlap < overlap:
-                chunk_id = int(chunk_fn.stem.split("_")[0])
-                failed_chunks.append(chunk_id)
+            return
+        for store, cleaned_fn in zip(text.stores, text.cleaned_fns):
+            combine_chunks(store, cleaned_fn)
+        print(f"[INFO] {text.text_id} cleaned")
+        if self.on_text_cleaned:
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(
+                    None, self.on_text_cleaned, text.text_id, text.cleaned_fns
+                )
+            except Exception as e:
+                print(f"[ERROR] {text.text_id} cleaned but not published: {e}")
+
+    async def _worker(self):
+        while True:
+            next_chunk = self._next_chunk()
+            if next_chunk is None:
+                return
+            text, chunk, store, attempt = next_chunk
+            try:
+                overlap = await cleanup_en_chunk(
+                    chunk, store, self.executor, attempt, self.min_overlap
+                )
+            except Exception as e:
+                self._fail_chunk(text, chunk, store, attempt, str(e))
+            else:
+                if overlap < self.min_overlap:
+                    if attempt < self.max_attempts:
+                        print(
+                            f"[WARNING] {text.text_id} chunk {chunk[0]} overlap "
+                            f"{overlap:.2f}, retrying ..."
+                        )
+                        # retried first, so that the text is finished soon
+                        text.pending.appendleft((chunk, store, attempt + 1))
+                        continue
+                    error = f"overlap {overlap:.2f} below {self.min_overlap}"
+                    self._fail_chunk(text, chunk, store, attempt, error, overlap)
+            text.n_unfinished -= 1
+            if text.n_unfinished == 0:
+                await self._finish_text(text)
+
+    async def run_async(self) -> Dict[str, List[dict]]:
+        # texts which were cleaned up in a previous run only need to be combined
+        for text in self.texts:
+            if not text.n_unfinished:
+                await self._finish_text(text)
+        await asyncio.gather(
+            *(self._worker() for _ in range(self.executor.max_in_flight))
+        )
+        return {text.text_id: text.failures for text in self.texts}
+
+    def run(self) -> Dict[str, List[dict]]:
+        """Clean up all the texts.
+
+        Returns:
+            failure report of each text, with id, attempts, overlap and error of
+            each failed chunk.
+        """
+        return asyncio.run(self.run_async())
 
-    return failed_chunks
 
+def write_failure_report(report: Dict[str, List[dict]], csv_path: Path):
+    """Save failed chunks of all the texts returned by `CleanupScheduler.run`."""
+    fields = ["text_id", "chunk_id", "attempts", "overlap", "error"]
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for text_id in sorted(report):
+            writer.writerows(report[text_id])
 
-def split_chunk_into_sentence(text_path: Path) -> None:
-    chunks_dir = text_path / "chunks"
-    chunks_fns = sorted(chunks_dir.glob("*_chunk.txt"))
-    for chunk_fn in chunks_fns:
-        text = chunk_fn.read_text(encoding="utf-8")
-        sents_text = en_sent_tokenizer(text)
-        chunk_sents_fn = chunks_dir / f"{chunk_fn.stem}_sents.txt"
-        chunk_sents_fn.write_text(sents_text, encoding="utf-8")
+
+def find_failed_cleanup_chunks(
+    text_path: Path, overlap: float = 0.8, chunk_stores_path: Path = CHUNK_STORES_PATH
+) -> Dict[str, List[int]]:
+    """Find chunks that failed to clean up based on char count overlap
+
+    Args:
+        text_path (Path): path to the text dir
+        overlap (float, optional): [description]. Defaults to 0.8.
+
+    Returns:
+        failed chunk ids of each text file, by file name.
+    """
+    return {
+        fn.name: get_chunk_store(fn, chunk_stores_path).find_low_overlap_chunks(overlap)
+        for fn in get_text_fns(text_path)
+    }
+
+
+def split_chunk_into_sentence(
+    text_path: Path, chunk_stores_path: Path = CHUNK_STORES_PATH
+) -> None:
+    for fn in get_text_fns(text_path):
+        store = get_chunk_store(fn, chunk_stores_path)
+        chunks_dir = text_path / "chunks" / fn.stem
+        chunks_dir.mkdir(parents=True, exist_ok=True)
+        for chunk_id in range(1, len(store) + 1):
+            # sentences from splitting the text, chunks imported from the chunk files
+            # of the previous versions don't have them
+            sents = store.get_sents(chunk_id)
+            if sents is None:
+                sents_text = en_sent_tokenizer(store.get_text(chunk_id))
+            else:
+                sents_text = join_sentences(sents)
+            chunk_sents_fn = chunks_dir / f"{chunk_id:04}_chunk_sents.txt"
+            chunk_sents_fn.write_text(sents_text, encoding="utf-8")
@@ -1,7 +1,12 @@
 import os
 from pathlib import Path
 
-from op_mt_tools.pipelines import add_text_pair_to_collection_pipeline
+from op_mt_tools.pipelines import (
+    add_text_pair_to_collection_pipeline,
+    add_text_pair_to_collection_worker,
+)
+from op_mt_tools.tm import AlignersEnum
+from op_mt_tools.work_queue import WorkQueue
 
 if __name__ == "__main__":
     import argparse
@@ -27,13 +32,46 @@ if __name__ == "__main__":
         action="store_true",
         help="whether to use gpt cleaned text",
     )
+    parser.add_argument(
+        "--keep_order",
+        action="store_true",
+        help="process text pairs in the given order instead of largest first",
+    )
+    parser.add_argument(
+        "--full_scan",
+        action="store_true",
+        help="check every text pair in the TRACKER instead of only the new ones",
+    )
+    parser.add_argument(
+        "--aligner",
+        choices=[AlignersEnum.REMOTE, AlignersEnum.REMOTE_INLINE, AlignersEnum.LOCAL],
+        default=AlignersEnum.REMOTE,
+        help="align on the hugging face space or on this machine, "
+        "remote-inline sends the views in the request instead of their github urls",
+    )
+    parser.add_argument(
+        "--queue_db",
+        type=Path,
+        help="pull text ids from the `text_pairs` work queue in this db",
+    )
     args = parser.parse_args()
 
-    add_text_pair_to_collection_pipeline(
-        collection_path=Path(args.collection_path),
-        should_create_TM=False if args.skip_create_TM else True,
-        text_ids=args.text_ids,
-    )
+    if args.queue_db:
+        add_text_pair_to_collection_worker(
+            collection_path=Path(args.collection_path),
+            queue=WorkQueue(db_path=args.queue_db, name="text_pairs"),
+            should_create_TM=False if args.skip_create_TM else True,
+            aligner=args.aligner,
+        )
+    else:
+        add_text_pair_to_collection_pipeline(
+            collection_path=Path(args.collection_path),
+            should_create_TM=False if args.skip_create_TM else True,
+            text_ids=args.text_ids,
+            schedule_by_size=not args.keep_order,
+            incremental=not args.full_scan,
+            aligner=args.aligner,
+        )
 
     # for gradio_client threading
     os._exit(0)
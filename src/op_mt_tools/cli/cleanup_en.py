@@ -1,12 +1,22 @@
 import argparse
 import os
+from pathlib import Path
 
 from op_mt_tools import config
 from op_mt_tools.cleanup import (
-    cleanup_en,
+    CHUNK_PROFILES_CONTEXT_FRACTION,
+    ChunkProfile,
+    CleanupScheduler,
     find_failed_cleanup_chunks,
+    get_chunk_store,
+    get_cleanup_executor,
+    get_profile_chunk_max_tokens,
+    get_text_fns,
+    plan_chunks,
     split_chunk_into_sentence,
+    write_failure_report,
 )
+from op_mt_tools.completion_cache import CompletionCache
 from op_mt_tools.github_utils import clone_or_pull_repo, commit_and_push
 
 GITHUB_ORG = os.environ["MAI_GITHUB_ORG"]
@@ -23,6 +33,29 @@ def run_batch_cleanup(args):
             ]
         )
 
+    executor = get_cleanup_executor(
+        max_in_flight=args.max_in_flight,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm,
+        api_base=args.api_base,
+        cache=None if args.no_cache else CompletionCache(),
+    )
+
+    def push_text(text_id, cleaned_fns):
+        print(f"[INFO] Cleaned text is saved at {cleaned_fns} ...")
+        if not args.skip_push:
+            print(f"[INFO] Committing and pushing {text_id} ...")
+            commit_and_push(config.TEXTS_PATH / text_id, msg="auto cleanup")
+
+    # chunks of all the texts are cleaned up by a single scheduler, so that the
+    # API isn't idle while the last chunks of a text are being cleaned
+    scheduler = CleanupScheduler(
+        executor,
+        on_text_cleaned=push_text,
+        min_overlap=args.min_overlap,
+        max_attempts=args.max_attempts,
+        chunk_max_tokens=get_profile_chunk_max_tokens(args.chunk_profile),
+    )
     for text_id in args.text_ids:
         text_dir = config.TEXTS_PATH / text_id
 
@@ -35,24 +68,63 @@ def run_batch_cleanup(args):
             print(f"[INFO] {text_id} already cleaned. Skipping ...")
             continue
 
-        print(f"[INFO] Cleaning {text_id} ...")
-        for i, text_fn in enumerate(text_dir.glob("*.txt")):
-            cleaned_fn = cleanup_en(text_fn, verbose=args.verbose)
-            print(f"[INFO] Cleaned text is saved at {cleaned_fn} ...")
+        print(f"[INFO] Splitting {text_id} into chunks ...")
+        scheduler.add_text(text_id, get_text_fns(text_dir))
 
-        if not args.skip_push:
-            print(f"[INFO] Committing and pushing {text_id} ...")
-            commit_and_push(text_dir, msg="auto cleanup")
+    chunks_stats = scheduler.get_pending_chunks_stats()
+    print(
+        f"[INFO] Cleaning {len(scheduler.texts)} texts with {args.chunk_profile} "
+        f"profile: {chunks_stats['requests']} requests, "
+        f"{chunks_stats['prompt_tokens']} prompt tokens ..."
+    )
+    report = scheduler.run()
+    failed_text_ids = [text_id for text_id, failures in report.items() if failures]
+    print(
+        f"[INFO] {len(report) - len(failed_text_ids)} texts cleaned, "
+        f"{len(failed_text_ids)} failed: {failed_text_ids}"
+    )
+    for text_id in failed_text_ids:
+        for failure in report[text_id]:
+            print(
+                f"\t- {text_id} chunk {failure['chunk_id']} "
+                f"after {failure['attempts']} attempts: {failure['error']}"
+            )
+    if args.failure_report:
+        write_failure_report(report, args.failure_report)
+        print(f"[INFO] Failure report saved to {args.failure_report}")
+    if executor.cache:
+        cache_stats = executor.cache.stats()
+        print(
+            f"[INFO] Completion cache: {cache_stats['hit_rate']:.2%} hit rate "
+            f"({cache_stats['hits']} hits, {cache_stats['misses']} misses), "
+            f"{cache_stats['entries']} completions, {cache_stats['size_mb']:.1f} MB"
+        )
+
+
+def run_plan_chunks(args):
+    documents = []
+    for text_id in args.text_ids:
+        text_dir = config.TEXTS_PATH / text_id
+        for fn in get_text_fns(text_dir):
+            documents.append(fn.read_text(encoding="utf-8"))
+    for profile, stats in plan_chunks(documents).items():
+        print(
+            f"{profile}: {stats['requests']} requests, "
+            f"{stats['prompt_tokens']} prompt tokens"
+        )
 
 
 def run_failed_chunks(args):
     text_path = config.TEXTS_PATH / args.text_id
     failed_chunks = find_failed_cleanup_chunks(text_path, overlap=args.overlap)
-    print(
-        f"[INFO] Failed chunks based on {args.overlap} overlap percent: \n- {failed_chunks}"
-    )
-    failed_percent = len(failed_chunks) / (failed_chunks[-1])
-    print(f"[INFO] Total failed chunks: {failed_percent:.2f}")
+    for fn in get_text_fns(text_path):
+        print(
+            f"[INFO] Failed chunks of {fn.name} based on {args.overlap} overlap "
+            f"percent: \n- {failed_chunks[fn.name]}"
+        )
+        n_chunks = len(get_chunk_store(fn))
+        failed_percent = len(failed_chunks[fn.name]) / n_chunks if n_chunks else 0.0
+        print(f"[INFO] Total failed chunks: {failed_percent:.2f}")
 
 
 def run_sent_tokenizer(args):
@@ -84,6 +156,63 @@ def main():
         "--skip_push",
         action="store_true",
     )
+    batch_cleanup.add_argument(
+        "--max_in_flight",
+        type=int,
+        default=16,
+        help="number of OpenAI requests sent at a time",
+    )
+    batch_cleanup.add_argument(
+        "--rpm",
+        type=float,
+        default=3500,
+        help="OpenAI requests per minute limit",
+    )
+    batch_cleanup.add_argument(
+        "--tpm",
+        type=float,
+        default=90000,
+        help="OpenAI tokens per minute limit",
+    )
+    batch_cleanup.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="send every prompt to OpenAI even if it was completed before",
+    )
+    batch_cleanup.add_argument(
+        "--api_base",
+        help="OpenAI compatible API url, eg: a local fake completion server",
+    )
+    batch_cleanup.add_argument(
+        "--min_overlap",
+        type=float,
+        default=0.8,
+        help="char count overlap below which a cleaned chunk is cleaned up again",
+    )
+    batch_cleanup.add_argument(
+        "--max_attempts",
+        type=int,
+        default=3,
+        help="number of times a chunk is cleaned up before it's failed",
+    )
+    batch_cleanup.add_argument(
+        "--failure_report", type=Path, help="write the failed chunks to csv"
+    )
+    batch_cleanup.add_argument(
+        "--chunk_profile",
+        choices=list(CHUNK_PROFILES_CONTEXT_FRACTION),
+        default=ChunkProfile.QUALITY,
+        help="size of the chunks of the texts not split yet, "
+        "quality for small chunks and throughput for fewer requests",
+    )
+
+    plan_chunks_parser = subparsers.add_parser(
+        "plan_chunks",
+        help="show requests and prompt tokens needed by each chunk profile",
+    )
+    plan_chunks_parser.add_argument(
+        "text_ids", nargs="+", help="list of downloaded text ids"
+    )
 
     find_failed_chunks = subparsers.add_parser(
         "find_failed_chunks", help="find failed chunks"
@@ -106,6 +235,8 @@ def main():
     args = parser.parse_args()
     if args.command == "batch_cleanup":
         run_batch_cleanup(args)
+    elif args.command == "plan_chunks":
+        run_plan_chunks(args)
     elif args.command == "find_failed_chunks":
         run_failed_chunks(args)
     elif args.command == "sent_tok":
@@ -0,0 +1,192 @@
+import hashlib
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from . import config
+
+COMPLETION_CACHE_PATH = config.DATA_PATH / "completion_cache.sqlite"
+
+
+def get_completion_key(model: str, temperature: float, prompt: str) -> str:
+    sha = hashlib.sha256()
+    sha.update(f"{model}\0{temperature}\0".encode())
+    sha.update(prompt.encode("utf-8"))
+    return sha.hexdigest()
+
+
+class CompletionCache:
+    """Cache of LLM completions in a SQLite file, shared by all the texts.
+
+    Completions are keyed by model, temperature and hash of the prompt. Least
+    recently used completions are evicted once the cache is over `max_size_mb`,
+    the size of the cache is kept as a running total next to the completions.
+
+    Args:
+        db_path: Path to the SQLite db file.
+        max_size_mb: Size of the stored completions, in MB, before eviction.
+    """
+
+    def __init__(self, db_path: Path = COMPLETION_CACHE_PATH, max_size_mb: float = 500):
+        self.db_path = db_path
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._create_table()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(str(self.db_path), timeout=60, isolation_level=None)
+
+    def _create_table(self):
+        conn = self._connect()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                completion TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS completions_last_used_at "
+            "ON completions (last_used_at)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)"
+        )
+        # caches created before the running total only need to be summed once
+        conn.execute(
+            "INSERT OR IGNORE INTO meta (key, value) "
+            "SELECT 'size', COALESCE(SUM(size), 0) FROM completions"
+        )
+        conn.close()
+
+    def _add_size(self, conn: sqlite3.Connection, delta: int):
+        conn.execute("UPDATE meta SET value = value + ? WHERE key = 'size'", (delta,))
+
+    def get(self, model: str, temperature: float, prompt: str) -> Optional[str]:
+        key = get_completion_key(model, temperature, prompt)
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT completion FROM completions WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            conn.close()
+            self.misses += 1
+            return None
+        conn.execute(
+            "UPDATE completions SET last_used_at = ? WHERE key = ?", (time.time(), key)
+        )
+        conn.close()
+        self.hits += 1
+        return row[0]
+
+    def _delete(self, conn: sqlite3.Connection, key: str) -> bool:
+        row = conn.execute(
+            "SELECT size FROM completions WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return False
+        conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+        self._add_size(conn, -row[0])
+        return True
+
+    def put(self, model: str, temperature: float, prompt: str, completion: str):
+        key = get_completion_key(model, temperature, prompt)
+        size = len(completion.encode("utf-8"))
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._delete(conn, key)
+            conn.execute(
+                "INSERT INTO completions "
+                "(key, model, completion, size, last_used_at) VALUES (?, ?, ?, ?, ?)",
+                (key, model, completion, size, time.time()),
+            )
+            self._add_size(conn, size)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        self.evict()
+
+    def delete(self, model: str, temperature: float, prompt: str) -> bool:
+        """Delete the cached completion of the prompt, eg: a rejected one.
+
+        Returns:
+            whether the prompt had a cached completion.
+        """
+        key = get_completion_key(model, temperature, prompt)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            deleted = self._delete(conn, key)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return deleted
+
+    def size(self) -> int:
+        conn = self._connect()
+        (size,) = conn.execute("SELECT value FROM meta WHERE key = 'size'").fetchone()
+        conn.close()
+        return size
+
+    def evict(self) -> int:
+        """Remove least recently used completions over `max_size`.
+
+        Returns:
+            number of completions removed.
+        """
+        if self.size() <= self.max_size:
+            return 0
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # size is read again, as another process may have evicted meanwhile
+            (excess,) = conn.execute(
+                "SELECT value FROM meta WHERE key = 'size'"
+            ).fetchone()
+            excess -= self.max_size
+            keys = []
+            removed_size = 0
+            for key, size in conn.execute(
+                "SELECT key, size FROM completions ORDER BY last_used_at"
+            ):
+                if excess <= 0:
+                    break
+                keys.append((key,))
+                excess -= size
+                removed_size += size
+            conn.executemany("DELETE FROM completions WHERE key = ?", keys)
+            self._add_size(conn, -removed_size)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return len(keys)
+
+    def stats(self) -> Dict[str, float]:
+        """Hits and misses of this instance, and size of the whole cache."""
+        conn = self._connect()
+        (entries,) = conn.execute("SELECT COUNT(*) FROM completions").fetchone()
+        conn.close()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+            "size_mb": self.size() / (1024 * 1024),
+        }
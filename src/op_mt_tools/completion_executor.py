@@ -0,0 +1,175 @@
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, List, Optional, Union
+
+import openai
+
+from .completion_cache import CompletionCache
+
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.APIError,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.Timeout,
+    openai.error.TryAgain,
+)
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate_per_minute`.
+
+    Args:
+        rate_per_minute: tokens added per minute, it's also the bucket capacity.
+        clock: monotonic clock in seconds.
+    """
+
+    def __init__(
+        self, rate_per_minute: float, clock: Callable[[], float] = time.monotonic
+    ):
+        self.rate_per_sec = rate_per_minute / 60
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.clock = clock
+        self.updated_at = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate_per_sec)
+        self.updated_at = now
+
+    async def acquire(self, amount: float = 1):
+        """Wait until `amount` tokens are available and take them.
+
+        Requests bigger than the capacity wait for a full bucket.
+        """
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate_per_sec)
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """Get seconds to wait from the retry-after header of the OpenAI error."""
+    headers = getattr(error, "headers", None) or {}
+    for name in ["retry-after", "Retry-After"]:
+        if name in headers:
+            try:
+                return float(headers[name])
+            except (TypeError, ValueError):
+                return None
+    return None
+
+
+class CompletionExecutor:
+    """Runs completion requests concurrently within the API rate limits.
+
+    At most `max_in_flight` requests are sent at a time, and the requests per minute
+    and estimated tokens per minute are kept within budget with token buckets.
+    Failed requests are retried after the delay in the retry-after header, or with
+    exponential backoff if there isn't any.
+
+    Args:
+        completion_fn: async function returning the completion of a prompt.
+        max_in_flight: number of requests sent at a time.
+        requests_per_minute: requests per minute budget.
+        tokens_per_minute: tokens per minute budget.
+        estimate_tokens: estimates prompt and completion tokens of a request.
+        max_retries: number of retries before giving up on a request.
+        max_backoff: maximum seconds between retries without retry-after header.
+        cache: if provided, cached prompts are completed without any request.
+        model: model of `completion_fn`, part of the cache key.
+        temperature: temperature of `completion_fn`, part of the cache key.
+    """
+
+    def __init__(
+        self,
+        completion_fn: Callable[[str], Awaitable[str]],
+        max_in_flight: int = 16,
+        requests_per_minute: float = 3500,
+        tokens_per_minute: float = 90000,
+        estimate_tokens: Callable[[str], int] = lambda prompt: len(prompt) // 2,
+        max_retries: int = 6,
+        max_backoff: float = 60.0,
+        cache: Optional[CompletionCache] = None,
+        model: str = "",
+        temperature: float = 0.0,
+    ):
+        self.completion_fn = completion_fn
+        self.max_in_flight = max_in_flight
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.estimate_tokens = estimate_tokens
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.cache = cache
+        self.model = model
+        self.temperature = temperature
+        self.n_requests = 0
+        self.n_retries = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _init_limits(self):
+        # asyncio primitives are bound to the event loop they are used in
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        self._requests_bucket = TokenBucket(self.requests_per_minute)
+        self._tokens_bucket = TokenBucket(self.tokens_per_minute)
+
+    def _get_retry_delay(self, error: Exception, attempt: int) -> float:
+        delay = get_retry_after(error)
+        if delay is None:
+            delay = min(2**attempt, self.max_backoff) * random.uniform(0.5, 1.0)
+        return delay
+
+    async def complete(self, prompt: str) -> str:
+        if self.cache:
+            completion = self.cache.get(self.model, self.temperature, prompt)
+            if completion is not None:
+                return completion
+        completion = await self._complete(prompt)
+        if self.cache:
+            self.cache.put(self.model, self.temperature, prompt, completion)
+        return completion
+
+    def invalidate(self, prompt: str):
+        """Remove cached completion of the prompt, so that it's requested again."""
+        if self.cache:
+            self.cache.delete(self.model, self.temperature, prompt)
+
+    async def _complete(self, prompt: str) -> str:
+        self._init_limits()
+        n_tokens = self.estimate_tokens(prompt)
+        attempt = 0
+        while True:
+            async with self._in_flight:
+                await self._requests_bucket.acquire(1)
+                await self._tokens_bucket.acquire(n_tokens)
+                self.n_requests += 1
+                try:
+                    return await self.completion_fn(prompt)
+                except RETRYABLE_ERRORS as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = self._get_retry_delay(e, attempt)
+                    print(f"[WARNING] {type(e).__name__}, retrying in {delay:.1f}s")
+            # sleep without holding the in flight slot
+            await asyncio.sleep(delay)
+            attempt += 1
+            self.n_retries += 1
+
+    async def complete_all(self, prompts: List[str]) -> List[Union[str, Exception]]:
+        """Complete all the prompts, failed ones are returned as their exception."""
+        return await asyncio.gather(
+            *(self.complete(prompt) for prompt in prompts), return_exceptions=True
+        )
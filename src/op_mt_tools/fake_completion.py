@@ -0,0 +1,70 @@
+import asyncio
+import random
+import re
+from collections import Counter
+
+import openai
+
+
+def get_prompt_text(prompt: str) -> str:
+    """Input text of the cleanup prompt, delimited by <> at the end of the prompt."""
+    match = re.search(r"<([^<>]*)>\s*$", prompt)
+    return match.group(1) if match else prompt
+
+
+def echo_sentences(text: str) -> str:
+    """Input text with a sentence per line, as a cleaned up completion."""
+    text = re.sub(r"\s+", " ", text).strip()
+    return "\n".join(sent for sent in re.split(r"(?<=[.!?])\s+", text) if sent)
+
+
+class FakeCompletionBackend:
+    """Deterministic stand-in for the OpenAI completion API, to run cleanup offline.
+
+    Completion of a prompt is its input text split into sentences. Each request
+    waits for `latency` and then fails with a rate limit error or an API error at
+    the given rates. Failures only depend on the prompt, the number of times it was
+    requested and `seed`, so the runs are reproducible with any concurrency.
+
+    Args:
+        latency: seconds to wait before responding.
+        error_rate: fraction of requests failed with an API error.
+        rate_limit_rate: fraction of requests failed with a rate limit error.
+        retry_after: retry-after header of the rate limit errors.
+        seed: seed of the simulated failures.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 1.0,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        self.n_prompt_requests: Counter = Counter()
+        self.n_requests = 0
+        self.n_rate_limited = 0
+        self.n_errors = 0
+
+    async def __call__(self, prompt: str) -> str:
+        self.n_requests += 1
+        self.n_prompt_requests[prompt] += 1
+        rng = random.Random(f"{self.seed}\0{self.n_prompt_requests[prompt]}\0{prompt}")
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        failure = rng.random()
+        if failure < self.rate_limit_rate:
+            self.n_rate_limited += 1
+            raise openai.error.RateLimitError(
+                "Rate limit reached", headers={"retry-after": str(self.retry_after)}
+            )
+        if failure < self.rate_limit_rate + self.error_rate:
+            self.n_errors += 1
+            raise openai.error.ServiceUnavailableError("Server is overloaded")
+        return echo_sentences(get_prompt_text(prompt))
@@ -1,9 +1,11 @@
 import logging
 import os
+import shutil
 import subprocess
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import requests
 from git import Repo, cmd
@@ -162,6 +164,111 @@ def get_github_repos_with_prefix(
         return []
 
 
+def clone_submodule(url: str, repo_path: Path, submodule_path: str, branch: str) -> str:
+    """Shallow clone single branch of submodule repo.
+
+    Returns:
+        sha of the cloned commit.
+    """
+    subprocess.run(
+        ["git", "clone", "-q", "--depth", "1", "--single-branch", "-b", branch]
+        + [url, submodule_path],
+        cwd=repo_path,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    result = subprocess.run(
+        ["git", "rev-parse", "HEAD"],
+        cwd=repo_path / submodule_path,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout.strip()
+
+
+def add_submodules(
+    repo_path: Path,
+    submodules: Dict[str, str],
+    branch: str = "main",
+    max_workers: int = 8,
+) -> Dict[str, Optional[str]]:
+    """Add many submodules to `repo_path` at once, without committing them.
+
+    The submodules are cloned concurrently, then registered in `.gitmodules` with a
+    single write and staged with a single `git update-index`.
+
+    Args:
+        repo_path: Path to the super repo.
+        submodules: url of each submodule by its path relative to `repo_path`.
+        branch: branch of the submodules to track.
+        max_workers: number of submodules cloned at a time.
+
+    Returns:
+        error of each submodule, None if it was added.
+    """
+    repo_path = Path(repo_path).resolve()
+
+    def clone(submodule_path: str, url: str) -> Tuple[Optional[str], Optional[str]]:
+        try:
+            return clone_submodule(url, repo_path, submodule_path, branch), None
+        except subprocess.CalledProcessError as e:
+            shutil.rmtree(repo_path / submodule_path, ignore_errors=True)
+            return None, (e.stderr or str(e)).strip()
+
+    shas, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(clone, submodule_path, url): submodule_path
+            for submodule_path, url in submodules.items()
+        }
+        for i, future in enumerate(as_completed(futures), start=1):
+            submodule_path = futures[future]
+            sha, errors[submodule_path] = future.result()
+            if sha:
+                shas[submodule_path] = sha
+                print(f"[INFO] [{i}/{len(submodules)}] {submodule_path} cloned")
+            else:
+                print(f"[ERROR] [{i}/{len(submodules)}] {submodule_path} failed")
+
+    if not shas:
+        return errors
+
+    gitmodules = "".join(
+        f'[submodule "{submodule_path}"]\n'
+        f"\tpath = {submodule_path}\n"
+        f"\turl = {submodules[submodule_path]}\n"
+        f"\tbranch = {branch}\n"
+        for submodule_path in sorted(shas)
+    )
+    with (repo_path / ".gitmodules").open("a", encoding="utf-8") as f:
+        f.write(gitmodules)
+    index_info = "".join(
+        f"160000 {sha}\t{submodule_path}\n" for submodule_path, sha in shas.items()
+    )
+    subprocess.run(
+        ["git", "update-index", "--add", "--index-info"],
+        cwd=repo_path,
+        input=index_info,
+        check=True,
+        text=True,
+    )
+    subprocess.run(["git", "add", ".gitmodules"], cwd=repo_path, check=True)
+    # move the .git dir of the clones into .git/modules like `git submodule add`
+    subprocess.run(
+        ["git", "submodule", "absorbgitdirs", "--"] + sorted(shas),
+        cwd=repo_path,
+        check=True,
+    )
+    subprocess.run(
+        ["git", "submodule", "init", "-q", "--"] + sorted(shas),
+        cwd=repo_path,
+        check=True,
+    )
+    return errors
+
+
 if __name__ == "__main__":
     import tempfile
 
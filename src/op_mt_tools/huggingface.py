@@ -13,10 +13,10 @@ def start_aligner_service(id_: str = space_id, token: str = token):
         print("[INFO] Space is already running!")
         return
 
-    space_runtime = restart_space(space_id, token=token)
+    space_runtime = restart_space(id_, token=token)
     print("[INFO] Waiting for the space to be ready...")
     current_stage = space_runtime.stage
     while current_stage != SpaceStage.RUNNING.value:
-        current_stage = get_space_runtime(space_id, token=token).stage
+        current_stage = get_space_runtime(id_, token=token).stage
         time.sleep(5)
     print("[INFO] Space is ready!")
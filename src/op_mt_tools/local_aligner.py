@@ -0,0 +1,228 @@
+import hashlib
+import itertools
+import logging
+import math
+import re
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from . import config
+
+MOVE = Tuple[int, int]  # number of bo and en sentences in an aligned bead
+BEAD = Tuple[List[int], List[int]]  # bo and en sentence indices
+
+LOCAL_ALIGNER_VERSION = "1.0"  # bump when the alignment output changes
+
+# Gale-Church prior of each move
+MOVES_PRIOR: Dict[MOVE, float] = {
+    (1, 1): 0.89,
+    (1, 0): 0.005,
+    (0, 1): 0.005,
+    (2, 1): 0.045,
+    (1, 2): 0.045,
+    (2, 2): 0.011,
+}
+CHAR_VARIANCE = 6.8
+LEXICON_WEIGHT = 2.0
+# optional, without it sentences are aligned by their length only
+LEXICON_PATH = config.DATA_PATH / "bo_en_lexicon.tsv"
+
+
+def banded_align(
+    n_src: int,
+    n_tgt: int,
+    cost_fn: Callable[[int, int, MOVE], float],
+    moves: Sequence[MOVE],
+    band_width: int = 30,
+) -> List[BEAD]:
+    """Find the least cost alignment of two sequences with dynamic programming.
+
+    Only the cells within `band_width` of the diagonal are computed, so memory grows
+    linearly with the length of the sequences. The band is doubled until the end is
+    reachable.
+
+    Args:
+        n_src: length of the source sequence.
+        n_tgt: length of the target sequence.
+        cost_fn: cost of aligning src[i-di:i] with tgt[j-dj:j] given i, j and move.
+        moves: allowed (di, dj) moves.
+        band_width: number of cells to compute on each side of the diagonal.
+
+    Returns:
+        aligned beads of source and target indices.
+
+    Raises:
+        ValueError: if the moves can't reach the end of both sequences.
+    """
+    slope = n_tgt / n_src if n_src else 0.0
+
+    def row_bounds(i: int, width: int) -> Tuple[int, int]:
+        center = round(i * slope)
+        return max(0, center - width), min(n_tgt, center + width)
+
+    width = max(band_width, 1)
+    while True:
+        bounds = [row_bounds(i, width) for i in range(n_src + 1)]
+        if n_src == 0:
+            bounds = [(0, n_tgt)]
+        costs: List[List[float]] = []
+        backs: List[List[int]] = []
+        for i in range(n_src + 1):
+            lo, hi = bounds[i]
+            row_costs = [math.inf] * (hi - lo + 1)
+            row_backs = [-1] * (hi - lo + 1)
+            for j in range(lo, hi + 1):
+                if i == 0 and j == 0:
+                    row_costs[0] = 0.0
+                    continue
+                for move_idx, (di, dj) in enumerate(moves):
+                    pi, pj = i - di, j - dj
+                    if pi < 0 or pj < 0:
+                        continue
+                    p_lo, p_hi = bounds[pi]
+                    if not p_lo <= pj <= p_hi:
+                        continue
+                    prev_cost = costs[pi][pj - p_lo] if pi < i else row_costs[pj - lo]
+                    if prev_cost == math.inf:
+                        continue
+                    cost = prev_cost + cost_fn(i, j, (di, dj))
+                    if cost < row_costs[j - lo]:
+                        row_costs[j - lo] = cost
+                        row_backs[j - lo] = move_idx
+            costs.append(row_costs)
+            backs.append(row_backs)
+
+        last_lo, last_hi = bounds[n_src]
+        if last_lo <= n_tgt <= last_hi and costs[n_src][n_tgt - last_lo] < math.inf:
+            break
+        if width >= max(n_src, n_tgt):
+            # band already covers every cell
+            raise ValueError(
+                f"End ({n_src}, {n_tgt}) is not reachable with the moves {moves}"
+            )
+        width *= 2
+
+    beads = []
+    i, j = n_src, n_tgt
+    while i > 0 or j > 0:
+        di, dj = moves[backs[i][j - bounds[i][0]]]
+        beads.append((list(range(i - di, i)), list(range(j - dj, j))))
+        i, j = i - di, j - dj
+    return beads[::-1]
+
+
+def length_cost(bo_len: int, en_len: int, char_ratio: float) -> float:
+    """Gale-Church cost of aligning texts of `bo_len` and `en_len` chars."""
+    if bo_len == 0 and en_len == 0:
+        return 0.0
+    mean = (bo_len + en_len / char_ratio) / 2
+    z = (char_ratio * bo_len - en_len) / math.sqrt(CHAR_VARIANCE * char_ratio * mean)
+    prob = math.erfc(abs(z) / math.sqrt(2))
+    return -math.log(max(prob, 1e-300))
+
+
+def bo_tokenize(sent: str) -> List[str]:
+    return [token for token in re.split(r"[་།\s]+", sent) if token]
+
+
+def en_tokenize(sent: str) -> List[str]:
+    return re.findall(r"[a-z]+", sent.lower())
+
+
+def get_local_aligner_version(lexicon_path: Path = LEXICON_PATH) -> str:
+    """Version of the alignment output, which also depends on the lexicon used."""
+    if not lexicon_path.is_file():
+        return f"{LOCAL_ALIGNER_VERSION}-length-only"
+    lexicon_hash = hashlib.sha256(lexicon_path.read_bytes()).hexdigest()[:12]
+    return f"{LOCAL_ALIGNER_VERSION}-lexicon-{lexicon_hash}"
+
+
+def load_lexicon(path: Path = LEXICON_PATH) -> Dict[str, Set[str]]:
+    """Load bo-en lexicon from tsv file with a bo word and its en word per line."""
+    lexicon: Dict[str, Set[str]] = {}
+    if not path.is_file():
+        logging.warning(f"No lexicon at {path}, aligning by sentence length only")
+        return lexicon
+    for line in path.read_text(encoding="utf-8").splitlines():
+        if "\t" not in line:
+            continue
+        bo_word, en_word = line.split("\t")[:2]
+        lexicon.setdefault(bo_word.strip("་ "), set()).add(en_word.strip().lower())
+    return lexicon
+
+
+def align_sentences(
+    bo_sents: List[str],
+    en_sents: List[str],
+    lexicon: Optional[Dict[str, Set[str]]] = None,
+    band_width: int = 30,
+) -> List[BEAD]:
+    """Align sentences with Gale-Church length cost and lexicon matches."""
+    bo_cum_lens = list(
+        itertools.accumulate([len(sent) for sent in bo_sents], initial=0)
+    )
+    en_cum_lens = list(
+        itertools.accumulate([len(sent) for sent in en_sents], initial=0)
+    )
+    char_ratio = en_cum_lens[-1] / bo_cum_lens[-1] if bo_cum_lens[-1] else 1.0
+    char_ratio = char_ratio if char_ratio else 1.0
+    bo_tokens = [bo_tokenize(sent) for sent in bo_sents] if lexicon else []
+    en_tokens = [set(en_tokenize(sent)) for sent in en_sents] if lexicon else []
+
+    def lexicon_score(bo_idxs: range, en_idxs: range) -> float:
+        if not lexicon or not bo_idxs or not en_idxs:
+            return 0.0
+        tokens = [token for i in bo_idxs for token in bo_tokens[i]]
+        if not tokens:
+            return 0.0
+        en_words = set().union(*(en_tokens[j] for j in en_idxs))
+        matches = sum(1 for token in tokens if lexicon.get(token, set()) & en_words)
+        return matches / len(tokens)
+
+    def cost_fn(i: int, j: int, move: MOVE) -> float:
+        di, dj = move
+        bo_len = bo_cum_lens[i] - bo_cum_lens[i - di]
+        en_len = en_cum_lens[j] - en_cum_lens[j - dj]
+        cost = length_cost(bo_len, en_len, char_ratio) - math.log(MOVES_PRIOR[move])
+        cost -= LEXICON_WEIGHT * lexicon_score(range(i - di, i), range(j - dj, j))
+        return cost
+
+    return banded_align(
+        len(bo_sents), len(en_sents), cost_fn, list(MOVES_PRIOR), band_width
+    )
+
+
+def align_text_pair(
+    bo_view_fn: Path,
+    en_view_fn: Path,
+    tm_path: Path,
+    lexicon: Optional[Dict[str, Set[str]]] = None,
+) -> Tuple[Path, Path]:
+    """Align segmented view files and save them as TM.
+
+    Args:
+        bo_view_fn: bo view file with a sentence per line.
+        en_view_fn: en view file with a sentence per line.
+        tm_path: TM directory, eg: ~/.monlamAI/data/tms/TM0001.
+
+    Returns:
+        paths to TM<id>-bo.txt and TM<id>-en.txt.
+    """
+    bo_sents = [s for s in bo_view_fn.read_text(encoding="utf-8").splitlines() if s]
+    en_sents = [s for s in en_view_fn.read_text(encoding="utf-8").splitlines() if s]
+    beads = align_sentences(bo_sents, en_sents, lexicon=lexicon)
+
+    tm_bo_lines, tm_en_lines = [], []
+    for bo_idxs, en_idxs in beads:
+        # unaligned sentences are dropped from the TM
+        if not bo_idxs or not en_idxs:
+            continue
+        tm_bo_lines.append(" ".join(bo_sents[i].strip() for i in bo_idxs))
+        tm_en_lines.append(" ".join(en_sents[j].strip() for j in en_idxs))
+
+    tm_path.mkdir(parents=True, exist_ok=True)
+    tm_bo_fn = tm_path / f"{tm_path.name}-bo.txt"
+    tm_en_fn = tm_path / f"{tm_path.name}-en.txt"
+    tm_bo_fn.write_text("\n".join(tm_bo_lines), encoding="utf-8")
+    tm_en_fn.write_text("\n".join(tm_en_lines), encoding="utf-8")
+    return tm_bo_fn, tm_en_fn
@@ -2,16 +2,24 @@ import os
 import time
 from collections import Counter
 from collections.abc import Generator
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from pathlib import Path
-from typing import Callable, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
+
+from git import Repo
+from tinydb import TinyDB
 
 from . import config
 from . import types as t
-from .collection import add_text_pair_to_collection, skip_text
+from .aligner_jobs import AlignerJobTracker
+from .alignment_cache import AlignmentCache
+from .collection import Collection, add_text_pair_to_collection, skip_text
 from .github_utils import download_first_text_file_from_github_repo
-from .tm import create_TM
-from .utils import clone_or_pull_repo, commit_and_push
+from .scheduler import CostModel, get_text_pair_path_size, order_by_cost
+from .tm import AlignersEnum, create_TM, create_TMs, needs_published_views
+from .utils import clone_or_pull_repo, commit_repo, push_repo, repo_lock
+from .work_queue import WorkQueue, run_worker
 
 
 def find_text_pair_ids(path: Path) -> Generator[t.TEXT_PAIR_ID, None, None]:
@@ -99,6 +107,63 @@ def download_textpairs_tracker_data() -> Path:
     return textpairs_tracker_path
 
 
+class TrackerState:
+    """Last TRACKER commit processed by the pipeline and text ids still pending."""
+
+    def __init__(self, db_path: Path = config.DATA_PATH / "tracker_state.json"):
+        self._db = TinyDB(db_path)
+
+    @property
+    def last_commit(self) -> Optional[str]:
+        state = self._db.all()
+        return state[0]["last_commit"] if state else None
+
+    @property
+    def pending_text_ids(self) -> List[t.TEXT_ID_NO_PREFIX]:
+        state = self._db.all()
+        return state[0]["pending_text_ids"] if state else []
+
+    def save(self, commit: str, pending_text_ids: List[t.TEXT_ID_NO_PREFIX]):
+        self._db.truncate()
+        self._db.insert({"last_commit": commit, "pending_text_ids": pending_text_ids})
+
+
+def get_tracker_head_commit(text_pairs_tracker_path: Path) -> str:
+    repo = Repo(text_pairs_tracker_path, search_parent_directories=True)
+    return repo.head.commit.hexsha
+
+
+def find_new_text_pair_text_ids(
+    text_pairs_tracker_path: Path, since_commit: str
+) -> List[t.TEXT_ID_NO_PREFIX]:
+    """Find text pairs completed in the TRACKER since `since_commit`.
+
+    Only the files added since `since_commit` are checked, so it doesn't depend on
+    the number of text pairs in the tracker.
+    """
+    print(f"[INFO] Finding text pairs completed since {since_commit[:7]}...")
+    repo = Repo(text_pairs_tracker_path, search_parent_directories=True)
+    diff = repo.git.diff(
+        "--name-status", since_commit, "HEAD", "--", str(text_pairs_tracker_path)
+    )
+    text_ids = []
+    for line in diff.splitlines():
+        status, *fns = line.split("\t")
+        if status[0] not in "ACR":
+            continue
+        fn = Path(fns[-1])
+        if fn.suffix == ".md":
+            continue
+        text_id = f"{int(fn.name[2:]):04d}"
+        is_pair_completed = all(
+            (text_pairs_tracker_path / f"{prefix}{text_id}").exists()
+            for prefix in ["BO", "EN"]
+        )
+        if is_pair_completed and text_id not in text_ids:
+            text_ids.append(text_id)
+    return text_ids
+
+
 def get_text_pairs(
     text_ids: List[t.TEXT_ID_NO_PREFIX] = [],
     text_pairs_tracker_path: Optional[Path] = None,
@@ -119,6 +184,7 @@ def get_text_pairs(
         text_pair_ids = find_text_pair_ids(path=text_pairs_tracker_path)
     else:
         raise ValueError("Either text_ids or text_pairs_tracker_path must be provided.")
+
     for text_pair_id in text_pair_ids:
         text_id = text_pair_id["bo"]
         should_skip = False
@@ -141,10 +207,71 @@ def get_text_id_from_text_pair_path(
     return text_pair_path["bo"].name[2:]
 
 
+def add_TMs_duration(
+    text_pairs_duration: Dict[str, float],
+    text_pairs_size: Dict[str, int],
+    TMs_duration: float,
+) -> None:
+    """Add share of the TMs creation time to the duration of each text pair.
+
+    TMs are created concurrently, so the time of each one is not known and the total
+    is shared in proportion to the text pair sizes.
+    """
+    total_size = sum(text_pairs_size.values())
+    for text_id in text_pairs_duration:
+        if total_size:
+            share = text_pairs_size[text_id] / total_size
+        else:
+            share = 1 / len(text_pairs_duration)
+        text_pairs_duration[text_id] += TMs_duration * share
+
+
+def push_collection(collection_path: Path) -> None:
+    with repo_lock(collection_path):
+        push_repo(collection_path)
+
+
+def process_text_pair(
+    text_pair_path: t.TEXT_PAIR_PATH,
+    collection_path: Path,
+    should_create_TM=True,
+    aligner: str = AlignersEnum.REMOTE,
+    push=True,
+) -> Tuple[t.TEXT_ID_NO_PREFIX, t.TEXT_PAIR_VIEW_PATH]:
+    """Add downloaded text pair to the collection and create its TM.
+
+    The collection is pushed before creating the TM only if the aligner downloads
+    the views from github, otherwise after. With `push=False` the commit is left for
+    the caller to push.
+    """
+    # workers sharing the collection update it one at a time
+    with repo_lock(collection_path):
+        text_id, text_pair_view_path = add_text_pair_to_collection(
+            text_pair_path, collection_path
+        )
+        if not text_id:
+            return text_id, text_pair_view_path
+        commit_repo(collection_path)
+        push_views = push and needs_published_views(aligner)
+        if push_views:
+            push_repo(collection_path)
+    if push_views:
+        time.sleep(3)  # wait for the views to be served by raw.githubusercontent
+        push = False
+    if should_create_TM:
+        create_TM(text_pair_view_path, text_id, aligner=aligner, cache=AlignmentCache())
+    if push:
+        push_collection(collection_path)
+    return text_id, text_pair_view_path
+
+
 def add_text_pair_to_collection_pipeline(
     collection_path: Path,
     should_create_TM=True,
     text_ids: List[t.TEXT_ID_NO_PREFIX] = [],
+    schedule_by_size=True,
+    incremental=True,
+    aligner: str = AlignersEnum.REMOTE,
 ) -> None:
     """Create collection from monlamAI text pair tracker.
 
@@ -152,18 +279,42 @@ def add_text_pair_to_collection_pipeline(
         collection_path: Path to the collection.
         should_create_TM: Whether to create TM.
         text_ids: List of text ids to add to the collection. If empty, add all text ids.
+        schedule_by_size: Whether to process the largest text pairs first.
+        incremental: Whether to only process text pairs completed in the TRACKER
+            since the last run and the ones which failed in the previous runs.
+        aligner: Name of the aligner used to create TMs, eg: "remote" or "local".
     """
     print("[INFO] Pipeline running...")
 
     if not collection_path.is_dir():
         raise ValueError(f"Collection doesn't exist at {collection_path.resolve()}")
 
+    tracker_state: Optional[TrackerState] = None
+    tracker_head_commit, tracker_path = None, None
     if text_ids:
         print("[INFO] Using text ids provided: ", text_ids)
         text_pairs_tracker_path = None
     else:
         text_pairs_tracker_path = download_textpairs_tracker_data()
+        tracker_path = text_pairs_tracker_path
+        if incremental:
+            tracker_state = TrackerState()
+            tracker_head_commit = get_tracker_head_commit(tracker_path)
+            if tracker_state.last_commit:
+                text_ids = tracker_state.pending_text_ids + [
+                    text_id
+                    for text_id in find_new_text_pair_text_ids(
+                        text_pairs_tracker_path, tracker_state.last_commit
+                    )
+                    if text_id not in tracker_state.pending_text_ids
+                ]
+                if not text_ids:
+                    print("[INFO] No new text pairs found.")
+                    tracker_state.save(tracker_head_commit, pending_text_ids=[])
+                    return
+                text_pairs_tracker_path = None
 
+    cost_model = CostModel() if schedule_by_size else None
     skip_added_text = partial(skip_text, collection_path=collection_path)
     text_pair_paths = get_text_pairs(
         text_ids=text_ids,
@@ -173,18 +324,105 @@ def add_text_pair_to_collection_pipeline(
         ],
     )
 
+    # TMs are submitted together at the end, so that the aligner jobs are in flight
+    # concurrently instead of waiting for each other.
+    text_pairs_view_path = {}
+    text_pairs_size, text_pairs_duration = {}, {}
+    # views sent to the aligner don't need to be on github before alignment, so the
+    # collection is pushed once while the TMs are created.
+    push_each = needs_published_views(aligner)
     for text_pair_path in text_pair_paths:
         text_id = get_text_id_from_text_pair_path(text_pair_path)
+        start = time.time()
         try:
-            text_id, text_pair_view_path = add_text_pair_to_collection(
-                text_pair_path, collection_path
+            text_id, text_pair_view_path = process_text_pair(
+                text_pair_path,
+                collection_path,
+                should_create_TM=False,
+                aligner=aligner,
+                push=push_each,
             )
-            if not text_id:
-                continue
-            commit_and_push(collection_path)
-            time.sleep(3)
-            if should_create_TM:
-                create_TM(text_pair_view_path, text_id)
         except Exception as e:
             print(f"[ERROR] Failed to add text pair {text_id}: {e}")
             continue
+        if text_id:
+            text_pairs_view_path[text_id] = text_pair_view_path
+            text_pairs_size[text_id] = get_text_pair_path_size(text_pair_path)
+            text_pairs_duration[text_id] = time.time() - start
+
+    if cost_model:
+        # jobs are taken in order by the free aligner slots, so longest first is LPT
+        print("[INFO] Ordering text pairs by estimated cost...")
+        text_pairs_view_path = {
+            text_id: text_pairs_view_path[text_id]
+            for text_id in order_by_cost(text_pairs_view_path, cost_model)
+        }
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pushed = None
+        if not push_each and text_pairs_view_path:
+            pushed = executor.submit(push_collection, collection_path)
+        if should_create_TM and text_pairs_view_path:
+            print(f"[INFO] Creating {len(text_pairs_view_path)} TMs...")
+            start = time.time()
+            tms_status = create_TMs(
+                text_pairs_view_path, aligner=aligner, cache=AlignmentCache()
+            )
+            add_TMs_duration(text_pairs_duration, text_pairs_size, time.time() - start)
+            for text_id, status in tms_status.items():
+                print(f"[INFO] TM{text_id}: {status}")
+            AlignerJobTracker().record_submissions(
+                text_pairs_view_path, tms_status, aligner
+            )
+        if pushed:
+            pushed.result()
+
+    if cost_model:
+        for text_id, duration in text_pairs_duration.items():
+            cost_model.record(
+                f"BO{text_id}", size_kb=text_pairs_size[text_id], duration=duration
+            )
+
+    if tracker_state and tracker_head_commit and tracker_path:
+        if not text_ids:
+            text_ids = [
+                text_pair_id["bo"][2:]
+                for text_pair_id in find_text_pair_ids(path=tracker_path)
+            ]
+        collection = Collection(path=collection_path)
+        pending_text_ids = [
+            text_id for text_id in text_ids if not collection.is_text_added(text_id)
+        ]
+        tracker_state.save(tracker_head_commit, pending_text_ids=pending_text_ids)
+
+
+def add_text_pair_to_collection_worker(
+    collection_path: Path,
+    queue: WorkQueue,
+    should_create_TM=True,
+    aligner: str = AlignersEnum.REMOTE,
+) -> int:
+    """Add text pairs leased from `queue` to the collection until the queue is drained.
+
+    Args:
+        collection_path: Path to the collection.
+        queue: Work queue of text ids without prefix, shared with other workers.
+        should_create_TM: Whether to create TM.
+        aligner: Name of the aligner used to create TMs.
+
+    Returns:
+        number of text pairs processed.
+    """
+    if not collection_path.is_dir():
+        raise ValueError(f"Collection doesn't exist at {collection_path.resolve()}")
+
+    def process_text_id(text_id: t.TEXT_ID_NO_PREFIX) -> None:
+        if skip_text(collection_path=collection_path, text_id=f"BO{text_id}"):
+            return
+        text_pair_id = next(get_text_pair_ids([text_id]))
+        text_pair_path = download_text_pair(text_pair_id)
+        if not text_pair_path:
+            raise ValueError(f"Text pair {text_id} not found")
+        process_text_pair(text_pair_path, collection_path, should_create_TM, aligner)
+
+    return run_worker(queue, process_text_id)
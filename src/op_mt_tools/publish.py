@@ -5,6 +5,7 @@ import subprocess
 from pathlib import Path
 from typing import List
 
+from .github_utils import add_submodules
 from .logger import setup_logger
 
 log_fn = setup_logger(Path(__file__).name)
@@ -80,9 +81,28 @@ def add_TM(
     logging.info(f"{tm_id} added to {dataset_path.name}")
 
 
-def add_tms_to_dataset(dataset_path: Path, tm_ids: List[str]):
+def add_tms_to_dataset(
+    dataset_path: Path,
+    tm_ids: List[str],
+    tms_path: str = "data",
+    max_workers: int = 8,
+):
+    """Add TMs to dataset with shallow clones done in parallel, in a single commit."""
+    dataset_path = Path(dataset_path).resolve()
+    submodules = {}
     for tm_id in tm_ids:
-        add_TM(dataset_path, tm_id)
+        if (dataset_path / tms_path / tm_id).exists():
+            logging.debug(f"TM: {tm_id} already exists in {dataset_path.name}")
+            continue
+        submodules[f"{tms_path}/{tm_id}"] = get_tm_github_url(tm_id)
+
+    errors = add_submodules(dataset_path, submodules, max_workers=max_workers)
+    for tm_relative_path, error in errors.items():
+        tm_id = Path(tm_relative_path).name
+        if error:
+            logging.error(f"{tm_id} Failed to add to {dataset_path.name}: {error}")
+        else:
+            logging.info(f"{tm_id} added to {dataset_path.name}")
     commit_and_push_changes(dataset_path, "Add TMs")
 
 
@@ -108,6 +128,12 @@ if __name__ == "__main__":
         nargs="+",
         help="TM ids to be added",
     )
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=8,
+        help="number of TMs cloned at a time",
+    )
     parser.add_argument(
         "--update_tms",
         action="store_true",
@@ -116,7 +142,9 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     if args.tm_ids:
-        add_tms_to_dataset(Path(args.dataset_path), args.tm_ids)
+        add_tms_to_dataset(
+            Path(args.dataset_path), args.tm_ids, max_workers=args.max_workers
+        )
     elif args.update_tms:
         update_submodules(args.dataset_path)
     else:
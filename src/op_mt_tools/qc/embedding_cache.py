@@ -0,0 +1,173 @@
+import hashlib
+import sqlite3
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from .. import config
+
+EMBEDDING_CACHE_PATH = config.DATA_PATH / "embedding_cache"
+SQLITE_MAX_PARAMS = 500  # hashes looked up per query
+
+
+def get_sentence_hash(sentence: str) -> str:
+    return hashlib.sha256(sentence.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Sentence embeddings of a model in a memory-mapped float16 matrix.
+
+    Rows of the matrix are indexed by sentence hash in a SQLite file, so sentences
+    unchanged since the last QC, or repeated across TMs, are encoded only once.
+
+    Args:
+        model_name: name of the model, each model has its own matrix and index.
+        cache_path: directory of the caches of all the models.
+    """
+
+    def __init__(self, model_name: str, cache_path: Path = EMBEDDING_CACHE_PATH):
+        self.model_name = model_name
+        self.path = cache_path / model_name.replace("/", "--")
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.path / "index.sqlite"
+        self.matrix_path = self.path / "embeddings.f16"
+        self.hits = 0
+        self.misses = 0
+        self._create_tables()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(str(self.index_path), timeout=60, isolation_level=None)
+
+    def _create_tables(self):
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rows (hash TEXT PRIMARY KEY, row INTEGER NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        conn.close()
+
+    @property
+    def dim(self) -> Optional[int]:
+        conn = self._connect()
+        row = conn.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+        conn.close()
+        return int(row[0]) if row else None
+
+    def __len__(self) -> int:
+        conn = self._connect()
+        (n_rows,) = conn.execute("SELECT COUNT(*) FROM rows").fetchone()
+        conn.close()
+        return n_rows
+
+    def _get_rows(
+        self, conn: sqlite3.Connection, hashes: Iterable[str]
+    ) -> Dict[str, int]:
+        hashes = list(hashes)
+        rows: Dict[str, int] = {}
+        for start in range(0, len(hashes), SQLITE_MAX_PARAMS):
+            end = start + SQLITE_MAX_PARAMS
+            batch = hashes[start:end]
+            placeholders = ",".join("?" * len(batch))
+            rows.update(
+                conn.execute(
+                    f"SELECT hash, row FROM rows WHERE hash IN ({placeholders})", batch
+                ).fetchall()
+            )
+        return rows
+
+    def _put(self, hashes: List[str], embeddings: np.ndarray) -> Dict[str, int]:
+        """Append embeddings of the hashes to the matrix and index their rows."""
+        conn = self._connect()
+        # lock the index, so that rows are appended by one process at a time
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('dim', ?)",
+                    (str(embeddings.shape[1]),),
+                )
+            elif int(row[0]) != embeddings.shape[1]:
+                raise ValueError(
+                    f"Embedding dim {embeddings.shape[1]} of {self.model_name} "
+                    f"doesn't match the cached embeddings dim {row[0]}"
+                )
+            # some of the hashes may have been added by another process meanwhile
+            rows = self._get_rows(conn, hashes)
+            new_idxs = [
+                i for i, sent_hash in enumerate(hashes) if sent_hash not in rows
+            ]
+            (n_rows,) = conn.execute("SELECT COUNT(*) FROM rows").fetchone()
+            row_nbytes = embeddings.shape[1] * np.dtype(np.float16).itemsize
+            mode = "r+b" if self.matrix_path.is_file() else "wb"
+            with open(self.matrix_path, mode) as f:
+                # rows after the indexed ones are left by interrupted writes
+                f.seek(n_rows * row_nbytes)
+                f.write(embeddings[new_idxs].astype(np.float16).tobytes())
+            new_rows = {hashes[i]: n_rows + j for j, i in enumerate(new_idxs)}
+            conn.executemany(
+                "INSERT INTO rows (hash, row) VALUES (?, ?)", list(new_rows.items())
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        rows.update(new_rows)
+        return rows
+
+    def _read_rows(self, rows: List[int], dim: int) -> np.ndarray:
+        if not rows:
+            return np.zeros((0, dim), dtype=np.float32)
+        n_rows = self.matrix_path.stat().st_size // (
+            dim * np.dtype(np.float16).itemsize
+        )
+        matrix: np.ndarray = np.memmap(
+            self.matrix_path, dtype=np.float16, mode="r", shape=(n_rows, dim)
+        )
+        return np.asarray(matrix[rows], dtype=np.float32)
+
+    def get_embeddings(
+        self, sentences: List[str], encode_fn: Callable[[List[str]], np.ndarray]
+    ) -> np.ndarray:
+        """Get embeddings of the sentences, encoding only the ones not cached.
+
+        Args:
+            sentences: sentences to get the embeddings of.
+            encode_fn: encodes the sentences which aren't cached yet.
+
+        Returns:
+            float32 embeddings of the sentences, as stored in the float16 cache.
+        """
+        hashes = [get_sentence_hash(sentence) for sentence in sentences]
+        conn = self._connect()
+        rows = self._get_rows(conn, set(hashes))
+        conn.close()
+        missing_sents: Dict[str, str] = {}
+        for sent_hash, sentence in zip(hashes, sentences):
+            if sent_hash not in rows:
+                missing_sents.setdefault(sent_hash, sentence)
+        self.misses += len(missing_sents)
+        self.hits += len(sentences) - len(missing_sents)
+        if missing_sents:
+            embeddings = np.asarray(
+                encode_fn(list(missing_sents.values())), dtype=np.float32
+            )
+            rows.update(self._put(list(missing_sents), embeddings))
+        return self._read_rows([rows[sent_hash] for sent_hash in hashes], self.dim or 0)
+
+    def stats(self) -> Dict[str, float]:
+        """Hits and misses of this instance, and size of the whole cache."""
+        total = self.hits + self.misses
+        size = self.matrix_path.stat().st_size if self.matrix_path.is_file() else 0
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self),
+            "size_mb": size / (1024 * 1024),
+        }
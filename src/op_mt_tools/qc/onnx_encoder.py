@@ -0,0 +1,134 @@
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from .. import config
+
+ONNX_MODELS_PATH = config.DATA_PATH / "onnx_models"
+ONNX_MODEL_FN = "model.onnx"
+ONNX_INT8_MODEL_FN = "model-int8.onnx"
+ONNX_INSTALL_HINT = "ONNX encoder needs the onnx extra: pip install op_mt_tools[onnx]"
+
+
+def get_onnx_model_dir(model_name: str, onnx_path: Path = ONNX_MODELS_PATH) -> Path:
+    return onnx_path / model_name.replace("/", "--")
+
+
+def export_onnx_model(model_name: str, model_dir: Path) -> Path:
+    """Export sentence transformer to ONNX and quantize its weights to int8.
+
+    Pooling and normalization of the sentence transformer are part of the exported
+    graph, so it outputs the sentence embeddings.
+
+    Returns:
+        path to the int8 ONNX model.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    try:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+    except ImportError as e:
+        raise ImportError(ONNX_INSTALL_HINT) from e
+
+    class SentenceEmbedding(torch.nn.Module):
+        def __init__(self, model: SentenceTransformer):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            features = {"input_ids": input_ids, "attention_mask": attention_mask}
+            return self.model(features)["sentence_embedding"]
+
+    model = SentenceTransformer(model_name, device="cpu")
+    model.eval()
+    model_dir.mkdir(parents=True, exist_ok=True)
+    model.tokenizer.save_pretrained(str(model_dir))
+    (model_dir / "max_seq_length.txt").write_text(str(model.max_seq_length))
+
+    inputs = model.tokenizer(["export"], return_tensors="pt")
+    model_fn = model_dir / ONNX_MODEL_FN
+    dynamic_axes = {"batch": 0, "tokens": 1}
+    with torch.no_grad():
+        torch.onnx.export(
+            SentenceEmbedding(model),
+            (inputs["input_ids"], inputs["attention_mask"]),
+            str(model_fn),
+            input_names=["input_ids", "attention_mask"],
+            output_names=["sentence_embedding"],
+            dynamic_axes={
+                "input_ids": dynamic_axes,
+                "attention_mask": dynamic_axes,
+                "sentence_embedding": {0: "batch"},
+            },
+            opset_version=14,
+        )
+    int8_model_fn = model_dir / ONNX_INT8_MODEL_FN
+    quantize_dynamic(str(model_fn), str(int8_model_fn), weight_type=QuantType.QInt8)
+    model_fn.unlink()
+    return int8_model_fn
+
+
+class OnnxSentenceEncoder:
+    """Int8 ONNX sentence encoder run with onnxruntime on CPU.
+
+    It has the `encode`, `tokenizer` and `max_seq_length` of a sentence transformer
+    used by `qc.tm.get_embedding`.
+
+    Args:
+        model_dir: directory of the exported model and its tokenizer.
+    """
+
+    def __init__(self, model_dir: Path):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError(ONNX_INSTALL_HINT) from e
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(str(model_dir))
+        self.max_seq_length = int((model_dir / "max_seq_length.txt").read_text())
+        self.session = onnxruntime.InferenceSession(
+            str(model_dir / ONNX_INT8_MODEL_FN), providers=["CPUExecutionProvider"]
+        )
+        self.embedding_dim = self.session.get_outputs()[0].shape[-1]
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.embedding_dim
+
+    def encode(
+        self, sentences: List[str], batch_size: int = 32, **kwargs
+    ) -> np.ndarray:
+        embeddings = []
+        for start in range(0, len(sentences), batch_size):
+            end = start + batch_size
+            inputs = self.tokenizer(
+                list(sentences[start:end]),
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            (batch_embeddings,) = self.session.run(
+                None,
+                {
+                    "input_ids": inputs["input_ids"].astype(np.int64),
+                    "attention_mask": inputs["attention_mask"].astype(np.int64),
+                },
+            )
+            embeddings.append(batch_embeddings)
+        if not embeddings:
+            return np.zeros((0, self.embedding_dim), dtype=np.float32)
+        return np.concatenate(embeddings).astype(np.float32)
+
+
+def get_onnx_encoder(
+    model_name: str, onnx_path: Path = ONNX_MODELS_PATH
+) -> OnnxSentenceEncoder:
+    """Load the int8 ONNX encoder of the model, exporting it on the first use."""
+    model_dir = get_onnx_model_dir(model_name, onnx_path)
+    if not (model_dir / ONNX_INT8_MODEL_FN).is_file():
+        print(f"[INFO] Exporting {model_name} to int8 ONNX at {model_dir} ...")
+        export_onnx_model(model_name, model_dir)
+    return OnnxSentenceEncoder(model_dir)
@@ -1,12 +1,25 @@
 import logging
 import math
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import List, Tuple
+from typing import Deque, Iterator, List, Optional, Tuple
+
+import numpy as np
 
 from .. import config
 from ..github_utils import commit_and_push
-from .tm import download_tm, get_sentence_pairs, get_similarity
+from ..work_queue import WorkQueue, run_worker
+from .tm import (
+    EncoderBackend,
+    download_tm,
+    get_embedding_cache,
+    get_sentence_pairs,
+    get_similarity,
+    set_encoder_backend,
+)
 
 # Configure the logging settings
 log_fn = config.LOGGING_PATH / f"qc-{datetime.now()}.log"
@@ -17,6 +30,12 @@ logging.basicConfig(
 )
 
 
+QC_BATCH_SIZE = 2048  # sentence pairs of many TMs encoded together
+QC_MAX_PREFETCH = 4  # TMs downloaded while the current ones are encoded
+
+PreparedTM = Tuple[Path, List[str], List[str]]  # TM path, bo and en sentences
+
+
 class SimilarityMetric:
     def __init__(self, threshold=0.75, max_ranks=3):
         self.threshold = threshold
@@ -28,16 +47,20 @@ class SimilarityMetric:
         else:
             return math.ceil((self.threshold - sim_score) / self.max_ranks * 10)
 
-    def compute_overall_rank(self, sim_scores: List[float]) -> Tuple[int, float]:
+    def compute_overall_rank(self, sim_scores: np.ndarray) -> Tuple[int, float]:
         sim_scores_avg = sum(sim_scores) / len(sim_scores)
         return self.compute_rank(sim_scores_avg), sim_scores_avg
 
+    def rank(self, sim_scores: np.ndarray) -> Tuple[List[int], int, float]:
+        sim_scores_ranks = [self.compute_rank(score) for score in sim_scores]
+        avg_rank, avg_sim_score = self.compute_overall_rank(sim_scores)
+        return sim_scores_ranks, avg_rank, avg_sim_score
+
     def __call__(
         self, bo_sents: List[str], en_sents: List[str]
-    ) -> Tuple[List[int], List[float], int, float]:
+    ) -> Tuple[List[int], np.ndarray, int, float]:
         sim_scores = get_similarity(bo_sents, en_sents)
-        sim_scores_ranks = [self.compute_rank(score) for score in sim_scores]
-        avg_rank, avg_sim_score = self.compute_overall_rank(sim_scores)
+        sim_scores_ranks, avg_rank, avg_sim_score = self.rank(sim_scores)
         return sim_scores_ranks, sim_scores, avg_rank, avg_sim_score
 
 
@@ -93,48 +116,185 @@ def save_review(tm_path: Path, bo_sents: List[str], en_sents: List[str]):
 
 
 def log_ranked_sents(
-    bo_sents: List[str], en_sents: List[str], sim_scores: List[float], ranks: List[int]
+    bo_sents: List[str], en_sents: List[str], sim_scores: np.ndarray, ranks: List[int]
 ):
     for bo_sent, en_sent, sim_score, rank in zip(bo_sents, en_sents, sim_scores, ranks):
         logging.info(f"{rank} {sim_score} {bo_sent} ||| {en_sent}")
 
 
-def run_pipeline(tm_ids: List[str], disable_push=False, verbose=False):
-    for tm_id in tm_ids:
-        try:
-            tm_path = download_tm(tm_id)
-        except Exception as e:
-            logging.error(f"Error in downloading {tm_id}")
-            logging.error(e)
-            continue
-        if tm_path.name not in tm_ids:
-            continue
-        logging.info(f"Running QC on {tm_path.name}")
-        metric = SimilarityMetric()
-        rank_marker = RankMarker()
+def prepare_qc(tm_id: str) -> Optional[PreparedTM]:
+    """Download TM and get its sentence pairs without the rank markers.
+
+    Returns:
+        TM path and its bo and en sentences, None if they couldn't be prepared.
+    """
+    try:
+        tm_path = download_tm(tm_id)
+    except Exception as e:
+        logging.error(f"Error in downloading {tm_id}")
+        logging.error(e)
+        return None
+    try:
+        bo_sents, en_sents = get_sentence_pairs(tm_path)
+    except Exception as e:
+        logging.error(f"Error in getting sentence pairs for {tm_id}")
+        logging.error(e)
+        return None
+
+    if not bo_sents or not en_sents:
+        logging.error(f"Empty sentence pairs for {tm_id}")
+        return None
+
+    if len(bo_sents) != len(en_sents):
+        logging.error(
+            f"Unaligned sentence pairs for {tm_id}, "
+            f"{len(bo_sents)} bo and {len(en_sents)} en sentences"
+        )
+        return None
+
+    bo_sents, en_sents = RankMarker().remove(bo_sents, en_sents)
+    return tm_path, bo_sents, en_sents
+
+
+def finish_qc(
+    tm_path: Path,
+    bo_sents: List[str],
+    en_sents: List[str],
+    sim_scores: np.ndarray,
+    disable_push=False,
+    verbose=False,
+):
+    """Mark the sentence pairs with their ranks and save, and push, the review."""
+    metric = SimilarityMetric()
+    rank_marker = RankMarker()
+    ranks, tm_rank, tm_avg_sim_score = metric.rank(sim_scores)
+    ranked_bo_sents, ranked_en_sents = rank_marker.mark(bo_sents, en_sents, ranks)
+    if verbose:
+        log_ranked_sents(ranked_bo_sents, ranked_en_sents, sim_scores, ranks)
+    save_review(tm_path, ranked_bo_sents, ranked_en_sents)
+    logging.info(f"{tm_path.name} rank: {tm_rank}, avg sim score: {tm_avg_sim_score}")
+    if not disable_push:
+        commit_and_push(tm_path, "add QC review")
+
+
+def run_qc(tm_id: str, disable_push=False, verbose=False) -> bool:
+    """Run QC on a single TM.
+
+    Returns:
+        whether QC of the TM completed.
+    """
+    prepared = prepare_qc(tm_id)
+    if prepared is None:
+        return False
+    tm_path, bo_sents, en_sents = prepared
+    logging.info(f"Running QC on {tm_path.name}")
+    sim_scores = get_similarity(bo_sents, en_sents)
+    finish_qc(tm_path, bo_sents, en_sents, sim_scores, disable_push, verbose)
+    return True
+
+
+def log_embedding_cache_stats():
+    stats = get_embedding_cache().stats()
+    logging.info(
+        f"Embedding cache: {stats['hit_rate']:.2%} hit rate "
+        f"({stats['hits']} hits, {stats['misses']} misses), "
+        f"{stats['entries']} embeddings, {stats['size_mb']:.1f} MB"
+    )
+
+
+def run_pipeline(
+    tm_ids: List[str],
+    disable_push=False,
+    verbose=False,
+    batch_size=QC_BATCH_SIZE,
+    max_prefetch=QC_MAX_PREFETCH,
+) -> float:
+    """Run QC on TMs, encoding the sentences of many TMs together.
+
+    Next TMs are downloaded while the current ones are encoded, sentence pairs of
+    the TMs are scored in batches of at least `batch_size` pairs, and the reviews
+    are saved and pushed in the background.
+
+    Returns:
+        sentences encoded per second, not counting the cached sentences.
+    """
+    n_sents, encoding_secs = 0, 0.0
+    batch: List[PreparedTM] = []
+    publish_futures = []
+
+    def score_batch(publisher: ThreadPoolExecutor):
+        nonlocal n_sents, encoding_secs
+        bo_sents = [sent for _, tm_bo_sents, _ in batch for sent in tm_bo_sents]
+        en_sents = [sent for _, _, tm_en_sents in batch for sent in tm_en_sents]
+        logging.info(f"Running QC on {len(batch)} TMs, {len(bo_sents)} pairs")
+        # cached sentences are not encoded, count only the cache misses
+        misses = get_embedding_cache().misses
+        encoding_start = time.time()
+        sim_scores = get_similarity(bo_sents, en_sents)
+        encoding_secs += time.time() - encoding_start
+        n_sents += get_embedding_cache().misses - misses
+        end = 0
+        for tm_path, tm_bo_sents, tm_en_sents in batch:
+            start, end = end, end + len(tm_bo_sents)
+            tm_sim_scores = sim_scores[start:end]
+            future = publisher.submit(
+                finish_qc,
+                tm_path,
+                tm_bo_sents,
+                tm_en_sents,
+                tm_sim_scores,
+                disable_push,
+                verbose,
+            )
+            publish_futures.append((tm_path.name, future))
+        batch.clear()
+
+    def prefetch(downloader: ThreadPoolExecutor) -> Iterator[Optional[PreparedTM]]:
+        """Prepare TMs in order, with at most `max_prefetch` of them in memory."""
+        pending: Deque[Future] = deque()
+        for tm_id in tm_ids:
+            if len(pending) >= max_prefetch:
+                yield pending.popleft().result()
+            pending.append(downloader.submit(prepare_qc, tm_id))
+        while pending:
+            yield pending.popleft().result()
+
+    with ThreadPoolExecutor(max_workers=max_prefetch) as downloader:
+        with ThreadPoolExecutor(max_workers=1) as publisher:
+            for prepared in prefetch(downloader):
+                if prepared is None or prepared[0].name not in tm_ids:
+                    continue
+                batch.append(prepared)
+                if sum(len(bo_sents) for _, bo_sents, _ in batch) >= batch_size:
+                    score_batch(publisher)
+            if batch:
+                score_batch(publisher)
+
+    for tm_id, future in publish_futures:
         try:
-            bo_sents, en_sents = get_sentence_pairs(tm_path)
+            future.result()
         except Exception as e:
-            logging.error(f"Error in getting sentence pairs for {tm_id}")
+            logging.error(f"Error in saving QC review of {tm_id}")
             logging.error(e)
-            continue
-
-        if not bo_sents or not en_sents:
-            logging.error(f"Empty sentence pairs for {tm_id}")
-            continue
-
-        bo_sents, en_sents = rank_marker.remove(bo_sents, en_sents)
-        ranks, sim_scores, tm_rank, tm_avg_sim_score = metric(bo_sents, en_sents)
-        ranked_bo_sents, ranked_en_sents = rank_marker.mark(bo_sents, en_sents, ranks)
-        if verbose:
-            log_ranked_sents(ranked_bo_sents, ranked_en_sents, sim_scores, ranks)
-        save_review(tm_path, ranked_bo_sents, ranked_en_sents)
-        logging.info(
-            f"{tm_path.name} rank: {tm_rank}, avg sim score: {tm_avg_sim_score}"
-        )
-        if not disable_push:
-            commit_and_push(tm_path, "add QC review")
 
+    sents_per_sec = n_sents / encoding_secs if encoding_secs else 0.0
+    logging.info(
+        f"Encoded {n_sents} uncached sentences, {sents_per_sec:.1f} sentences/sec"
+    )
+    log_embedding_cache_stats()
+    logging.info("QC completed.")
+    return sents_per_sec
+
+
+def run_worker_pipeline(queue: WorkQueue, disable_push=False, verbose=False):
+    """Run QC on TM ids leased from `queue` until the queue is drained."""
+
+    def process_tm_id(tm_id: str) -> None:
+        if not run_qc(tm_id, disable_push=disable_push, verbose=verbose):
+            raise RuntimeError(f"QC failed for {tm_id}, see {log_fn}")
+
+    run_worker(queue, process_tm_id)
+    log_embedding_cache_stats()
     logging.info("QC completed.")
 
 
@@ -145,7 +305,7 @@ if __name__ == "__main__":
     parser.add_argument(
         "tm_ids",
         type=str,
-        nargs="+",
+        nargs="*",
         help="TM ids to run QC on.",
     )
     parser.add_argument(
@@ -159,10 +319,38 @@ if __name__ == "__main__":
         help="whether to disable push to github",
     )
 
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=QC_BATCH_SIZE,
+        help="sentence pairs of many TMs encoded together",
+    )
+    parser.add_argument(
+        "--encoder",
+        choices=[EncoderBackend.TORCH, EncoderBackend.ONNX],
+        help="encoder backend, defaults to QC_ENCODER_BACKEND env var or torch",
+    )
+    parser.add_argument(
+        "--queue_db",
+        type=Path,
+        help="pull TM ids from the `qc` work queue in this db",
+    )
+
     args = parser.parse_args()
 
-    run_pipeline(
-        tm_ids=args.tm_ids,
-        disable_push=args.disable_push,
-        verbose=args.verbose,
-    )
+    if args.encoder:
+        set_encoder_backend(args.encoder)
+    if args.queue_db:
+        run_worker_pipeline(
+            queue=WorkQueue(db_path=args.queue_db, name="qc"),
+            disable_push=args.disable_push,
+            verbose=args.verbose,
+        )
+    else:
+        sents_per_sec = run_pipeline(
+            tm_ids=args.tm_ids,
+            disable_push=args.disable_push,
+            verbose=args.verbose,
+            batch_size=args.batch_size,
+        )
+        print(f"[INFO] QC encoded {sents_per_sec:.1f} uncached sentences/sec")
@@ -0,0 +1,216 @@
+import logging
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+from ..github_utils import commit_and_push
+from ..local_aligner import MOVE, banded_align
+from .pipeline import RankMarker
+from .tm import download_tm, get_cached_embedding, get_similarity, get_text_paths
+
+REALIGN_MOVES: List[MOVE] = [(1, 1), (1, 2), (2, 1), (1, 0), (0, 1)]
+SKIP_COST = 0.8  # cost of leaving a sentence unaligned, ie 1-0 or 0-1 move
+
+
+def find_low_similarity_windows(
+    sim_scores: np.ndarray, threshold: float = 0.5, context: int = 1
+) -> List[Tuple[int, int]]:
+    """Find contiguous windows of sentence pairs scoring below `threshold`.
+
+    Each window is extended by `context` pairs on both sides and overlapping windows
+    are merged.
+
+    Returns:
+        start and end (exclusive) line index of each window.
+    """
+    windows: List[Tuple[int, int]] = []
+    n = len(sim_scores)
+    for i, score in enumerate(sim_scores):
+        if score >= threshold:
+            continue
+        start, end = max(0, i - context), min(n, i + 1 + context)
+        if windows and start <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], max(windows[-1][1], end))
+        else:
+            windows.append((start, end))
+    return windows
+
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def realign_window(
+    bo_sents: List[str],
+    en_sents: List[str],
+    bo_embeddings: np.ndarray,
+    en_embeddings: np.ndarray,
+    band_width: int = 10,
+) -> Tuple[List[str], List[str]]:
+    """Re-align sentences of a window by their embeddings.
+
+    Merged sentences are scored with the normalized sum of their embeddings, and the
+    sentences left unaligned are dropped. The window may have more sentences on one
+    side.
+
+    Returns:
+        realigned bo and en sentences of the window.
+    """
+    bo_embeddings = normalize(bo_embeddings)
+    en_embeddings = normalize(en_embeddings)
+
+    def cost_fn(i: int, j: int, move: MOVE) -> float:
+        di, dj = move
+        if not di or not dj:
+            return SKIP_COST
+        bo_vec = normalize(bo_embeddings[slice(i - di, i)].sum(axis=0))
+        en_vec = normalize(en_embeddings[slice(j - dj, j)].sum(axis=0))
+        return 1.0 - float(np.dot(bo_vec, en_vec))
+
+    beads = banded_align(
+        len(bo_sents), len(en_sents), cost_fn, REALIGN_MOVES, band_width
+    )
+    realigned_bo_sents, realigned_en_sents = [], []
+    for bo_idxs, en_idxs in beads:
+        if not bo_idxs or not en_idxs:
+            continue
+        realigned_bo_sents.append(" ".join(bo_sents[i] for i in bo_idxs))
+        realigned_en_sents.append(" ".join(en_sents[j] for j in en_idxs))
+    return realigned_bo_sents, realigned_en_sents
+
+
+def realign_windows(
+    bo_sents: List[str], en_sents: List[str], windows: List[Tuple[int, int]]
+) -> List[Tuple[List[str], List[str]]]:
+    """Re-align sentences of each window, encoding the sentences of all the windows
+    in one go. Embeddings cached while scoring the TM are reused.
+
+    Returns:
+        realigned bo and en sentences of each window.
+    """
+    window_bo_sents = [s for start, end in windows for s in bo_sents[start:end]]
+    window_en_sents = [s for start, end in windows for s in en_sents[start:end]]
+    bo_embeddings = np.asarray(get_cached_embedding(window_bo_sents), dtype=np.float32)
+    en_embeddings = np.asarray(get_cached_embedding(window_en_sents), dtype=np.float32)
+
+    realigned_windows = []
+    bo_offset, en_offset = 0, 0
+    for start, end in windows:
+        # last window may have more sentences on one side
+        n_bo, n_en = len(bo_sents[start:end]), len(en_sents[start:end])
+        bo_slice = slice(bo_offset, bo_offset + n_bo)
+        en_slice = slice(en_offset, en_offset + n_en)
+        realigned_windows.append(
+            realign_window(
+                bo_sents[start:end],
+                en_sents[start:end],
+                bo_embeddings[bo_slice],
+                en_embeddings[en_slice],
+            )
+        )
+        bo_offset, en_offset = bo_offset + n_bo, en_offset + n_en
+    return realigned_windows
+
+
+def splice_windows(
+    lines: List[str], windows: List[Tuple[int, int]], windows_lines: List[List[str]]
+) -> List[str]:
+    """Replace the lines of each window with its new lines, other lines are kept."""
+    spliced_lines: List[str] = []
+    last_end = 0
+    for (start, end), window_lines in zip(windows, windows_lines):
+        spliced_lines += lines[last_end:start]
+        spliced_lines += window_lines
+        last_end = end
+    spliced_lines += lines[last_end:]
+    return spliced_lines
+
+
+def repair_alignment(
+    bo_sents: List[str],
+    en_sents: List[str],
+    sim_scores: np.ndarray,
+    threshold: float = 0.5,
+    context: int = 1,
+) -> Tuple[List[str], List[str], int]:
+    """Re-align only the windows of low similarity sentence pairs.
+
+    Returns:
+        repaired bo and en sentences, and number of windows re-aligned.
+    """
+    windows = find_low_similarity_windows(sim_scores, threshold, context)
+    if not windows:
+        return bo_sents, en_sents, 0
+
+    realigned_windows = realign_windows(bo_sents, en_sents, windows)
+    repaired_bo_sents = splice_windows(
+        bo_sents, windows, [bo for bo, _ in realigned_windows]
+    )
+    repaired_en_sents = splice_windows(
+        en_sents, windows, [en for _, en in realigned_windows]
+    )
+    return repaired_bo_sents, repaired_en_sents, len(windows)
+
+
+def repair_tm(tm_path: Path, threshold: float = 0.5, context: int = 1) -> int:
+    """Re-align low similarity windows of TM and rewrite only their lines.
+
+    Lines out of the windows are kept as they are, with their rank markers. If bo and
+    en have a different number of lines, the lines without a pair are re-aligned
+    with the last window when it reaches them.
+
+    Returns:
+        number of windows re-aligned.
+    """
+    text_paths = get_text_paths(tm_path)
+    bo_text = text_paths["bo"].read_text(encoding="utf-8")
+    en_text = text_paths["en"].read_text(encoding="utf-8")
+    bo_lines, en_lines = bo_text.splitlines(), en_text.splitlines()
+    n_pairs = min(len(bo_lines), len(en_lines))
+    bo_sents, en_sents = RankMarker().remove(bo_lines, en_lines)
+    sim_scores = get_similarity(bo_sents[:n_pairs], en_sents[:n_pairs])
+    windows = find_low_similarity_windows(sim_scores, threshold, context)
+    if windows and windows[-1][1] == n_pairs:
+        windows[-1] = (windows[-1][0], max(len(bo_lines), len(en_lines)))
+    if windows:
+        realigned_windows = realign_windows(bo_sents, en_sents, windows)
+        for text_path, text, lines, window_lines in [
+            (text_paths["bo"], bo_text, bo_lines, [bo for bo, _ in realigned_windows]),
+            (text_paths["en"], en_text, en_lines, [en for _, en in realigned_windows]),
+        ]:
+            repaired_text = "\n".join(splice_windows(lines, windows, window_lines))
+            if text.endswith("\n"):
+                repaired_text += "\n"
+            text_path.write_text(repaired_text, encoding="utf-8")
+    logging.info(f"{tm_path.name} repaired {len(windows)} windows")
+    return len(windows)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Re-align low similarity windows of TMs."
+    )
+    parser.add_argument("tm_ids", type=str, nargs="+", help="TM ids to repair.")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.5,
+        help="sentence pairs below this similarity score are re-aligned",
+    )
+    parser.add_argument(
+        "--disable-push",
+        action="store_true",
+        help="whether to disable push to github",
+    )
+    args = parser.parse_args()
+
+    for tm_id in args.tm_ids:
+        tm_path = download_tm(tm_id)
+        n_windows = repair_tm(tm_path, threshold=args.threshold)
+        print(f"[INFO] {tm_id}: {n_windows} windows re-aligned")
+        if n_windows and not args.disable_push:
+            commit_and_push(tm_path, "repair low similarity alignments")
@@ -3,42 +3,152 @@ import os
 import random
 import sys
 from pathlib import Path
-from typing import Dict, List
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
 
 from .. import config
 from ..github_utils import clone_or_pull_repo
+from .embedding_cache import EmbeddingCache
+from .onnx_encoder import get_onnx_encoder
+
+
+class EncoderBackend:
+    TORCH = "torch"
+    ONNX = "onnx"  # int8 quantized, needs the onnx extra
+
 
+MODEL_NAME = "buddhist-nlp/bod-eng-similarity"
+encoder_backend = os.environ.get("QC_ENCODER_BACKEND", EncoderBackend.TORCH)
 model = None
+embedding_cache = None
+SIM_BLOCK_SIZE = 4096  # sentence pairs whose similarity is computed at a time
+MAX_BATCH_TOKENS = 8192  # padded tokens of a batch of sentences encoded at a time
 
 
-def get_model():
-    from sentence_transformers import SentenceTransformer
+def set_encoder_backend(backend: str):
+    """Switch the backend of the encoder, eg: to the int8 ONNX one on CPU servers."""
+    global encoder_backend, model, embedding_cache
+    if backend not in [EncoderBackend.TORCH, EncoderBackend.ONNX]:
+        raise ValueError(f"Unknown encoder backend {backend}")
+    encoder_backend = backend
+    model = None
+    embedding_cache = None
+
 
+def get_model():
     global model
-    model_path = "buddhist-nlp/bod-eng-similarity"
     if model is None:
-        model = SentenceTransformer(model_path)
+        if encoder_backend == EncoderBackend.ONNX:
+            model = get_onnx_encoder(MODEL_NAME)
+        else:
+            from sentence_transformers import SentenceTransformer
+
+            model = SentenceTransformer(MODEL_NAME)
     return model
 
 
-def get_embedding(sentences):
+def get_embedding_cache() -> EmbeddingCache:
+    global embedding_cache
+    if embedding_cache is None:
+        # embeddings of the quantized model differ, so they are cached separately
+        model_name = MODEL_NAME
+        if encoder_backend == EncoderBackend.ONNX:
+            model_name = f"{MODEL_NAME}-onnx-int8"
+        embedding_cache = EmbeddingCache(model_name)
+    return embedding_cache
+
+
+def get_token_budget_batches(
+    sorted_lengths: List[int], max_batch_tokens=MAX_BATCH_TOKENS
+) -> List[Tuple[int, int]]:
+    """Group sentences sorted by length into batches of at most `max_batch_tokens`.
+
+    Every sentence of a batch is padded to its longest one, so the padded tokens of
+    a batch are its size times the length of its last sentence.
+
+    Returns:
+        start and end (exclusive) index of each batch.
+    """
+    batches = []
+    start = 0
+    for end, length in enumerate(sorted_lengths, start=1):
+        if end - start > 1 and (end - start) * length > max_batch_tokens:
+            batches.append((start, end - 1))
+            start = end - 1
+    if start < len(sorted_lengths):
+        batches.append((start, len(sorted_lengths)))
+    return batches
+
+
+def get_embedding(sentences, max_batch_tokens=MAX_BATCH_TOKENS) -> np.ndarray:
+    """Encode sentences in batches of similar length within a padded token budget.
+
+    Sentences are sorted by tokenized length, so that short sentences aren't padded
+    to long ones, and the embeddings are returned in the order of `sentences`.
+    """
     model = get_model()
-    return model.encode(sentences, convert_to_tensor=True, show_progress_bar=False)
-
+    embeddings = np.empty(
+        (len(sentences), model.get_sentence_embedding_dimension()), np.float32
+    )
+    if not len(sentences):
+        return embeddings
+    input_ids = model.tokenizer(
+        list(sentences), truncation=True, max_length=model.max_seq_length
+    )["input_ids"]
+    lengths = np.array([len(ids) for ids in input_ids])
+    order = np.argsort(lengths, kind="stable")
+    for start, end in get_token_budget_batches(
+        lengths[order].tolist(), max_batch_tokens
+    ):
+        idxs = order[start:end]
+        batch_embeddings = model.encode(
+            [sentences[i] for i in idxs], batch_size=len(idxs), show_progress_bar=False
+        )
+        embeddings[idxs] = batch_embeddings
+    return embeddings
 
-def get_similarity(sentences1, sentences2) -> List[float]:
-    from sentence_transformers import util
 
-    embeddings1 = get_embedding(sentences1)
-    embeddings2 = get_embedding(sentences2)
-    cosine_scores = util.cos_sim(embeddings1, embeddings2)
+def get_pairs_cos_sim(
+    embeddings1: np.ndarray, embeddings2: np.ndarray, block_size=SIM_BLOCK_SIZE
+) -> np.ndarray:
+    """Cosine similarity of each row of `embeddings1` with the same row of `embeddings2`.
 
-    sim_scores = []
-    for i in range(len(sentences1)):
-        sim_scores.append(max(float(cosine_scores[i][i]), 0.0))
+    Rows are normalized and multiplied in blocks of `block_size`, so memory is
+    O(N·d) instead of the O(N²) similarity matrix of all the pairs.
+    """
+    if len(embeddings1) != len(embeddings2):
+        raise ValueError(
+            f"Can't pair {len(embeddings1)} embeddings with {len(embeddings2)} ones"
+        )
+    n = len(embeddings1)
+    sim_scores = np.empty(n, dtype=np.float32)
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        block1 = np.asarray(embeddings1[start:end], dtype=np.float32)
+        block2 = np.asarray(embeddings2[start:end], dtype=np.float32)
+        norms1 = np.maximum(np.linalg.norm(block1, axis=1), 1e-12)
+        norms2 = np.maximum(np.linalg.norm(block2, axis=1), 1e-12)
+        dots = np.einsum("ij,ij->i", block1, block2)
+        sim_scores[start:end] = dots / (norms1 * norms2)
     return sim_scores
 
 
+def get_cached_embedding(sentences) -> np.ndarray:
+    """Embeddings of the sentences, only the ones not in the cache are encoded."""
+    return get_embedding_cache().get_embeddings(sentences, get_embedding)
+
+
+def get_similarity(sentences1, sentences2, use_cache=True) -> np.ndarray:
+    """Similarity score of each aligned sentence pair, negative scores are 0."""
+    embed: Callable[[List[str]], np.ndarray] = get_embedding
+    if use_cache:
+        embed = get_cached_embedding
+    embeddings1 = embed(sentences1)
+    embeddings2 = embed(sentences2)
+    return np.maximum(get_pairs_cos_sim(embeddings1, embeddings2), 0.0)
+
+
 def get_text_paths(tm_path: Path) -> Dict[str, Path]:
     text_paths = {}
     for fn in tm_path.iterdir():
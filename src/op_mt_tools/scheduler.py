@@ -0,0 +1,97 @@
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+from tinydb import Query, TinyDB
+
+from . import config
+from . import types as t
+
+COSTS_DB_PATH = config.DATA_PATH / "text_pair_costs.json"
+DEFAULT_SECS_PER_KB = 0.5  # used until some durations are recorded
+
+
+def get_local_text_size(text_id: t.TEXT_ID) -> Optional[int]:
+    """Get size in KB of the already downloaded text, if any."""
+    text_path = config.TEXTS_PATH / text_id
+    if not text_path.is_dir():
+        return None
+    text_fns = list(text_path.glob("*.txt"))
+    if not text_fns:
+        return None
+    return sum(fn.stat().st_size for fn in text_fns) // 1024
+
+
+def get_text_pair_size(text_id: t.TEXT_ID_NO_PREFIX) -> Optional[int]:
+    """Get size in KB of the text pair, if both texts are downloaded."""
+    size = 0
+    for prefix in ["BO", "EN"]:
+        text_size = get_local_text_size(f"{prefix}{text_id}")
+        if text_size is None:
+            return None
+        size += text_size
+    return size
+
+
+def get_text_pair_path_size(text_pair_path: t.TEXT_PAIR_PATH) -> int:
+    """Get size in KB of downloaded text pair."""
+    size = 0
+    for text_path in text_pair_path.values():
+        for fn in Path(text_path).glob("*.txt"):
+            size += fn.stat().st_size
+    return size // 1024
+
+
+class CostModel:
+    """Estimates text pair processing time from its size.
+
+    Actual durations, including the TM creation, are recorded after each run, so that
+    estimates of later runs are based on the observed seconds per KB instead of the
+    default one.
+    """
+
+    def __init__(self, db_path: Path = COSTS_DB_PATH):
+        self._db_path = db_path
+        self._db = TinyDB(db_path)
+        self.query = Query()
+
+    def record(self, text_id: t.TEXT_ID, size_kb: int, duration: float):
+        item = {"text_id": text_id, "size_kb": size_kb, "duration": duration}
+        self._db.upsert(item, self.query.text_id == text_id)
+
+    def secs_per_kb(self) -> float:
+        records = [item for item in self._db.all() if item["size_kb"] > 0]
+        total_size = sum(item["size_kb"] for item in records)
+        if not total_size:
+            return DEFAULT_SECS_PER_KB
+        total_duration = sum(item["duration"] for item in records)
+        return total_duration / total_size
+
+    def estimate(self, text_id: t.TEXT_ID, size_kb: Optional[int]) -> float:
+        """Estimate processing time of text in seconds.
+
+        Texts of unknown size, which are not downloaded yet, are estimated from their
+        recorded duration or else the mean recorded duration.
+        """
+        item = self._db.get(self.query.text_id == text_id)
+        if item and (size_kb is None or item["size_kb"] == size_kb):
+            return item["duration"]
+        if size_kb is None:
+            durations = [item["duration"] for item in self._db.all()]
+            return sum(durations) / len(durations) if durations else 0.0
+        return size_kb * self.secs_per_kb()
+
+
+def order_by_cost(
+    text_ids: Iterable[t.TEXT_ID_NO_PREFIX], cost_model: CostModel
+) -> List[t.TEXT_ID_NO_PREFIX]:
+    """Order text pairs longest-processing-time-first.
+
+    Workers which take the next text pair from the returned list whenever they are
+    free, like the work queue workers or the aligner jobs in flight, get the LPT
+    schedule. Only the sizes of the downloaded texts are used, see `estimate`.
+    """
+    costs = {
+        text_id: cost_model.estimate(f"BO{text_id}", get_text_pair_size(text_id))
+        for text_id in text_ids
+    }
+    return sorted(costs, key=lambda text_id: costs[text_id], reverse=True)
@@ -1,58 +1,144 @@
 import argparse
+import asyncio
+import base64
+import gzip
 import json
 import logging
 import os
 import subprocess
 import tempfile
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
 
 from gradio_client import Client
 from gradio_client.utils import Status as JobStatus
 
+from . import config
 from . import types as t
-from .github_utils import commit_and_push, get_github_repos_with_prefix
-from .huggingface import start_aligner_service
+from .aligner_pool import AlignerClientPool
+from .alignment_cache import AlignmentCache, get_text_pair_hash
+from .github_utils import (
+    add_submodules,
+    check_repo_exists,
+    commit_and_push,
+    create_github_repo_from_dir,
+    get_github_repos_with_prefix,
+)
+from .local_aligner import align_text_pair, get_local_aligner_version, load_lexicon
 
 # Envs
 HF_TOKEN = os.environ["HF_TOKEN"]
 
-clients: List[Client] = []
 clients_names = [
     "openpecha/tibetan-aligner-api",
     # "openpecha/tibetan-aligner-api-2",
 ]
-client_access_count = 0
+clients_pool: Optional[AlignerClientPool] = None
+clients_pool_lock = threading.Lock()
+
+
+def get_clients_pool(max_clients: int = len(clients_names)) -> AlignerClientPool:
+    global clients_pool
+
+    if clients_pool is None:
+        # clients are acquired from many threads, the pool must be created only once
+        with clients_pool_lock:
+            if clients_pool is None:
+                pool = AlignerClientPool(clients_names[:max_clients], hf_token=HF_TOKEN)
+                pool.warm()
+                clients_pool = pool
+    return clients_pool
 
 
 def get_client(max_clients: int = len(clients_names)) -> Client:
-    global client_access_count
+    """Get client of the least-loaded aligner space, see `release_client`."""
+    return get_clients_pool(max_clients).acquire()
 
-    if len(clients) != max_clients:
-        for client_name in clients_names:
-            start_aligner_service(id_=client_name)
-            clients.append(Client(client_name, hf_token=HF_TOKEN))
 
-    client_idx = client_access_count % max_clients
-    client_access_count += 1
-    return clients[client_idx]
+def release_client(client: Client, latency: Optional[float] = None, ok=True) -> None:
+    if clients_pool is not None:
+        clients_pool.release(client, latency=latency, ok=ok)
 
 
 def run_aligner(input_json_fn: Path):
     client = get_client()
-    job = client.submit(
-        input_json_fn,
-        api_name="/align",
-    )
+    start = time.time()
+    try:
+        job = client.submit(
+            input_json_fn,
+            api_name="/align",
+        )
 
-    logging.info("Waiting for Alignment Job to start...")
-    while job.status().code != JobStatus.PROCESSING:
-        time.sleep(1)
+        logging.info("Waiting for Alignment Job to start...")
+        while job.status().code != JobStatus.PROCESSING:
+            time.sleep(1)
+    except Exception:
+        release_client(client, ok=False)
+        raise
+    release_client(client, latency=time.time() - start)
     logging.info("Alignment Job started")
     return "PROCESSING"
 
 
+async def wait_for_job_start(
+    job, poll_interval: float = 0.5, max_poll_interval: float = 30.0
+) -> str:
+    """Poll `job` status with exponential backoff until it starts processing."""
+    while job.status().code != JobStatus.PROCESSING:
+        if job.done():
+            job.result()  # raises if the job failed
+            return "FINISHED"
+        await asyncio.sleep(poll_interval)
+        poll_interval = min(poll_interval * 2, max_poll_interval)
+    return "PROCESSING"
+
+
+async def submit_alignment(input_json_fn: Path, in_flight: asyncio.Semaphore) -> str:
+    async with in_flight:
+        loop = asyncio.get_event_loop()
+        # acquiring may wait for a space to start, so keep it off the event loop
+        client = await loop.run_in_executor(None, get_client)
+        start = time.time()
+        try:
+            job = await loop.run_in_executor(
+                None, partial(client.submit, input_json_fn, api_name="/align")
+            )
+            logging.info(f"Waiting for Alignment Job of {input_json_fn} to start...")
+            status = await wait_for_job_start(job)
+        except Exception:
+            release_client(client, ok=False)
+            raise
+        release_client(client, latency=time.time() - start)
+        logging.info(f"Alignment Job of {input_json_fn} started")
+        return status
+
+
+async def submit_alignments(
+    requests: List[Path], max_in_flight: int = 2 * len(clients_names)
+) -> List["asyncio.Future[str]"]:
+    """Submit alignment jobs keeping at most `max_in_flight` jobs waiting to start.
+
+    Args:
+        requests: request body json files, see `create_request_body`.
+        max_in_flight: number of jobs submitted to the aligner spaces at a time.
+
+    Returns:
+        future of each request resolving to its job status.
+    """
+    in_flight = asyncio.Semaphore(max_in_flight)
+    return [
+        asyncio.ensure_future(submit_alignment(input_json_fn, in_flight))
+        for input_json_fn in requests
+    ]
+
+
+INLINE_CONTENT_ENCODING = "gzip+base64"
+
+
 def get_raw_github_file_url(local_view_fn: Path):
     """Get raw github file url.
 
@@ -70,12 +156,26 @@ def get_raw_github_file_url(local_view_fn: Path):
     )
 
 
-def create_request_body(text_id, text_pair_view_path, base_dir: Path) -> Path:
+def encode_view_file(view_path: Path) -> str:
+    """Gzip and base64 encode content of view file to send it in a request body."""
+    content = Path(view_path).read_bytes()
+    return base64.b64encode(gzip.compress(content)).decode("ascii")
+
+
+def decode_view_content(encoded_content: str) -> str:
+    return gzip.decompress(base64.b64decode(encoded_content)).decode("utf-8")
+
+
+def create_request_body(
+    text_id, text_pair_view_path, base_dir: Path, inline: bool = False
+) -> Path:
     """Create request body for TM creation.
 
     Args:
         text_id: Text id.
         text_pair_view_path: Dict of language code and view path.
+        inline: Whether to send the content of the views instead of their raw github
+            urls, so that the views don't have to be pushed before alignment.
 
     Returns:
         request_json_fn(Path): Request body saved in json.
@@ -84,22 +184,251 @@ def create_request_body(text_id, text_pair_view_path, base_dir: Path) -> Path:
         "text_id": text_id,
     }
     for lang_code, view_path in text_pair_view_path.items():
-        request_body[f"{lang_code}_file_url"] = get_raw_github_file_url(view_path)
+        if inline:
+            request_body[f"{lang_code}_file_content"] = encode_view_file(view_path)
+        else:
+            request_body[f"{lang_code}_file_url"] = get_raw_github_file_url(view_path)
+    if inline:
+        request_body["content_encoding"] = INLINE_CONTENT_ENCODING
 
     request_body_json_fn = base_dir / "request_body.json"
     json.dump(request_body, request_body_json_fn.open("w"))
     return request_body_json_fn
 
 
-def create_TM(text_pair_view_path: Dict[t.LANG_CODE, Path], text_id: str) -> str:
+ALIGNERS_REGISTRY: Dict[str, Callable[[t.TEXT_PAIR_VIEW_PATH, str], str]] = {}
+
+
+def register_aligner(name):
+    def wrapper(fn):
+        ALIGNERS_REGISTRY[name] = fn
+        return fn
+
+    return wrapper
+
+
+class AlignersEnum:
+    REMOTE = "remote"
+    REMOTE_INLINE = "remote-inline"
+    LOCAL = "local"
+
+
+REMOTE_ALIGNERS = [AlignersEnum.REMOTE, AlignersEnum.REMOTE_INLINE]
+
+
+def needs_published_views(aligner: str) -> bool:
+    """Whether the aligner downloads the views from github."""
+    return aligner == AlignersEnum.REMOTE
+
+
+@register_aligner(AlignersEnum.REMOTE)
+def remote_aligner(
+    text_pair_view_path: t.TEXT_PAIR_VIEW_PATH, text_id: str, inline: bool = False
+) -> str:
+    """Submit text pair to the aligner space, which publishes the TM itself."""
     with tempfile.TemporaryDirectory() as tmp_dir:
         request_body_json_fn = create_request_body(
-            text_id, text_pair_view_path, base_dir=Path(tmp_dir)
+            text_id, text_pair_view_path, base_dir=Path(tmp_dir), inline=inline
         )
         status = run_aligner(request_body_json_fn)
         return status
 
 
+@register_aligner(AlignersEnum.REMOTE_INLINE)
+def remote_inline_aligner(
+    text_pair_view_path: t.TEXT_PAIR_VIEW_PATH, text_id: str
+) -> str:
+    """Submit text pair with the content of its views, so they needn't be pushed."""
+    return remote_aligner(text_pair_view_path, text_id, inline=True)
+
+
+@register_aligner(AlignersEnum.LOCAL)
+def local_aligner(text_pair_view_path: t.TEXT_PAIR_VIEW_PATH, text_id: str) -> str:
+    """Align text pair on this machine and publish the TM."""
+    tm_path = get_tm_path(text_id)
+    align_text_pair(
+        bo_view_fn=Path(text_pair_view_path["bo"]),
+        en_view_fn=Path(text_pair_view_path["en"]),
+        tm_path=tm_path,
+        lexicon=load_lexicon(),
+    )
+    publish_TM(tm_path)
+    return "ALIGNED"
+
+
+ALIGNERS_VERSION = {
+    AlignersEnum.REMOTE: "tibetan-aligner-api",
+    AlignersEnum.REMOTE_INLINE: "tibetan-aligner-api",
+    # adding or updating the lexicon invalidates the cached alignments
+    AlignersEnum.LOCAL: f"local-aligner-{get_local_aligner_version()}",
+}
+CACHED_STATUS = "CACHED"
+
+
+def get_tm_path(text_id: str) -> Path:
+    return config.TMS_PATH / f"TM{text_id}"
+
+
+def publish_TM(tm_path: Path) -> None:
+    if (tm_path / ".git").is_dir():
+        commit_and_push(tm_path, "update TM")
+    else:
+        create_github_repo_from_dir(tm_path)
+
+
+def reuse_cached_TM(cache: AlignmentCache, key: str, text_id: str) -> bool:
+    """Check if the text pair is already aligned and its TM is published.
+
+    Stored TM files are restored and published again. Entries without TM files are
+    dropped if their TM repo doesn't exist anymore, so that the text pair is
+    realigned.
+    """
+    entry = cache.lookup(key, text_id)
+    if entry is None:
+        return False
+    tm_path = get_tm_path(text_id)
+    if entry["has_outputs"]:
+        cache.restore(key, tm_path)
+        publish_TM(tm_path)
+    elif not check_repo_exists(
+        os.environ["MAI_GITHUB_ORG"], tm_path.name, os.environ["GITHUB_TOKEN"]
+    ):
+        cache.remove(key)
+        return False
+    return True
+
+
+def cache_published_TM(
+    cache: AlignmentCache, key: str, text_id: str, aligner: str
+) -> None:
+    """Add TM to the cache if the aligner has published it before returning.
+
+    Remote aligners publish the TM after the job is submitted, so their TMs are
+    added by `aligner_jobs.collect` once the TM repo is confirmed.
+    """
+    if aligner in REMOTE_ALIGNERS:
+        return
+    cache.put(key, text_id, tm_path=get_tm_path(text_id))
+
+
+def create_TM(
+    text_pair_view_path: t.TEXT_PAIR_VIEW_PATH,
+    text_id: str,
+    aligner: str = AlignersEnum.REMOTE,
+    cache: Optional[AlignmentCache] = None,
+) -> str:
+    aligner_fn = ALIGNERS_REGISTRY.get(aligner)
+    if aligner_fn is None:
+        raise ValueError(f"Aligner {aligner} not found.")
+    if cache is None:
+        return aligner_fn(text_pair_view_path, text_id)
+
+    key = get_text_pair_hash(text_pair_view_path, ALIGNERS_VERSION[aligner])
+    is_cached = reuse_cached_TM(cache, key, text_id)
+    cache.flush_stats()
+    if is_cached:
+        return CACHED_STATUS
+    status = aligner_fn(text_pair_view_path, text_id)
+    cache_published_TM(cache, key, text_id, aligner)
+    return status
+
+
+def _create_TMs(
+    text_pairs_view_path: Dict[str, t.TEXT_PAIR_VIEW_PATH],
+    max_in_flight: int,
+    aligner: str,
+) -> Dict[str, str]:
+    if aligner not in REMOTE_ALIGNERS:
+        statuses = {}
+        with ProcessPoolExecutor() as pool:
+            futures = {
+                text_id: pool.submit(create_TM, text_pair_view_path, text_id, aligner)
+                for text_id, text_pair_view_path in text_pairs_view_path.items()
+            }
+            for text_id, future in futures.items():
+                try:
+                    statuses[text_id] = future.result()
+                except Exception as e:
+                    statuses[text_id] = f"FAILED: {e}"
+        return statuses
+
+    async def submit_all(request_fns: List[Path]) -> list:
+        futures = await submit_alignments(request_fns, max_in_flight=max_in_flight)
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        request_fns = []
+        for text_id, text_pair_view_path in text_pairs_view_path.items():
+            request_dir = Path(tmp_dir) / text_id
+            request_dir.mkdir()
+            request_fns.append(
+                create_request_body(
+                    text_id,
+                    text_pair_view_path,
+                    base_dir=request_dir,
+                    inline=aligner == AlignersEnum.REMOTE_INLINE,
+                )
+            )
+        results = asyncio.run(submit_all(request_fns))
+
+    return {
+        text_id: result if isinstance(result, str) else f"FAILED: {result}"
+        for text_id, result in zip(text_pairs_view_path, results)
+    }
+
+
+def create_TMs(
+    text_pairs_view_path: Dict[str, t.TEXT_PAIR_VIEW_PATH],
+    max_in_flight: int = 2 * len(clients_names),
+    aligner: str = AlignersEnum.REMOTE,
+    cache: Optional[AlignmentCache] = None,
+) -> Dict[str, str]:
+    """Create TMs of many text pairs concurrently.
+
+    Args:
+        text_pairs_view_path: view paths of each text pair by text id.
+        max_in_flight: number of jobs submitted to the aligner spaces at a time.
+        aligner: name of the aligner, local aligner uses all the cpu cores.
+        cache: if provided, text pairs whose TM was published before with the same
+            views are skipped.
+
+    Returns:
+        status of each text id, or the error message if the submission failed.
+    """
+    if cache is None:
+        return _create_TMs(text_pairs_view_path, max_in_flight, aligner)
+
+    keys, statuses = {}, {}
+    for text_id, text_pair_view_path in text_pairs_view_path.items():
+        keys[text_id] = get_text_pair_hash(
+            text_pair_view_path, ALIGNERS_VERSION[aligner]
+        )
+        if reuse_cached_TM(cache, keys[text_id], text_id):
+            statuses[text_id] = CACHED_STATUS
+
+    uncached_text_pairs_view_path = {
+        text_id: text_pair_view_path
+        for text_id, text_pair_view_path in text_pairs_view_path.items()
+        if text_id not in statuses
+    }
+    if uncached_text_pairs_view_path:
+        statuses.update(
+            _create_TMs(uncached_text_pairs_view_path, max_in_flight, aligner)
+        )
+    for text_id in uncached_text_pairs_view_path:
+        if statuses[text_id].startswith("FAILED"):
+            continue
+        cache_published_TM(cache, keys[text_id], text_id, aligner)
+
+    cache.flush_stats()
+    cache_stats = cache.stats()
+    print(
+        f"[INFO] Alignment cache hit rate: {cache_stats['hit_rate']:.2%} "
+        f"({cache_stats['hits']} hits, {cache_stats['misses']} misses)"
+    )
+    return {text_id: statuses[text_id] for text_id in text_pairs_view_path}
+
+
 def get_all_TMs() -> Optional[List[str]]:
     """Get all latest TMs."""
     org = os.environ["MAI_GITHUB_ORG"]
@@ -108,9 +437,13 @@ def get_all_TMs() -> Optional[List[str]]:
     return repos
 
 
+def get_TM_url(tm: str) -> str:
+    return f"https://github.com/{os.environ['MAI_GITHUB_ORG']}/{tm}.git"
+
+
 def export_TM(tm: str, export_dir: Path, branch):
     """Export TM as submodules of `output_dir`."""
-    tm_url = f"https://github.com/{os.environ['MAI_GITHUB_ORG']}/{tm}.git"
+    tm_url = get_TM_url(tm)
     submodule_path = f"data/{tm}"
     subprocess.run(
         ["git", "submodule", "add", "-b", branch, "--force", tm_url, submodule_path],
@@ -122,8 +455,12 @@ def export_all_TMs(
     export_dir: Path,
     tm_ids: Optional[List[t.TEXT_ID]] = None,
     branch: str = "main",
+    max_workers: int = 8,
 ):
-    """Export all latest TMs."""
+    """Export all latest TMs.
+
+    TMs are shallow cloned in parallel and added as submodules in a single commit.
+    """
     print("[INFO] Exporting all TMs...")
 
     if not tm_ids:
@@ -133,17 +470,25 @@ def export_all_TMs(
         print("[INFO] No TM found. Exiting...")
         return
 
+    submodules = {}
     for tm_id in tm_ids:
         if not tm_id:
             continue
-        if export_dir.joinpath(tm_id).exists():
+        if export_dir.joinpath("data", tm_id).exists():
             print(f"[INFO] {tm_id} already exists. Skipping...")
             continue
-        export_TM(tm_id, export_dir, branch)
+        submodules[f"data/{tm_id}"] = get_TM_url(tm_id)
+
+    errors = add_submodules(
+        export_dir, submodules, branch=branch, max_workers=max_workers
+    )
+    failed = {path: error for path, error in errors.items() if error}
+    for path, error in failed.items():
+        print(f"[ERROR] Failed to export {Path(path).name}: {error}")
 
     msg = "add TMs on " + time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
     commit_and_push(export_dir, msg)
-    print("[INFO] Exporting all TMs done!")
+    print(f"[INFO] Exporting all TMs done! {len(errors) - len(failed)} TMs added.")
 
 
 if __name__ == "__main__":
@@ -159,13 +504,21 @@ if __name__ == "__main__":
         default="main",
         help="default branch of the TM repo",
     )
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=8,
+        help="number of TMs cloned at a time",
+    )
     parser.add_argument(
         "--not-tm",
         action="store_true",
     )
     args = parser.parse_args()
 
-    export_all_TMs(args.export_dir, tm_ids=args.tm_ids, branch=args.branch)
-    args = parser.parse_args()
-
-    export_all_TMs(args.export_dir, tm_ids=args.tm_ids, branch=args.branch)
+    export_all_TMs(
+        args.export_dir,
+        tm_ids=args.tm_ids,
+        branch=args.branch,
+        max_workers=args.max_workers,
+    )
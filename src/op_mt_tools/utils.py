@@ -1,7 +1,9 @@
 import os
+import sqlite3
 import subprocess
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Tuple
+from typing import Iterator, Tuple
 
 from git import Repo, cmd
 from openpecha.core import metadata
@@ -59,8 +61,8 @@ def get_pkg_version():
     return pkg_resources.get_distribution("op-mt-tools").version
 
 
-def commit_and_push(path: Path) -> None:
-    """Commit and push local repo."""
+def commit_repo(path: Path) -> None:
+    """Commit all the changes of local repo."""
     # configure git users
     subprocess.run(
         f"git config --global user.name {os.environ['GITHUB_USERNAME']}".split()
@@ -71,7 +73,38 @@ def commit_and_push(path: Path) -> None:
     repo = Repo(path)
     repo.git.add(".", "--all")
     repo.git.commit("-m", "Add text pair")
-    repo.remotes.origin.push()
+
+
+def push_repo(path: Path) -> None:
+    Repo(path).remotes.origin.push()
+
+
+@contextmanager
+def repo_lock(path: Path, timeout: float = 600) -> Iterator[None]:
+    """Lock local repo, so that one process at a time updates, commits or pushes it.
+
+    The lock is a SQLite write transaction on a file in `.git`, so it is shared by
+    every process using the repo and released if the process dies.
+    """
+    conn = sqlite3.connect(
+        str(path / ".git" / "op_mt_tools.lock"),
+        timeout=timeout,
+        isolation_level=None,
+    )
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        finally:
+            conn.execute("ROLLBACK")
+    finally:
+        conn.close()
+
+
+def commit_and_push(path: Path) -> None:
+    """Commit and push local repo."""
+    commit_repo(path)
+    push_repo(path)
 
 
 def clone_or_pull_repo(repo_url: str, local_repo_path: Path) -> None:
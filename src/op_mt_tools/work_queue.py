@@ -0,0 +1,286 @@
+import argparse
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from . import config
+from .scheduler import CostModel, order_by_cost
+
+QUEUE_DB_PATH = config.DATA_PATH / "work_queue.sqlite"
+
+
+class TaskStatus:
+    PENDING = "pending"
+    LEASED = "leased"
+    DONE = "done"
+    DEAD = "dead"
+
+
+def get_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class WorkQueue:
+    """Work queue of text ids backed by a SQLite table.
+
+    Workers lease tasks for `lease_secs` and must heartbeat to keep them. Tasks whose
+    lease expires are handed to another worker, and tasks failing `max_attempts`
+    times are moved to the dead letters. Every worker process, on any host which can
+    reach the db file, can pull tasks concurrently. A task which is done is never
+    leased again.
+
+    Args:
+        db_path: Path to the SQLite db file shared by all the workers.
+        name: Name of the queue, eg: "text_pairs" or "qc".
+        lease_secs: Seconds a task stays leased without heartbeat.
+        max_attempts: Number of attempts before the task is dead lettered.
+    """
+
+    def __init__(
+        self,
+        db_path: Path = QUEUE_DB_PATH,
+        name: str = "text_pairs",
+        lease_secs: int = 600,
+        max_attempts: int = 3,
+    ):
+        self.db_path = db_path
+        self.name = name
+        self.lease_secs = lease_secs
+        self.max_attempts = max_attempts
+        self._create_table()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.db_path), timeout=60, isolation_level=None)
+        return conn
+
+    def _create_table(self):
+        conn = self._connect()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tasks (
+                queue TEXT NOT NULL,
+                task_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                lease_owner TEXT,
+                lease_expires_at REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                updated_at REAL,
+                PRIMARY KEY (queue, task_id)
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (queue, status)")
+        conn.close()
+
+    def enqueue(self, task_ids: List[str]) -> int:
+        """Add tasks to the queue, tasks already in the queue are ignored.
+
+        Returns:
+            number of newly added tasks.
+        """
+        conn = self._connect()
+        cursor = conn.executemany(
+            "INSERT OR IGNORE INTO tasks (queue, task_id, status, updated_at) "
+            "VALUES (?, ?, ?, ?)",
+            [
+                (self.name, task_id, TaskStatus.PENDING, time.time())
+                for task_id in task_ids
+            ],
+        )
+        conn.close()
+        return cursor.rowcount
+
+    def lease(self, worker_id: str) -> Optional[str]:
+        """Lease the next available task to `worker_id`."""
+        conn = self._connect()
+        now = time.time()
+        try:
+            # take the write lock upfront so that no two workers lease the same task
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE tasks SET status = ?, last_error = 'lease expired', updated_at = ? "
+                "WHERE queue = ? AND status = ? AND lease_expires_at < ? "
+                "AND attempts >= ?",
+                (
+                    TaskStatus.DEAD,
+                    now,
+                    self.name,
+                    TaskStatus.LEASED,
+                    now,
+                    self.max_attempts,
+                ),
+            )
+            row = conn.execute(
+                "SELECT task_id FROM tasks WHERE queue = ? "
+                "AND (status = ? OR (status = ? AND lease_expires_at < ?)) "
+                "ORDER BY rowid LIMIT 1",
+                (self.name, TaskStatus.PENDING, TaskStatus.LEASED, now),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            task_id = row[0]
+            conn.execute(
+                "UPDATE tasks SET status = ?, lease_owner = ?, lease_expires_at = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE queue = ? AND task_id = ?",
+                (
+                    TaskStatus.LEASED,
+                    worker_id,
+                    now + self.lease_secs,
+                    now,
+                    self.name,
+                    task_id,
+                ),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return task_id
+
+    def _update_leased(self, task_id: str, worker_id: str, sql: str, params: tuple):
+        conn = self._connect()
+        cursor = conn.execute(
+            f"{sql} WHERE queue = ? AND task_id = ? AND status = ? AND lease_owner = ?",
+            params + (self.name, task_id, TaskStatus.LEASED, worker_id),
+        )
+        conn.close()
+        return cursor.rowcount == 1
+
+    def heartbeat(self, task_id: str, worker_id: str) -> bool:
+        """Extend the lease, returns False if the worker no longer owns the task."""
+        now = time.time()
+        return self._update_leased(
+            task_id,
+            worker_id,
+            "UPDATE tasks SET lease_expires_at = ?, updated_at = ?",
+            (now + self.lease_secs, now),
+        )
+
+    def complete(self, task_id: str, worker_id: str) -> bool:
+        return self._update_leased(
+            task_id,
+            worker_id,
+            "UPDATE tasks SET status = ?, lease_owner = NULL, updated_at = ?",
+            (TaskStatus.DONE, time.time()),
+        )
+
+    def fail(self, task_id: str, worker_id: str, error: str) -> bool:
+        """Release the task for retry, or dead letter it after `max_attempts`."""
+        return self._update_leased(
+            task_id,
+            worker_id,
+            "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+            "lease_owner = NULL, last_error = ?, updated_at = ?",
+            (
+                self.max_attempts,
+                TaskStatus.DEAD,
+                TaskStatus.PENDING,
+                error,
+                time.time(),
+            ),
+        )
+
+    def dead_letters(self) -> List[Tuple[str, str]]:
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT task_id, last_error FROM tasks WHERE queue = ? AND status = ?",
+            (self.name, TaskStatus.DEAD),
+        ).fetchall()
+        conn.close()
+        return rows
+
+    def stats(self) -> Dict[str, int]:
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT status, COUNT(*) FROM tasks WHERE queue = ? GROUP BY status",
+            (self.name,),
+        ).fetchall()
+        conn.close()
+        return dict(rows)
+
+
+def _keep_alive(
+    queue: WorkQueue, task_id: str, worker_id: str, stop: threading.Event
+) -> None:
+    while not stop.wait(queue.lease_secs / 3):
+        if not queue.heartbeat(task_id, worker_id):
+            return
+
+
+def run_worker(
+    queue: WorkQueue,
+    process_fn: Callable[[str], None],
+    worker_id: Optional[str] = None,
+) -> int:
+    """Process tasks from `queue` with `process_fn` until the queue is drained.
+
+    `process_fn` should raise on failure so that the task is retried.
+
+    Returns:
+        number of tasks processed successfully.
+    """
+    worker_id = worker_id if worker_id else get_worker_id()
+    print(f"[INFO] Worker {worker_id} pulling from queue {queue.name}...")
+    n_done = 0
+    while True:
+        task_id = queue.lease(worker_id)
+        if task_id is None:
+            break
+        stop_heartbeat = threading.Event()
+        heartbeat = threading.Thread(
+            target=_keep_alive,
+            args=(queue, task_id, worker_id, stop_heartbeat),
+            daemon=True,
+        )
+        heartbeat.start()
+        try:
+            process_fn(task_id)
+        except Exception as e:
+            print(f"[ERROR] Task {task_id} failed: {e}")
+            queue.fail(task_id, worker_id, str(e))
+        else:
+            if queue.complete(task_id, worker_id):
+                n_done += 1
+        finally:
+            stop_heartbeat.set()
+            heartbeat.join()
+    print(f"[INFO] Worker {worker_id} done, {n_done} tasks completed.")
+    return n_done
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage work queue of text ids")
+    parser.add_argument("command", choices=["enqueue", "stats", "dead"])
+    parser.add_argument("queue", help="queue name, eg: text_pairs or qc")
+    parser.add_argument("task_ids", nargs="*", help="task ids to enqueue")
+    parser.add_argument("--db", type=Path, default=QUEUE_DB_PATH)
+    parser.add_argument(
+        "--by_cost",
+        action="store_true",
+        help="enqueue text pairs longest first, as estimated by the cost model",
+    )
+    args = parser.parse_args()
+
+    queue = WorkQueue(db_path=args.db, name=args.queue)
+    if args.command == "enqueue":
+        task_ids = args.task_ids
+        if args.by_cost:
+            # workers lease tasks in enqueue order, so longest first is LPT
+            task_ids = order_by_cost(task_ids, CostModel())
+        n_added = queue.enqueue(task_ids)
+        print(f"[INFO] {n_added} tasks added to {args.queue}")
+    elif args.command == "stats":
+        for status, count in queue.stats().items():
+            print(f"{status}: {count}")
+    elif args.command == "dead":
+        for task_id, error in queue.dead_letters():
+            print(f"{task_id}: {error}")
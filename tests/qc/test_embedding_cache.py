@@ -0,0 +1,57 @@
+from unittest import mock
+
+import numpy as np
+
+from op_mt_tools.qc.embedding_cache import EmbeddingCache
+from op_mt_tools.qc.tm import get_similarity
+
+
+def fake_encode(sentences):
+    return np.array([[len(sent), 1.0, -2.0] for sent in sentences], dtype=np.float32)
+
+
+def test_embedding_cache_encodes_only_misses(tmp_path):
+    cache = EmbeddingCache("org/model", cache_path=tmp_path)
+    encode_fn = mock.Mock(side_effect=fake_encode)
+
+    embeddings = cache.get_embeddings(["a", "bb", "a"], encode_fn)
+    cached_embeddings = EmbeddingCache("org/model", tmp_path).get_embeddings(
+        ["bb", "ccc", "a"], encode_fn
+    )
+
+    assert np.array_equal(embeddings, fake_encode(["a", "bb", "a"]))
+    assert np.array_equal(cached_embeddings, fake_encode(["bb", "ccc", "a"]))
+    assert encode_fn.call_args_list == [mock.call(["a", "bb"]), mock.call(["ccc"])]
+    assert (tmp_path / "org--model" / "embeddings.f16").stat().st_size == 3 * 3 * 2
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 2, 3)
+
+
+def test_embedding_cache_empty_sentences(tmp_path):
+    cache = EmbeddingCache("model", cache_path=tmp_path)
+
+    embeddings = cache.get_embeddings([], fake_encode)
+
+    assert embeddings.shape == (0, 0)
+
+
+def test_get_similarity_with_embedding_cache(tmp_path):
+    rng = np.random.default_rng(0)
+    sentences = [f"sent {i}" for i in range(20)]
+    sent_embeddings = {sent: rng.normal(size=8) for sent in sentences}
+
+    def encode(sents):
+        return np.array([sent_embeddings[sent] for sent in sents], dtype=np.float32)
+
+    cache = EmbeddingCache("model", cache_path=tmp_path)
+    with mock.patch("op_mt_tools.qc.tm.get_embedding", side_effect=encode), mock.patch(
+        "op_mt_tools.qc.tm.get_embedding_cache", return_value=cache
+    ):
+        sim_scores = get_similarity(sentences[:10], sentences[10:], use_cache=False)
+        cached_sim_scores = get_similarity(sentences[:10], sentences[10:])
+        cached_sim_scores_2 = get_similarity(sentences[:10], sentences[10:])
+
+    # embeddings are stored as float16
+    assert np.allclose(sim_scores, cached_sim_scores, atol=1e-3)
+    assert np.array_equal(cached_sim_scores, cached_sim_scores_2)
+    assert cache.stats()["hits"] == 20
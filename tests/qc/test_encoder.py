@@ -0,0 +1,80 @@
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from op_mt_tools.qc.onnx_encoder import OnnxSentenceEncoder
+from op_mt_tools.qc.tm import (
+    MODEL_NAME,
+    EncoderBackend,
+    get_embedding,
+    get_embedding_cache,
+    get_model,
+    get_token_budget_batches,
+    set_encoder_backend,
+)
+
+
+def test_get_token_budget_batches():
+    batches = get_token_budget_batches([1, 2, 2, 3, 5, 9, 20], max_batch_tokens=10)
+
+    assert batches == [(0, 3), (3, 5), (5, 6), (6, 7)]
+
+
+class FakeModel:
+    max_seq_length = 128
+
+    def __init__(self):
+        self.batches = []
+
+    def tokenizer(self, sentences, truncation, max_length):
+        return {"input_ids": [sent.split() for sent in sentences]}
+
+    def get_sentence_embedding_dimension(self):
+        return 2
+
+    def encode(self, sentences, batch_size, show_progress_bar):
+        self.batches.append(sentences)
+        return np.array(
+            [[len(sent), sent.count("b")] for sent in sentences], np.float32
+        )
+
+
+def test_get_embedding_sorts_sentences_by_length():
+    model = FakeModel()
+    sentences = ["a " * 8, "b", "a a", "b " * 6, "a"]
+
+    with mock.patch("op_mt_tools.qc.tm.get_model", return_value=model):
+        embeddings = get_embedding(sentences, max_batch_tokens=8)
+
+    assert model.batches == [["b", "a", "a a"], ["b " * 6], ["a " * 8]]
+    assert np.array_equal(embeddings, model.encode(sentences, 5, False))
+
+
+def test_get_embedding_without_sentences():
+    with mock.patch("op_mt_tools.qc.tm.get_model", return_value=FakeModel()):
+        embeddings = get_embedding([])
+
+    assert embeddings.shape == (0, 2)
+
+
+@mock.patch("op_mt_tools.qc.tm.get_onnx_encoder")
+def test_onnx_encoder_backend(mock_get_onnx_encoder, tmp_path):
+    try:
+        set_encoder_backend(EncoderBackend.ONNX)
+        with mock.patch("op_mt_tools.qc.tm.EmbeddingCache") as mock_embedding_cache:
+            model = get_model()
+            get_embedding_cache()
+    finally:
+        set_encoder_backend(EncoderBackend.TORCH)
+
+    assert model is mock_get_onnx_encoder.return_value
+    mock_get_onnx_encoder.assert_called_once_with(MODEL_NAME)
+    # embeddings of the quantized model are cached apart from the torch ones
+    mock_embedding_cache.assert_called_once_with(f"{MODEL_NAME}-onnx-int8")
+
+
+def test_onnx_encoder_backend_without_onnxruntime(tmp_path):
+    with mock.patch.dict("sys.modules", {"onnxruntime": None}):
+        with pytest.raises(ImportError, match="onnx extra"):
+            OnnxSentenceEncoder(tmp_path)
@@ -1,7 +1,12 @@
 from unittest import mock
 
-from op_mt_tools.qc.pipeline import RankMarker, SimilarityMetric
-from op_mt_tools.qc.tm import get_similarity
+import numpy as np
+import pytest
+import torch
+from sentence_transformers import util
+
+from op_mt_tools.qc.pipeline import RankMarker, SimilarityMetric, run_pipeline
+from op_mt_tools.qc.tm import get_pairs_cos_sim, get_similarity
 
 
 def test_get_similarity():
@@ -10,12 +15,31 @@ def test_get_similarity():
 
     sim_scores = get_similarity(bo_sents, en_sents)
 
-    assert isinstance(sim_scores, list)
-    assert isinstance(sim_scores[0], float)
+    assert isinstance(sim_scores, np.ndarray)
     assert sim_scores[0] >= 0.0
     assert len(sim_scores) == 1
 
 
+def test_get_pairs_cos_sim_same_as_cos_sim_diagonal():
+    rng = np.random.default_rng(0)
+    embeddings1 = rng.normal(size=(10, 8)).astype(np.float32)
+    embeddings2 = rng.normal(size=(10, 8)).astype(np.float32)
+    embeddings2[3] = 0.0
+
+    sim_scores = get_pairs_cos_sim(embeddings1, embeddings2, block_size=4)
+
+    cos_sim = util.cos_sim(torch.from_numpy(embeddings1), torch.from_numpy(embeddings2))
+    assert np.allclose(sim_scores, np.diag(cos_sim.numpy()), atol=1e-6)
+
+
+def test_get_pairs_cos_sim_length_mismatch():
+    embeddings1 = np.ones((3, 8), dtype=np.float32)
+    embeddings2 = np.ones((2, 8), dtype=np.float32)
+
+    with pytest.raises(ValueError):
+        get_pairs_cos_sim(embeddings1, embeddings2)
+
+
 @mock.patch("op_mt_tools.qc.pipeline.get_similarity")
 def test_similarity_metric_0(mock_get_similarity):
     bo_sents = ["bo_text"]
@@ -97,3 +121,121 @@ def test_remove_rank_marker():
 
     assert ranked_bo_sents[3] == "bo_text"
     assert ranked_en_sents[3] == "en_text"
+
+
+def make_tm(tm_path, n_pairs):
+    tm_path.mkdir()
+    bo_sents = [f"bo_{tm_path.name}_{i}" for i in range(n_pairs)]
+    en_sents = [f"en_{tm_path.name}_{i}" for i in range(n_pairs)]
+    (tm_path / f"{tm_path.name}-bo.txt").write_text("\n".join(bo_sents))
+    (tm_path / f"{tm_path.name}-en.txt").write_text("\n".join(en_sents))
+    return tm_path
+
+
+@mock.patch("op_mt_tools.qc.pipeline.time")
+@mock.patch("op_mt_tools.qc.pipeline.get_embedding_cache")
+@mock.patch("op_mt_tools.qc.pipeline.commit_and_push")
+@mock.patch("op_mt_tools.qc.pipeline.get_similarity")
+@mock.patch("op_mt_tools.qc.pipeline.download_tm")
+def test_run_pipeline_batches_tms(
+    mock_download_tm,
+    mock_get_similarity,
+    mock_commit_and_push,
+    mock_get_embedding_cache,
+    mock_time,
+    tmp_path,
+):
+    tm_paths = {
+        "TM1": make_tm(tmp_path / "TM1", 2),
+        "TM2": make_tm(tmp_path / "TM2", 3),
+        "TM3": make_tm(tmp_path / "TM3", 4),
+    }
+
+    def download_tm(tm_id):
+        if tm_id not in tm_paths:
+            raise ValueError(f"{tm_id} not found")
+        return tm_paths[tm_id]
+
+    mock_download_tm.side_effect = download_tm
+    cache = mock_get_embedding_cache.return_value
+    cache.misses = 0
+    cache.stats.return_value = dict(
+        hits=0, misses=0, hit_rate=0.0, entries=0, size_mb=0.0
+    )
+
+    def get_similarity(bo_sents, en_sents):
+        # only the en sentences of the second batch are already cached
+        cache.misses += len(bo_sents) + (len(en_sents) if len(bo_sents) == 5 else 0)
+        return np.array([0.9 if sent.endswith("_0") else 0.1 for sent in bo_sents])
+
+    mock_get_similarity.side_effect = get_similarity
+    # each batch takes 1 sec to encode
+    mock_time.time.side_effect = [0.0, 1.0, 1.0, 2.0]
+
+    sents_per_sec = run_pipeline(["TM1", "TM404", "TM2", "TM3"], batch_size=5)
+
+    # TM1 and TM2 fill the first batch, TM3 is scored in the last one
+    assert [len(call.args[0]) for call in mock_get_similarity.call_args_list] == [5, 4]
+    for tm_id, tm_path in tm_paths.items():
+        bo_lines = (tm_path / f"{tm_id}-bo.txt").read_text().splitlines()
+        assert bo_lines[0] == f"bo_{tm_id}_0"
+        assert all(line.startswith("3️⃣ bo_") for line in bo_lines[1:])
+    assert mock_commit_and_push.call_count == 3
+    # 5 + 5 + 4 encoded sentences in 2 secs, the cached en sentences are not counted
+    assert sents_per_sec == 7.0
+
+
+@mock.patch("op_mt_tools.qc.pipeline.commit_and_push")
+@mock.patch("op_mt_tools.qc.pipeline.get_similarity")
+@mock.patch("op_mt_tools.qc.pipeline.download_tm")
+def test_run_pipeline_skips_unaligned_tm(
+    mock_download_tm, mock_get_similarity, mock_commit_and_push, tmp_path
+):
+    tm_paths = {
+        "TM1": make_tm(tmp_path / "TM1", 3),
+        "TM2": make_tm(tmp_path / "TM2", 2),
+    }
+    (tm_paths["TM1"] / "TM1-en.txt").write_text("en_TM1_0\nen_TM1_1")
+    mock_download_tm.side_effect = lambda tm_id: tm_paths[tm_id]
+    mock_get_similarity.side_effect = lambda bo_sents, en_sents: np.array(
+        [0.9 if bo[3:] == en[3:] else 0.1 for bo, en in zip(bo_sents, en_sents)]
+    )
+
+    run_pipeline(["TM1", "TM2"], batch_size=10)
+
+    assert len(mock_get_similarity.call_args_list) == 1
+    assert mock_get_similarity.call_args.args[0] == ["bo_TM2_0", "bo_TM2_1"]
+    bo_text = (tm_paths["TM1"] / "TM1-bo.txt").read_text()
+    assert bo_text == "bo_TM1_0\nbo_TM1_1\nbo_TM1_2"
+    bo_lines = (tm_paths["TM2"] / "TM2-bo.txt").read_text().splitlines()
+    assert bo_lines == ["bo_TM2_0", "bo_TM2_1"]
+    assert mock_commit_and_push.call_count == 1
+
+
+@mock.patch("op_mt_tools.qc.pipeline.commit_and_push")
+@mock.patch("op_mt_tools.qc.pipeline.get_similarity")
+@mock.patch("op_mt_tools.qc.pipeline.download_tm")
+def test_run_pipeline_bounds_prefetched_tms(
+    mock_download_tm, mock_get_similarity, mock_commit_and_push, tmp_path
+):
+    tm_ids = [f"TM{i}" for i in range(6)]
+    tm_paths = {tm_id: make_tm(tmp_path / tm_id, 1) for tm_id in tm_ids}
+    downloaded = []
+    n_downloaded_when_scored = []
+
+    def download_tm(tm_id):
+        downloaded.append(tm_id)
+        return tm_paths[tm_id]
+
+    def get_similarity(bo_sents, en_sents):
+        n_downloaded_when_scored.append(len(downloaded))
+        return np.ones(len(bo_sents))
+
+    mock_download_tm.side_effect = download_tm
+    mock_get_similarity.side_effect = get_similarity
+
+    run_pipeline(tm_ids, batch_size=1, max_prefetch=2)
+
+    assert len(n_downloaded_when_scored) == len(tm_ids)
+    for i, n_downloaded in enumerate(n_downloaded_when_scored):
+        assert n_downloaded <= i + 2
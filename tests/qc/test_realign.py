@@ -0,0 +1,153 @@
+from unittest import mock
+
+import numpy as np
+
+from op_mt_tools.qc.realign import (
+    find_low_similarity_windows,
+    realign_window,
+    repair_alignment,
+    repair_tm,
+)
+
+EMBEDDINGS = {
+    "bo_a": [1.0, 0.0, 0.0],
+    "bo_b": [0.0, 1.0, 0.0],
+    "bo_c": [0.0, 0.0, 1.0],
+    "en_a": [1.0, 0.0, 0.0],
+    "en_b1": [0.0, 1.0, 0.3],
+    "en_b2": [0.0, 1.0, -0.3],
+}
+
+
+def fake_get_embedding(sentences):
+    return np.array([EMBEDDINGS[sent] for sent in sentences])
+
+
+def test_find_low_similarity_windows():
+    sim_scores = [0.9, 0.2, 0.9, 0.9, 0.9, 0.3, 0.1, 0.9]
+
+    windows = find_low_similarity_windows(sim_scores, threshold=0.5, context=1)
+
+    assert windows == [(0, 3), (4, 8)]
+
+
+def test_find_low_similarity_windows_merges_overlaps():
+    sim_scores = [0.9, 0.2, 0.9, 0.3, 0.9]
+
+    windows = find_low_similarity_windows(sim_scores, threshold=0.5, context=1)
+
+    assert windows == [(0, 5)]
+
+
+@mock.patch(
+    "op_mt_tools.qc.realign.get_cached_embedding", side_effect=fake_get_embedding
+)
+def test_repair_alignment(mock_get_cached_embedding):
+    bo_sents = ["bo_a", "bo_a", "bo_b", "bo_c", "bo_a"]
+    en_sents = ["en_a", "en_a", "en_b1", "en_b2", "en_a"]
+    sim_scores = [0.9, 0.9, 0.1, 0.9, 0.9]
+
+    bo_sents, en_sents, n_windows = repair_alignment(
+        bo_sents, en_sents, sim_scores, threshold=0.5, context=1
+    )
+
+    assert n_windows == 1
+    assert bo_sents == ["bo_a", "bo_a", "bo_b", "bo_a"]
+    assert en_sents == ["en_a", "en_a", "en_b1 en_b2", "en_a"]
+    # only sentences of the window are encoded
+    assert mock_get_cached_embedding.call_args_list[0] == mock.call(
+        ["bo_a", "bo_b", "bo_c"]
+    )
+
+
+def test_realign_window_skips_extra_en_sentences():
+    bo_sents = ["bo_a"]
+    en_sents = ["en_b1", "en_a", "en_b2"]
+
+    realigned = realign_window(
+        bo_sents,
+        en_sents,
+        fake_get_embedding(bo_sents),
+        fake_get_embedding(en_sents),
+        band_width=1,
+    )
+
+    # en_b1 is left unaligned
+    assert realigned == (["bo_a"], ["en_a en_b2"])
+    assert realign_window(
+        [], ["en_a"], np.zeros((0, 3)), fake_get_embedding(["en_a"])
+    ) == ([], [])
+
+
+@mock.patch("op_mt_tools.qc.realign.get_cached_embedding")
+def test_repair_alignment_without_low_scores(mock_get_cached_embedding):
+    bo_sents = ["bo_a"]
+    en_sents = ["en_a"]
+
+    assert repair_alignment(bo_sents, en_sents, [0.9]) == (bo_sents, en_sents, 0)
+    mock_get_cached_embedding.assert_not_called()
+
+
+@mock.patch(
+    "op_mt_tools.qc.realign.get_cached_embedding", side_effect=fake_get_embedding
+)
+@mock.patch("op_mt_tools.qc.realign.get_similarity")
+def test_repair_tm(mock_get_similarity, mock_get_cached_embedding, tmp_path):
+    tm_path = tmp_path / "TM0001"
+    tm_path.mkdir()
+    (tm_path / "TM0001-bo.txt").write_text("bo_a\n1️⃣ bo_b\nbo_c", encoding="utf-8")
+    (tm_path / "TM0001-en.txt").write_text("en_a\n1️⃣ en_b1\nen_b2", encoding="utf-8")
+    mock_get_similarity.return_value = [0.9, 0.4, 0.1]
+
+    n_windows = repair_tm(tm_path, threshold=0.5)
+
+    assert n_windows == 1
+    assert (tm_path / "TM0001-bo.txt").read_text() == "bo_a\nbo_b"
+    assert (tm_path / "TM0001-en.txt").read_text() == "en_a\nen_b1 en_b2"
+
+
+@mock.patch(
+    "op_mt_tools.qc.realign.get_cached_embedding", side_effect=fake_get_embedding
+)
+@mock.patch("op_mt_tools.qc.realign.get_similarity")
+def test_repair_tm_keeps_lines_out_of_windows(
+    mock_get_similarity, mock_get_cached_embedding, tmp_path
+):
+    tm_path = tmp_path / "TM0001"
+    tm_path.mkdir()
+    bo_lines = ["2️⃣ bo_c", "bo_a", "bo_b", "bo_c", "1️⃣ bo_a", "3️⃣ bo_b"]
+    en_lines = ["2️⃣ en_b2", "en_a", "en_b1", "en_b2", "1️⃣ en_a", "3️⃣ en_b1", "en_a"]
+    (tm_path / "TM0001-bo.txt").write_text("\n".join(bo_lines) + "\n")
+    (tm_path / "TM0001-en.txt").write_text("\n".join(en_lines) + "\n")
+    mock_get_similarity.return_value = [0.6, 0.9, 0.9, 0.1, 0.9, 0.6]
+
+    n_windows = repair_tm(tm_path, threshold=0.5, context=1)
+
+    assert n_windows == 1
+    assert mock_get_similarity.call_args.args[0][0] == "bo_c"
+    assert (tm_path / "TM0001-bo.txt").read_text() == (
+        "2️⃣ bo_c\nbo_a\nbo_b\nbo_c bo_a\n3️⃣ bo_b\n"
+    )
+    assert (tm_path / "TM0001-en.txt").read_text() == (
+        "2️⃣ en_b2\nen_a\nen_b1 en_b2\nen_a\n3️⃣ en_b1\nen_a\n"
+    )
+
+
+@mock.patch(
+    "op_mt_tools.qc.realign.get_cached_embedding", side_effect=fake_get_embedding
+)
+@mock.patch("op_mt_tools.qc.realign.get_similarity")
+def test_repair_tm_realigns_trailing_lines_without_pair(
+    mock_get_similarity, mock_get_cached_embedding, tmp_path
+):
+    tm_path = tmp_path / "TM0001"
+    tm_path.mkdir()
+    (tm_path / "TM0001-bo.txt").write_text("bo_a\nbo_b", encoding="utf-8")
+    (tm_path / "TM0001-en.txt").write_text("en_a\nen_a\nen_b1\nen_b2", encoding="utf-8")
+    mock_get_similarity.return_value = [0.9, 0.1]
+
+    n_windows = repair_tm(tm_path, threshold=0.5, context=0)
+
+    assert n_windows == 1
+    assert (tm_path / "TM0001-bo.txt").read_text() == "bo_a\nbo_b"
+    assert (tm_path / "TM0001-en.txt").read_text() == "en_a\nen_b1 en_b2"
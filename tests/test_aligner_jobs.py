@@ -0,0 +1,118 @@
+from pathlib import Path
+from unittest import mock
+
+from op_mt_tools.aligner_jobs import (
+    AlignerJobStatus,
+    AlignerJobTracker,
+    collect,
+    resubmit_failed,
+)
+from op_mt_tools.alignment_cache import AlignmentCache
+
+TEXT_PAIRS_VIEW_PATH = {
+    text_id: {"bo": Path(f"O{text_id}-bo.txt"), "en": Path(f"O{text_id}-en.txt")}
+    for text_id in ["0001", "0002", "0003", "0004"]
+}
+
+
+def create_tracker(tmp_path, timeout_secs=3600):
+    tracker = AlignerJobTracker(
+        db_path=tmp_path / "jobs.json", timeout_secs=timeout_secs
+    )
+    tracker.record_submissions(
+        TEXT_PAIRS_VIEW_PATH,
+        {
+            "0001": "PROCESSING",
+            "0002": "PROCESSING",
+            "0003": "FAILED: space is down",
+            "0004": "ALIGNED",
+        },
+    )
+    return tracker
+
+
+def test_record_submissions(tmp_path):
+    tracker = create_tracker(tmp_path)
+
+    assert tracker.stats() == {"pending": 2, "failed": 1, "succeeded": 1}
+    assert tracker.get("0003")["error"] == "FAILED: space is down"
+    assert tracker.get("0001")["view_path"]["bo"] == "O0001-bo.txt"
+
+
+def test_collect(tmp_path):
+    tracker = create_tracker(tmp_path)
+    tm_repos = {"TM0001": True}
+
+    stats = collect(tracker, check_fn=tm_repos.get)
+
+    # TM0002 is not created yet but hasn't timed out
+    assert stats == {"succeeded": 2, "pending": 1, "failed": 1}
+
+
+def test_collect_keeps_TM_repo_without_files_pending(tmp_path):
+    tracker = create_tracker(tmp_path)
+
+    collect(tracker, check_fn={"TM0001": False}.get)
+
+    # the space may not have pushed the TM files yet
+    assert tracker.get("0001")["status"] == AlignerJobStatus.PENDING
+
+
+def test_collect_caches_confirmed_TMs(tmp_path):
+    text_pairs_view_path = {}
+    for text_id in ["0001", "0002"]:
+        text_pairs_view_path[text_id] = {}
+        for lang_code in ["bo", "en"]:
+            view_fn = tmp_path / f"O{text_id}-{lang_code}.txt"
+            view_fn.write_text(f"{text_id} {lang_code}", encoding="utf-8")
+            text_pairs_view_path[text_id][lang_code] = view_fn
+    tracker = AlignerJobTracker(db_path=tmp_path / "jobs.json")
+    tracker.record_submissions(
+        text_pairs_view_path, {"0001": "PROCESSING", "0002": "PROCESSING"}
+    )
+    cache = AlignmentCache(path=tmp_path / "cache")
+
+    collect(tracker, check_fn={"TM0001": True}.get, cache=cache)
+
+    assert cache.lookup(tracker.get("0001")["cache_key"], "0001") is not None
+    assert cache.lookup(tracker.get("0002")["cache_key"], "0002") is None
+
+
+def test_collect_times_out_pending_jobs(tmp_path):
+    tracker = create_tracker(tmp_path, timeout_secs=0)
+    tm_repos = {"TM0001": False}
+
+    collect(tracker, check_fn=tm_repos.get)
+
+    assert tracker.get("0001")["status"] == AlignerJobStatus.FAILED
+    assert tracker.get("0002")["status"] == AlignerJobStatus.TIMEOUT
+
+
+@mock.patch("op_mt_tools.aligner_jobs.create_TMs")
+def test_resubmit_failed(mock_create_TMs, tmp_path):
+    tracker = create_tracker(tmp_path, timeout_secs=0)
+    collect(tracker, check_fn=lambda tm_id: None)
+    mock_create_TMs.return_value = {"0001": "PROCESSING", "0002": "PROCESSING"}
+    # 0003 has no attempts left
+    tracker._db.update({"attempts": 3}, tracker.query.text_id == "0003")
+
+    resubmit_failed(tracker, max_attempts=3)
+
+    resubmitted = mock_create_TMs.call_args.args[0]
+    assert resubmitted == {
+        "0001": TEXT_PAIRS_VIEW_PATH["0001"],
+        "0002": TEXT_PAIRS_VIEW_PATH["0002"],
+    }
+    assert tracker.get("0001")["status"] == AlignerJobStatus.PENDING
+    assert tracker.get("0001")["attempts"] == 2
+
+
+def test_to_csv(tmp_path):
+    tracker = create_tracker(tmp_path)
+    csv_path = tmp_path / "jobs.csv"
+
+    tracker.to_csv(csv_path)
+
+    lines = csv_path.read_text().splitlines()
+    assert lines[0] == "text_id,tm_id,aligner,status,attempts,error"
+    assert lines[1] == "0001,TM0001,remote,pending,1,"
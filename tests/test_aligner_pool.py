@@ -0,0 +1,90 @@
+import threading
+from unittest import mock
+
+import pytest
+
+from op_mt_tools.aligner_pool import AlignerClientPool
+
+
+def create_pool(space_names, start_space=None, **kwargs):
+    return AlignerClientPool(
+        space_names,
+        hf_token="token",
+        start_space=start_space if start_space else mock.MagicMock(),
+        client_factory=lambda name, hf_token: mock.MagicMock(name=name),
+        **kwargs,
+    )
+
+
+def test_acquire_least_loaded_space():
+    pool = create_pool(["space-1", "space-2"])
+
+    client_1 = pool.acquire(timeout=5)
+    client_2 = pool.acquire(timeout=5)
+    pool.release(client_1, latency=1.0)
+    client_3 = pool.acquire(timeout=5)
+
+    assert client_1 is not client_2
+    assert client_3 is client_1
+    assert pool.stats()["space-2"]["in_flight"] == 1
+
+
+def test_acquire_does_not_wait_for_cold_space():
+    space_2_started = threading.Event()
+
+    def start_space(name):
+        if name == "space-2":
+            space_2_started.wait(5)
+
+    pool = create_pool(["space-1", "space-2"], start_space=start_space)
+
+    clients = [pool.acquire(timeout=5) for _ in range(3)]
+    space_2_started.set()
+
+    assert all(client._mock_name == "space-1" for client in clients)
+
+
+def test_failing_space_is_cooled_down():
+    pool = create_pool(["space-1", "space-2"], max_failures=2, cooldown_secs=60)
+
+    for _ in range(2):
+        client = pool.acquire(timeout=5)
+        pool.release(client, ok=False)
+    failed_space = client._mock_name
+
+    assert not pool.stats()[failed_space]["healthy"]
+    for _ in range(3):
+        assert pool.acquire(timeout=5)._mock_name != failed_space
+
+
+def test_acquire_fails_when_no_space_starts():
+    pool = create_pool(["space-1"], start_space=mock.MagicMock(side_effect=Exception))
+
+    with pytest.raises(RuntimeError):
+        pool.acquire(timeout=5)
+
+
+def test_space_failing_to_start_is_started_again_after_cooldown():
+    n_starts = {"space-1": 0, "space-2": 0}
+
+    def start_space(name):
+        n_starts[name] += 1
+        if name == "space-1" and n_starts[name] == 1:
+            raise Exception("space-1 is sleeping")
+
+    pool = create_pool(
+        ["space-1", "space-2"], start_space=start_space, cooldown_secs=0.2
+    )
+    client = pool.acquire(timeout=5)
+    assert client._mock_name == "space-2"
+
+    # space-1 is started again once its cooldown is over, and gets the next job
+    # as it's the least loaded
+    for _ in range(50):
+        if pool.stats()["space-1"]["ready"]:
+            break
+        pool.release(pool.acquire(timeout=5))
+        threading.Event().wait(0.05)
+
+    assert n_starts["space-1"] == 2
+    assert pool.acquire(timeout=5)._mock_name == "space-1"
@@ -0,0 +1,75 @@
+from op_mt_tools.alignment_cache import AlignmentCache, get_text_pair_hash
+
+
+def create_text_pair_view(path, bo_text="ཀ་ཁ།", en_text="one"):
+    bo_view_fn, en_view_fn = path / "bo.txt", path / "en.txt"
+    bo_view_fn.write_text(bo_text, encoding="utf-8")
+    en_view_fn.write_text(en_text, encoding="utf-8")
+    return {"bo": bo_view_fn, "en": en_view_fn}
+
+
+def test_get_text_pair_hash(tmp_path):
+    text_pair_view_path = create_text_pair_view(tmp_path)
+    key = get_text_pair_hash(text_pair_view_path, "v1")
+
+    assert key == get_text_pair_hash(text_pair_view_path, "v1")
+    assert key != get_text_pair_hash(text_pair_view_path, "v2")
+
+    text_pair_view_path["en"].write_text("two", encoding="utf-8")
+    assert key != get_text_pair_hash(text_pair_view_path, "v1")
+
+
+def test_lookup_counts_hits_and_misses(tmp_path):
+    cache = AlignmentCache(path=tmp_path / "cache")
+
+    assert cache.lookup("key1", "0001") is None
+    cache.put("key1", "0001")
+    assert cache.lookup("key1", "0001")["has_outputs"] is False
+    # same content under another text id is not a hit
+    assert cache.lookup("key1", "0002") is None
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+    assert stats["entries"] == 1
+
+
+def test_put_and_restore_outputs(tmp_path):
+    tm_path = tmp_path / "TM0001"
+    tm_path.mkdir()
+    (tm_path / "TM0001-bo.txt").write_text("ཀ་ཁ།", encoding="utf-8")
+    (tm_path / "TM0001-en.txt").write_text("one", encoding="utf-8")
+    cache = AlignmentCache(path=tmp_path / "cache")
+
+    cache.put("key1", "0001", tm_path=tm_path)
+    restored_tm_path = tmp_path / "restored" / "TM0001"
+
+    assert cache.lookup("key1", "0001")["has_outputs"] is True
+    assert cache.restore("key1", restored_tm_path)
+    assert (restored_tm_path / "TM0001-en.txt").read_text(encoding="utf-8") == "one"
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = AlignmentCache(path=tmp_path / "cache", max_entries=2)
+    cache.put("key1", "0001")
+    cache.put("key2", "0002")
+    cache.lookup("key1", "0001")
+
+    cache.put("key3", "0003")
+
+    assert cache.lookup("key1", "0001") is not None
+    assert cache.lookup("key2", "0002") is None
+    assert cache.lookup("key3", "0003") is not None
+
+
+def test_flush_stats(tmp_path):
+    cache = AlignmentCache(path=tmp_path / "cache")
+    cache.lookup("key1", "0001")
+    cache.lookup("key2", "0002")
+
+    # lookups are counted in memory
+    assert AlignmentCache(path=tmp_path / "cache").stats()["misses"] == 0
+    cache.flush_stats()
+    cache.flush_stats()
+
+    assert AlignmentCache(path=tmp_path / "cache").stats()["misses"] == 2
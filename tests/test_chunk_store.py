@@ -0,0 +1,65 @@
+import sqlite3
+
+from op_mt_tools.chunk_store import ChunkStatus, ChunkStore
+
+
+def test_chunk_store(tmp_path):
+    store = ChunkStore(tmp_path / "chunks.sqlite")
+    assert not store.split_completed
+
+    store.add_chunks(["chunk 1", "chunk 2", "chunk 3"])
+    store.start(1)
+    store.complete(1, "cleaned 1", overlap=0.9)
+    store.start(2)
+    store.fail(2, "rate limited")
+    store.start(3)
+    store.complete(3, "cleaned 3", overlap=0.5)
+
+    assert store.split_completed
+    assert len(store) == 3
+    assert store.get_uncleaned_chunks() == [(2, "chunk 2")]
+    assert store.get_cleaned_texts() == ["cleaned 1", "cleaned 3"]
+    assert store.find_low_overlap_chunks(0.8) == [3]
+    assert store.stats() == {ChunkStatus.CLEANED: 2, ChunkStatus.FAILED: 1}
+
+
+def test_import_chunk_files(tmp_path):
+    chunks_dir = tmp_path / "chunks"
+    chunks_dir.mkdir()
+    (chunks_dir / "0001_chunk.txt").write_text("chunk 1")
+    (chunks_dir / "0001_chunk_cleaned.txt").write_text("cleaned 1")
+    (chunks_dir / "0002_chunk.txt").write_text("chunk 2")
+    store = ChunkStore(tmp_path / "chunks.sqlite")
+
+    n_chunks = store.import_chunk_files(chunks_dir)
+
+    assert n_chunks == 2
+    assert store.get_uncleaned_chunks() == [(2, "chunk 2")]
+    assert store.get_cleaned_texts() == ["cleaned 1"]
+
+
+def test_chunk_store_sents(tmp_path):
+    store = ChunkStore(tmp_path / "chunks.sqlite")
+
+    store.add_chunks(["a. b.", "c."], [["a.", "b."], ["c."]])
+
+    assert store.get_sents(1) == ["a.", "b."]
+    assert store.get_sents(2) == ["c."]
+
+
+def test_chunk_store_without_sents_column(tmp_path):
+    db_path = tmp_path / "chunks.sqlite"
+    conn = sqlite3.connect(str(db_path))
+    conn.execute(
+        "CREATE TABLE chunks (chunk_id INTEGER PRIMARY KEY, text TEXT NOT NULL, "
+        "cleaned TEXT, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+        "error TEXT, overlap REAL, started_at REAL, finished_at REAL, duration REAL)"
+    )
+    conn.execute("INSERT INTO chunks (text, status) VALUES ('chunk 1', 'pending')")
+    conn.commit()
+    conn.close()
+
+    store = ChunkStore(db_path)
+
+    assert store.get_uncleaned_chunks() == [(1, "chunk 1")]
+    assert store.get_sents(1) is None
@@ -1,13 +1,31 @@
+import re
 from pathlib import Path
+from unittest import mock
 
 import pytest
 
 from op_mt_tools.cleanup import (
+    CONTEXT_LENGTH,
+    STRICT_CLEANUP_PROMPT,
+    ChunkProfile,
+    CleanupScheduler,
+    chunk_sentences,
     cleanup_en,
     combine_chunks,
     find_failed_cleanup_chunks,
+    get_chunk_store,
+    get_chunks,
+    get_cleanup_prompt,
+    get_profile_chunk_max_tokens,
+    get_text_fns,
+    num_tokens_from_messages,
+    plan_chunks,
+    split_chunk_into_sentence,
     split_document,
+    write_failure_report,
 )
+from op_mt_tools.completion_cache import CompletionCache
+from op_mt_tools.completion_executor import CompletionExecutor
 
 
 @pytest.mark.skip(reason="Need to Mock OpenAI API")
@@ -20,6 +38,259 @@ def test_split_document():
     assert sents == ["Hello World.", "Hello World"]
 
 
+class FakeEncoding:
+    def encode(self, text):
+        return re.findall(r" ?\S+", text)
+
+
+@mock.patch("op_mt_tools.cleanup.get_encoding", return_value=FakeEncoding())
+def test_chunk_sentences_same_as_rejoining_chunks(mock_get_encoding):
+    def chunk_sentences_by_rejoining(sents, chunk_max_tokens):
+        chunks, current_chunk = [], []
+        for sentence in sents:
+            current_chunk.append(sentence)
+            if num_tokens_from_messages(" ".join(current_chunk)) > chunk_max_tokens:
+                current_chunk.pop()
+                chunks.append(" ".join(current_chunk))
+                current_chunk = [sentence]
+        if current_chunk:
+            chunks.append(" ".join(current_chunk))
+        return chunks
+
+    long_sent = " ".join(["word"] * 20)
+    sents = [long_sent, "one two.", "three four five.", long_sent, "six.", "", "x y"]
+
+    for chunk_max_tokens in [8, 10, 12, 30]:
+        chunks = chunk_sentences(sents, chunk_max_tokens)
+        assert chunks == chunk_sentences_by_rejoining(sents, chunk_max_tokens)
+    # sentence over the limit at the start of the document gives an empty chunk
+    assert chunk_sentences(sents, 10)[:2] == ["", long_sent]
+
+
+@mock.patch("op_mt_tools.cleanup.get_encoding", return_value=FakeEncoding())
+def test_plan_chunks_packs_chunks_within_context(mock_get_encoding):
+    document = " ".join(["word " * 19 + "word."] * 500)
+
+    plan = plan_chunks([document])
+
+    quality, throughput = plan[ChunkProfile.QUALITY], plan[ChunkProfile.THROUGHPUT]
+    assert throughput["requests"] < quality["requests"] / 2
+    assert throughput["prompt_tokens"] < quality["prompt_tokens"]
+    for profile in [ChunkProfile.QUALITY, ChunkProfile.THROUGHPUT]:
+        chunk_max_tokens = get_profile_chunk_max_tokens(profile)
+        for chunk in split_document(document, chunk_max_tokens):
+            prompt_tokens = num_tokens_from_messages(get_cleanup_prompt(chunk))
+            # prompt and the cleaned chunk fit in the context window
+            assert prompt_tokens + 1.1 * len(chunk.split()) < CONTEXT_LENGTH
+
+
+@mock.patch("op_mt_tools.cleanup.get_encoding", return_value=FakeEncoding())
+def test_cleanup_scheduler_finishes_shortest_text_first(mock_get_encoding, tmp_path):
+    prompts = []
+
+    async def completion_fn(prompt):
+        prompts.append(prompt)
+        return "cleaned sentence."
+
+    texts = {"long": 3, "short": 1}
+    for text_id, n_chunks in texts.items():
+        (tmp_path / text_id).mkdir()
+        sents = ["word " * 99 + "word."] * 4 * n_chunks
+        (tmp_path / text_id / f"{text_id}.txt").write_text(" ".join(sents))
+    cleaned_text_ids = []
+    scheduler = CleanupScheduler(
+        CompletionExecutor(completion_fn, max_in_flight=1),
+        on_text_cleaned=lambda text_id, fns: cleaned_text_ids.append(text_id),
+        min_overlap=0.0,
+        chunk_stores_path=tmp_path / "stores",
+    )
+    for text_id in texts:
+        scheduler.add_text(text_id, [tmp_path / text_id / f"{text_id}.txt"])
+
+    report = scheduler.run()
+
+    assert report == {"long": [], "short": []}
+    assert len(prompts) == 4
+    assert cleaned_text_ids == ["short", "long"]
+    cleaned_fn = tmp_path / "long" / "[CLEANED]_long.txt"
+    assert cleaned_fn.read_text() == "cleaned sentence.\n" * 3
+    store = get_chunk_store(tmp_path / "long" / "long.txt", tmp_path / "stores")
+    assert store.stats() == {"cleaned": 3}
+    # overlap of the cleaned chunks is saved as they are cleaned
+    failed_chunks = find_failed_cleanup_chunks(
+        tmp_path / "long", chunk_stores_path=tmp_path / "stores"
+    )
+    assert failed_chunks == {"long.txt": [1, 2, 3]}
+
+
+def get_prompt_text(prompt):
+    return re.search(r"<([^<>]*)>$", prompt).group(1)
+
+
+@mock.patch("op_mt_tools.cleanup.get_encoding", return_value=FakeEncoding())
+def test_cleanup_scheduler_retries_low_overlap_chunks(mock_get_encoding, tmp_path):
+    text = " ".join(["word " * 99 + "word."] * 4)
+    prompts = []
+
+    async def completion_fn(prompt):
+        # only the chunk split into smaller parts is cleaned up completely
+        prompts.append(prompt)
+        prompt_text = get_prompt_text(prompt)
+        return "short." if prompt_text.count("word.") == 4 else prompt_text
+
+    fn = tmp_path / "text" / "text.txt"
+    fn.parent.mkdir()
+    fn.write_text(text)
+    scheduler = CleanupScheduler(
+        CompletionExecutor(completion_fn), chunk_stores_path=tmp_path / "stores"
+    )
+    scheduler.add_text("text", [fn])
+
+    report = scheduler.run()
+
+    assert report == {"text": []}
+    assert get_prompt_text(prompts[0]) == get_prompt_text(prompts[1])
+    assert prompts[1].startswith(STRICT_CLEANUP_PROMPT.strip()[:-4])
+    assert len(prompts) > 3
+    cleaned_text = (tmp_path / "text" / "[CLEANED]_text.txt").read_text()
+    assert cleaned_text.replace("\n", " ").strip() == text
+    failed_chunks = find_failed_cleanup_chunks(
+        tmp_path / "text", chunk_stores_path=tmp_path / "stores"
+    )
+    assert failed_chunks == {"text.txt": []}
+
+
+@mock.patch("op_mt_tools.cleanup.get_encoding", return_value=FakeEncoding())
+def test_cleanup_scheduler_reports_failed_chunks(mock_get_encoding, tmp_path):
+    async def completion_fn(prompt):
+        return "short."
+
+    fn = tmp_path / "text" / "text.txt"
+    fn.parent.mkdir()
+    fn.write_text(" ".join(["word " * 99 + "word."] * 4))
+    cleaned_text_ids = []
+    scheduler = CleanupScheduler(
+        CompletionExecutor(completion_fn),
+        on_text_cleaned=lambda text_id, fns: cleaned_text_ids.append(text_id),
+        max_attempts=2,
+        chunk_stores_path=tmp_path / "stores",
+    )
+    scheduler.add_text("text", [fn])
+
+    report = scheduler.run()
+
+    assert [failure["chunk_id"] for failure in report["text"]] == [1]
+    assert report["text"][0]["attempts"] == 2
+    assert report["text"][0]["overlap"] < 0.8
+    assert cleaned_text_ids == []
+    assert not (tmp_path / "text" / "[CLEANED]_text.txt").exists()
+    assert get_chunk_store(fn, tmp_path / "stores").stats() == {"failed": 1}
+    report_fn = tmp_path / "report.csv"
+    write_failure_report(report, report_fn)
+    assert report_fn.read_text().splitlines()[1].startswith("text,1,2,")
+
+
+@mock.patch("op_mt_tools.cleanup.get_encoding", return_value=FakeEncoding())
+def test_cleanup_scheduler_doesnt_cache_low_overlap_completions(
+    mock_get_encoding, tmp_path
+):
+    async def completion_fn(prompt):
+        return "short."
+
+    fn = tmp_path / "text" / "text.txt"
+    fn.parent.mkdir()
+    fn.write_text(" ".join(["word " * 99 + "word."] * 4))
+    cache = CompletionCache(db_path=tmp_path / "cache.sqlite")
+    scheduler = CleanupScheduler(
+        CompletionExecutor(completion_fn, cache=cache),
+        max_attempts=2,
+        chunk_stores_path=tmp_path / "stores",
+    )
+    scheduler.add_text("text", [fn])
+
+    scheduler.run()
+
+    assert cache.stats()["entries"] == 0
+    assert cache.size() == 0
+
+
+@mock.patch("op_mt_tools.cleanup.get_encoding", return_value=FakeEncoding())
+def test_split_chunk_into_sentence_reuses_split_sents(mock_get_encoding, tmp_path):
+    sents = ["word " * 99 + "word.", "Another sentence."] * 8
+    fn = tmp_path / "text" / "text.txt"
+    fn.parent.mkdir()
+    fn.write_text(" ".join(sents))
+    store = get_chunk_store(fn, tmp_path / "stores")
+    chunks = list(get_chunks(fn.read_text(), store))
+
+    with mock.patch("op_mt_tools.cleanup.en_sent_tokenizer") as mock_tokenizer:
+        split_chunk_into_sentence(fn.parent, tmp_path / "stores")
+
+    mock_tokenizer.assert_not_called()
+    chunks_dir = fn.parent / "chunks" / "text"
+    chunk_sents_fns = sorted(chunks_dir.glob("*_chunk_sents.txt"))
+    assert len(chunk_sents_fns) == len(chunks) > 1
+    sents_per_line = [fn.read_text().splitlines() for fn in chunk_sents_fns]
+    assert [sent for lines in sents_per_line for sent in lines] == sents
+
+
+def make_legacy_chunks(text_dir):
+    chunks_dir = text_dir / "chunks"
+    chunks_dir.mkdir(parents=True)
+    chunks = ["First sentence. Second one.", "Third sentence here.", "Last one."]
+    (text_dir / "text.txt").write_text(" ".join(chunks))
+    for chunk_id, chunk in enumerate(chunks, start=1):
+        (chunks_dir / f"{chunk_id:04}_chunk.txt").write_text(chunk)
+    (chunks_dir / "0001_chunk_cleaned.txt").write_text("First sentence.\nSecond one.")
+    (chunks_dir / "0002_chunk_cleaned.txt").write_text("Third")
+    (chunks_dir / "split_completed").touch()
+
+
+def test_find_failed_cleanup_chunks_of_legacy_chunk_files(tmp_path):
+    text_dir = tmp_path / "text"
+    make_legacy_chunks(text_dir)
+
+    failed_chunks = find_failed_cleanup_chunks(text_dir, chunk_stores_path=tmp_path)
+    assert failed_chunks == {"text.txt": [2]}
+    store = get_chunk_store(text_dir / "text.txt", tmp_path)
+    assert store.stats() == {"cleaned": 2, "pending": 1}
+
+
+def test_split_chunk_into_sentence_of_legacy_chunk_files(tmp_path):
+    text_dir = tmp_path / "text"
+    make_legacy_chunks(text_dir)
+
+    split_chunk_into_sentence(text_dir, tmp_path)
+
+    chunk_sents_fns = sorted((text_dir / "chunks" / "text").glob("*_chunk_sents.txt"))
+    assert len(chunk_sents_fns) == 3
+
+
+@mock.patch("op_mt_tools.cleanup.get_encoding", return_value=FakeEncoding())
+def test_cleanup_scheduler_keeps_chunks_of_each_file_apart(mock_get_encoding, tmp_path):
+    async def completion_fn(prompt):
+        return get_prompt_text(prompt)
+
+    text_dir = tmp_path / "text"
+    text_dir.mkdir()
+    for name in ["a", "b"]:
+        (text_dir / f"{name}.txt").write_text(" ".join([f"{name} " * 99 + "a."] * 4))
+    # left by a previous cleanup, it isn't cleaned up again
+    (text_dir / "[CLEANED]_a.txt").write_text("a.")
+    scheduler = CleanupScheduler(
+        CompletionExecutor(completion_fn), chunk_stores_path=tmp_path / "stores"
+    )
+    scheduler.add_text("text", get_text_fns(text_dir))
+
+    assert scheduler.texts[0].n_unfinished == 2
+    report = scheduler.run()
+
+    assert report == {"text": []}
+    assert (text_dir / "[CLEANED]_b.txt").read_text().startswith("b b")
+    assert (text_dir / "[CLEANED]_a.txt").read_text().startswith("a a")
+    assert not list(text_dir.glob("*.sqlite"))
+
+
 @pytest.mark.skip(reason="Need to Mock OpenAI API")
 def test_run_cleanup():
     fn = Path(__file__).parent / "manual" / "uncleaned_texts" / "01.txt"
@@ -35,15 +306,14 @@ def test_find_failed_cleanup_chunks():
 
     failed_chunks = find_failed_cleanup_chunks(text_path)
 
-    assert failed_chunks == [1]
+    assert failed_chunks == {"01.txt": [1]}
 
 
 @pytest.mark.skip(reason="need large data")
 def test_combine_chunks():
     text_dir = Path(__file__).parent / "manual" / "uncleaned_texts"
-    chunks_dir = text_dir / "chunks"
     output_fn = text_dir / "[AUTO_CLEANED]_01.txt"
 
-    combine_chunks(chunks_dir, output_fn)
+    combine_chunks(get_chunk_store(text_dir / "01.txt"), output_fn)
 
     assert output_fn.is_file()
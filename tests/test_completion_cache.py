@@ -0,0 +1,75 @@
+import asyncio
+import sqlite3
+
+from op_mt_tools.completion_cache import CompletionCache
+from op_mt_tools.completion_executor import CompletionExecutor
+
+
+def test_get_and_put(tmp_path):
+    cache = CompletionCache(db_path=tmp_path / "cache.sqlite")
+
+    assert cache.get("gpt", 0, "prompt") is None
+    cache.put("gpt", 0, "prompt", "completion")
+
+    assert cache.get("gpt", 0, "prompt") == "completion"
+    assert cache.get("gpt", 0.5, "prompt") is None
+    assert cache.get("gpt-4", 0, "prompt") is None
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 3
+    assert stats["entries"] == 1
+
+
+def test_evicts_least_recently_used_over_size(tmp_path):
+    cache = CompletionCache(db_path=tmp_path / "cache.sqlite", max_size_mb=20 / 2**20)
+    cache.put("gpt", 0, "a", "x" * 8)
+    cache.put("gpt", 0, "b", "x" * 8)
+    cache.get("gpt", 0, "a")
+
+    cache.put("gpt", 0, "c", "x" * 8)
+
+    assert cache.get("gpt", 0, "a") is not None
+    assert cache.get("gpt", 0, "b") is None
+    assert cache.get("gpt", 0, "c") is not None
+    assert cache.size() <= 20
+
+
+def test_keeps_running_size(tmp_path):
+    cache = CompletionCache(db_path=tmp_path / "cache.sqlite", max_size_mb=20 / 2**20)
+    cache.put("gpt", 0, "a", "x" * 8)
+    cache.put("gpt", 0, "a", "x" * 4)
+    cache.put("gpt", 0, "b", "x" * 8)
+    assert cache.size() == 12
+
+    cache.put("gpt", 0, "c", "x" * 12)
+    assert cache.size() == 20
+    assert cache.delete("gpt", 0, "c")
+    assert not cache.delete("gpt", 0, "c")
+    assert cache.size() == 8
+
+    conn = sqlite3.connect(str(cache.db_path))
+    (size,) = conn.execute("SELECT SUM(size) FROM completions").fetchone()
+    conn.execute("DROP TABLE meta")
+    conn.commit()
+    conn.close()
+    assert size == 8
+    # size of caches without the running total is summed up once
+    assert CompletionCache(db_path=tmp_path / "cache.sqlite").size() == 8
+
+
+def test_executor_skips_cached_prompts(tmp_path):
+    prompts = []
+
+    async def completion_fn(prompt):
+        prompts.append(prompt)
+        return prompt.upper()
+
+    cache = CompletionCache(db_path=tmp_path / "cache.sqlite")
+    executor = CompletionExecutor(completion_fn, cache=cache, model="gpt")
+
+    asyncio.run(executor.complete_all(["colophon", "chunk 1"]))
+    completions = asyncio.run(executor.complete_all(["colophon", "chunk 2"]))
+
+    assert completions == ["COLOPHON", "CHUNK 2"]
+    assert prompts == ["colophon", "chunk 1", "chunk 2"]
+    assert cache.stats()["hits"] == 1
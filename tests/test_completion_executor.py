@@ -0,0 +1,109 @@
+import asyncio
+import json
+import threading
+from functools import partial
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+
+import pytest
+
+from op_mt_tools.cleanup import get_completion_async
+from op_mt_tools.completion_executor import CompletionExecutor, TokenBucket
+
+
+class FakeCompletionHandler(BaseHTTPRequestHandler):
+    """Echoes the prompt, rate limiting the first request."""
+
+    n_requests = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        FakeCompletionHandler.n_requests += 1
+        if FakeCompletionHandler.n_requests == 1:
+            self.send_response(429)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            error = {"error": {"message": "Rate limit reached", "type": "requests"}}
+            self.wfile.write(json.dumps(error).encode())
+            return
+        content = body["messages"][0]["content"].upper()
+        response = {
+            "id": "chatcmpl-0",
+            "object": "chat.completion",
+            "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": content}}
+            ],
+        }
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps(response).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_completion_server():
+    FakeCompletionHandler.n_requests = 0
+    server = HTTPServer(("127.0.0.1", 0), FakeCompletionHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/v1"
+    server.shutdown()
+
+
+@mock.patch("openai.api_key", "fake-key")
+def test_executor_with_fake_server_retries_rate_limited_request(
+    fake_completion_server,
+):
+    executor = CompletionExecutor(
+        completion_fn=partial(get_completion_async, api_base=fake_completion_server),
+        max_in_flight=1,
+    )
+
+    completions = asyncio.run(executor.complete_all(["hello", "world"]))
+
+    assert completions == ["HELLO", "WORLD"]
+    assert FakeCompletionHandler.n_requests == 3
+
+
+def test_executor_limits_in_flight_requests():
+    in_flight, max_in_flight = 0, 0
+
+    async def completion_fn(prompt):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return prompt
+
+    executor = CompletionExecutor(completion_fn, max_in_flight=3)
+
+    completions = asyncio.run(executor.complete_all([str(i) for i in range(10)]))
+
+    assert completions == [str(i) for i in range(10)]
+    assert max_in_flight == 3
+
+
+def test_token_bucket_waits_for_refill():
+    now = 0.0
+    sleeps = []
+
+    async def fake_sleep(secs):
+        nonlocal now
+        sleeps.append(secs)
+        now += secs
+
+    async def acquire_all(bucket):
+        await bucket.acquire(60)
+        await bucket.acquire(30)
+
+    with mock.patch("op_mt_tools.completion_executor.asyncio.sleep", fake_sleep):
+        bucket = TokenBucket(rate_per_minute=60, clock=lambda: now)
+        asyncio.run(acquire_all(bucket))
+
+    # 30 tokens are refilled in 30 secs at 60 tokens per minute
+    assert sleeps == [30.0]
@@ -0,0 +1,76 @@
+import asyncio
+import re
+from unittest import mock
+
+import openai
+import pytest
+
+from op_mt_tools.cleanup import cleanup_en, get_cleanup_executor, get_cleanup_prompt
+from op_mt_tools.completion_executor import get_retry_after
+from op_mt_tools.fake_completion import FakeCompletionBackend
+
+
+class FakeEncoding:
+    def encode(self, text):
+        return re.findall(r" ?\S+", text)
+
+
+def test_fake_completion_echoes_sentences():
+    backend = FakeCompletionBackend()
+    prompt = get_cleanup_prompt("First sentence. Second\nsentence!  Third?")
+
+    completion = asyncio.run(backend(prompt))
+
+    assert completion == "First sentence.\nSecond sentence!\nThird?"
+
+
+def test_fake_completion_failures_are_deterministic():
+    def get_failures(prompts):
+        backend = FakeCompletionBackend(error_rate=0.2, rate_limit_rate=0.3)
+        failures = {}
+        for prompt in prompts:
+            try:
+                asyncio.run(backend(prompt))
+                failures[prompt] = None
+            except openai.error.OpenAIError as e:
+                failures[prompt] = type(e)
+        return failures
+
+    prompts = [get_cleanup_prompt(f"Sentence {i}.") for i in range(100)]
+
+    failures = get_failures(prompts)
+
+    assert failures == get_failures(prompts[::-1])
+    n_rate_limited = list(failures.values()).count(openai.error.RateLimitError)
+    n_errors = list(failures.values()).count(openai.error.ServiceUnavailableError)
+    assert 15 < n_rate_limited < 45
+    assert 5 < n_errors < 35
+
+
+def test_fake_completion_rate_limit_has_retry_after():
+    backend = FakeCompletionBackend(rate_limit_rate=1.0, retry_after=2.5)
+
+    with pytest.raises(openai.error.RateLimitError) as e:
+        asyncio.run(backend(get_cleanup_prompt("Sentence.")))
+
+    assert get_retry_after(e.value) == 2.5
+    assert backend.n_rate_limited == 1
+
+
+@mock.patch("op_mt_tools.cleanup.get_encoding", return_value=FakeEncoding())
+def test_cleanup_en_with_fake_completion(mock_get_encoding, tmp_path):
+    text = " ".join(f"Sentence {i} " + "word " * 47 + "word." for i in range(40))
+    fn = tmp_path / "text" / "text.txt"
+    fn.parent.mkdir()
+    fn.write_text(text)
+    backend = FakeCompletionBackend(rate_limit_rate=0.5, retry_after=0.01)
+    executor = get_cleanup_executor(completion_fn=backend)
+
+    cleaned_fn = cleanup_en(
+        fn, executor=executor, chunk_stores_path=tmp_path / "stores"
+    )
+
+    assert cleaned_fn.read_text().split() == text.split()
+    assert backend.n_rate_limited > 0
+    assert executor.n_retries == backend.n_rate_limited
+    assert executor.n_requests == backend.n_requests
@@ -1,6 +1,8 @@
+import subprocess
+
 import pytest
 
-from op_mt_tools.github_utils import get_github_repos_with_prefix
+from op_mt_tools.github_utils import add_submodules, get_github_repos_with_prefix
 
 
 @pytest.mark.skip(reason="Calling external API")
@@ -14,3 +16,50 @@ def test_get_github_repos_with_prefix():
     repos = get_github_repos_with_prefix(org, token, prefix)
 
     assert repos
+
+
+def create_origin_repo(path, name):
+    repo_path = path / name
+    repo_path.mkdir(parents=True)
+    subprocess.run(["git", "init", "-q", "-b", "main"], cwd=repo_path, check=True)
+    (repo_path / f"{name}-bo.txt").write_text("ཀ་ཁ།", encoding="utf-8")
+    subprocess.run(["git", "add", "."], cwd=repo_path, check=True)
+    subprocess.run(["git", "commit", "-q", "-m", "init"], cwd=repo_path, check=True)
+    return repo_path
+
+
+def test_add_submodules(tmp_path):
+    origins_path = tmp_path / "origins"
+    submodules = {
+        f"data/{name}": str(create_origin_repo(origins_path, name))
+        for name in ["TM0001", "TM0002"]
+    }
+    submodules["data/TM0003"] = str(origins_path / "TM0003")  # missing repo
+    dataset_path = tmp_path / "dataset"
+    dataset_path.mkdir()
+    subprocess.run(["git", "init", "-q", "-b", "main"], cwd=dataset_path, check=True)
+
+    errors = add_submodules(dataset_path, submodules, max_workers=2)
+
+    assert errors["data/TM0001"] is None
+    assert errors["data/TM0002"] is None
+    assert errors["data/TM0003"]
+    assert not (dataset_path / "data" / "TM0003").exists()
+    gitmodules = (dataset_path / ".gitmodules").read_text()
+    assert gitmodules.count("[submodule") == 2
+    staged = subprocess.run(
+        ["git", "ls-files", "--stage"],
+        cwd=dataset_path,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert "160000" in staged and "data/TM0001" in staged and "data/TM0002" in staged
+    status = subprocess.run(
+        ["git", "submodule", "status"],
+        cwd=dataset_path,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert "data/TM0001" in status and "data/TM0002" in status
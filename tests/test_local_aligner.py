@@ -0,0 +1,98 @@
+import pytest
+
+from op_mt_tools.local_aligner import (
+    align_sentences,
+    align_text_pair,
+    banded_align,
+    get_local_aligner_version,
+    load_lexicon,
+)
+
+
+def test_banded_align_one_to_one():
+    src = [1, 2, 3, 4]
+    tgt = [1, 2, 3, 4]
+
+    def cost_fn(i, j, move):
+        if move == (1, 1):
+            return abs(src[i - 1] - tgt[j - 1])
+        return 10.0
+
+    beads = banded_align(len(src), len(tgt), cost_fn, [(1, 1), (1, 0), (0, 1)])
+
+    assert beads == [([0], [0]), ([1], [1]), ([2], [2]), ([3], [3])]
+
+
+def test_banded_align_widens_band():
+    def cost_fn(i, j, move):
+        return 1.0
+
+    beads = banded_align(1, 20, cost_fn, [(1, 1), (0, 1)], band_width=1)
+
+    assert sum(len(en_idxs) for _, en_idxs in beads) == 20
+
+
+def test_banded_align_unreachable_end():
+    def cost_fn(i, j, move):
+        return 1.0
+
+    with pytest.raises(ValueError):
+        banded_align(1, 3, cost_fn, [(1, 1), (1, 2), (2, 1), (1, 0)], band_width=2)
+    with pytest.raises(ValueError):
+        banded_align(0, 2, cost_fn, [(1, 1), (1, 0)])
+
+
+def test_align_sentences_merges_split_sentence():
+    bo_sents = ["a" * 20, "b" * 40, "c" * 20]
+    en_sents = ["a" * 20, "b" * 20, "b" * 20, "c" * 20]
+
+    beads = align_sentences(bo_sents, en_sents)
+
+    assert beads == [([0], [0]), ([1], [1, 2]), ([2], [3])]
+
+
+def test_align_sentences_uses_lexicon():
+    bo_sents = ["ཆོས་", "སངས་རྒྱས་"]
+    en_sents = ["buddha", "dharma"]
+    lexicon = {"ཆོས": {"dharma"}, "སངས": {"buddha"}}
+
+    beads = align_sentences(bo_sents, en_sents, lexicon=lexicon)
+
+    assert beads == [([0], [0]), ([1], [1])]
+
+
+def test_load_lexicon(tmp_path):
+    lexicon_fn = tmp_path / "lexicon.tsv"
+    lexicon_fn.write_text("ཆོས་\tDharma\nཆོས\tdoctrine\n", encoding="utf-8")
+
+    lexicon = load_lexicon(lexicon_fn)
+
+    assert lexicon == {"ཆོས": {"dharma", "doctrine"}}
+
+
+def test_get_local_aligner_version(tmp_path):
+    lexicon_fn = tmp_path / "lexicon.tsv"
+    length_only_version = get_local_aligner_version(lexicon_fn)
+
+    lexicon_fn.write_text("ཆོས་\tdharma\n", encoding="utf-8")
+    lexicon_version = get_local_aligner_version(lexicon_fn)
+    lexicon_fn.write_text("ཆོས་\tdoctrine\n", encoding="utf-8")
+
+    assert length_only_version != lexicon_version
+    assert get_local_aligner_version(lexicon_fn) != lexicon_version
+
+
+def test_align_text_pair(tmp_path):
+    bo_view_fn = tmp_path / "bo.txt"
+    en_view_fn = tmp_path / "en.txt"
+    bo_view_fn.write_text("a" * 10 + "\n" + "b" * 30 + "\n", encoding="utf-8")
+    en_view_fn.write_text(
+        "A" * 10 + "\n" + "B" * 15 + "\n" + "B" * 15, encoding="utf-8"
+    )
+
+    tm_bo_fn, tm_en_fn = align_text_pair(bo_view_fn, en_view_fn, tmp_path / "TM0001")
+
+    assert tm_bo_fn.name == "TM0001-bo.txt"
+    assert tm_en_fn.name == "TM0001-en.txt"
+    assert tm_bo_fn.read_text().splitlines() == ["a" * 10, "b" * 30]
+    assert tm_en_fn.read_text().splitlines() == ["A" * 10, "B" * 15 + " " + "B" * 15]
@@ -2,10 +2,14 @@ import os
 from pathlib import Path
 from unittest import mock
 
+from git import Repo
+
 from op_mt_tools.pipelines import (
     add_text_pair_to_collection_pipeline,
+    add_TMs_duration,
     download_text,
     download_textpairs_tracker_data,
+    find_new_text_pair_text_ids,
     get_text_pairs,
 )
 
@@ -89,11 +93,17 @@ def test_download_monlamAI_tracker_data(mock_clone_or_pull_repo):
 @mock.patch("op_mt_tools.pipelines.download_textpairs_tracker_data")
 @mock.patch("op_mt_tools.pipelines.get_text_pairs")
 @mock.patch("op_mt_tools.pipelines.add_text_pair_to_collection")
-@mock.patch("op_mt_tools.pipelines.commit_and_push")
-@mock.patch("op_mt_tools.pipelines.create_TM")
+@mock.patch("op_mt_tools.pipelines.commit_repo")
+@mock.patch("op_mt_tools.pipelines.push_repo")
+@mock.patch("op_mt_tools.pipelines.create_TMs")
+@mock.patch("op_mt_tools.pipelines.AlignerJobTracker")
+@mock.patch("op_mt_tools.pipelines.repo_lock")
 def test_add_text_pair_to_collection_pipeline(
-    create_TM,
-    commit_and_push,
+    repo_lock,
+    AlignerJobTracker,
+    create_TMs,
+    push_repo,
+    commit_repo,
     add_text_pair_to_collection,
     get_text_pairs,
     download_textpairs_tracker_data,
@@ -114,5 +124,112 @@ def test_add_text_pair_to_collection_pipeline(
     )
     collection_path = Path("tests/data/collection")
 
+    create_TMs.return_value = {"0001": "PROCESSING"}
+
     # act
-    add_text_pair_to_collection_pipeline(collection_path)
+    add_text_pair_to_collection_pipeline(collection_path, incremental=False)
+
+    # assert
+    assert create_TMs.call_args.args[0] == {
+        "0001": add_text_pair_to_collection.return_value[1]
+    }
+    assert create_TMs.call_args.kwargs["aligner"] == "remote"
+    AlignerJobTracker.return_value.record_submissions.assert_called_once_with(
+        create_TMs.call_args.args[0], create_TMs.return_value, "remote"
+    )
+
+
+@mock.patch("op_mt_tools.pipelines.get_text_pairs")
+@mock.patch("op_mt_tools.pipelines.add_text_pair_to_collection")
+@mock.patch("op_mt_tools.pipelines.commit_repo")
+@mock.patch("op_mt_tools.pipelines.push_repo")
+@mock.patch("op_mt_tools.pipelines.create_TMs")
+@mock.patch("op_mt_tools.pipelines.AlignerJobTracker")
+@mock.patch("op_mt_tools.pipelines.repo_lock")
+def test_add_text_pair_to_collection_pipeline_pushes_once_with_inline_aligner(
+    repo_lock,
+    AlignerJobTracker,
+    create_TMs,
+    push_repo,
+    commit_repo,
+    add_text_pair_to_collection,
+    get_text_pairs,
+):
+    get_text_pairs.return_value = [
+        {"bo": Path(f"BO000{i}"), "en": Path(f"EN000{i}")} for i in range(1, 3)
+    ]
+    add_text_pair_to_collection.side_effect = [
+        ("0001", {"bo": "O0001-bo.txt", "en": "O0002-en.txt"}),
+        ("0002", {"bo": "O0003-bo.txt", "en": "O0004-en.txt"}),
+    ]
+    create_TMs.return_value = {"0001": "PROCESSING", "0002": "PROCESSING"}
+    collection_path = Path("tests/data/collection")
+
+    add_text_pair_to_collection_pipeline(
+        collection_path, text_ids=["0001", "0002"], aligner="remote-inline"
+    )
+
+    assert commit_repo.call_count == 2
+    push_repo.assert_called_once_with(collection_path)
+    assert create_TMs.call_args.kwargs["aligner"] == "remote-inline"
+
+
+def commit_tracker_files(repo, path, fns):
+    for fn in fns:
+        (path / fn).touch()
+    repo.git.add(".")
+    repo.git.commit("-m", "update tracker")
+    return repo.head.commit.hexsha
+
+
+def test_add_TMs_duration():
+    text_pairs_duration = {"0001": 1.0, "0002": 2.0}
+
+    add_TMs_duration(text_pairs_duration, {"0001": 10, "0002": 30}, TMs_duration=8.0)
+
+    assert text_pairs_duration == {"0001": 3.0, "0002": 8.0}
+
+
+def test_find_new_text_pair_text_ids(tmp_path):
+    repo = Repo.init(tmp_path)
+    repo.git.config("user.name", "test")
+    repo.git.config("user.email", "test@test.com")
+    tracker_path = tmp_path / "mt" / "mt-extracted-text-pairs"
+    tracker_path.mkdir(parents=True)
+    last_commit = commit_tracker_files(repo, tracker_path, ["BO0001", "EN0001"])
+    commit_tracker_files(
+        repo, tracker_path, ["BO0002", "EN0002", "BO0003", "EN0004", "README.md"]
+    )
+
+    text_ids = find_new_text_pair_text_ids(tracker_path, last_commit)
+
+    assert text_ids == ["0002"]
+
+
+@mock.patch("op_mt_tools.pipelines.download_textpairs_tracker_data")
+@mock.patch("op_mt_tools.pipelines.get_tracker_head_commit")
+@mock.patch("op_mt_tools.pipelines.find_new_text_pair_text_ids")
+@mock.patch("op_mt_tools.pipelines.TrackerState")
+@mock.patch("op_mt_tools.pipelines.get_text_pairs")
+def test_add_text_pair_to_collection_pipeline_incremental(
+    get_text_pairs,
+    TrackerState,
+    find_new_text_pair_text_ids,
+    get_tracker_head_commit,
+    download_textpairs_tracker_data,
+):
+    tracker_state = TrackerState.return_value
+    tracker_state.last_commit = "last_commit"
+    tracker_state.pending_text_ids = ["0001"]
+    get_tracker_head_commit.return_value = "head_commit"
+    find_new_text_pair_text_ids.return_value = ["0001", "0002"]
+    get_text_pairs.return_value = []
+    collection_path = Path("tests/data/collection")
+
+    add_text_pair_to_collection_pipeline(collection_path, schedule_by_size=False)
+
+    assert get_text_pairs.call_args.kwargs["text_ids"] == ["0001", "0002"]
+    assert get_text_pairs.call_args.kwargs["text_pairs_tracker_path"] is None
+    tracker_state.save.assert_called_once_with(
+        "head_commit", pending_text_ids=["0001", "0002"]
+    )
@@ -0,0 +1,69 @@
+from unittest import mock
+
+from op_mt_tools.scheduler import (
+    DEFAULT_SECS_PER_KB,
+    CostModel,
+    get_text_pair_path_size,
+    get_text_pair_size,
+    order_by_cost,
+)
+
+
+def test_cost_model_default_rate(tmp_path):
+    cost_model = CostModel(db_path=tmp_path / "costs.json")
+
+    assert cost_model.estimate("BO0001", size_kb=10) == 10 * DEFAULT_SECS_PER_KB
+
+
+def test_cost_model_learns_rate(tmp_path):
+    cost_model = CostModel(db_path=tmp_path / "costs.json")
+    cost_model.record("BO0001", size_kb=10, duration=20.0)
+    cost_model.record("BO0002", size_kb=30, duration=60.0)
+
+    assert cost_model.secs_per_kb() == 2.0
+    assert cost_model.estimate("BO0003", size_kb=5) == 10.0
+    # recorded duration is used as-is for unchanged texts
+    assert cost_model.estimate("BO0001", size_kb=10) == 20.0
+
+
+def test_cost_model_estimates_unknown_size(tmp_path):
+    cost_model = CostModel(db_path=tmp_path / "costs.json")
+    assert cost_model.estimate("BO0001", size_kb=None) == 0.0
+
+    cost_model.record("BO0001", size_kb=10, duration=20.0)
+    cost_model.record("BO0002", size_kb=30, duration=40.0)
+
+    assert cost_model.estimate("BO0001", size_kb=None) == 20.0
+    assert cost_model.estimate("BO0003", size_kb=None) == 30.0
+
+
+@mock.patch("op_mt_tools.scheduler.get_text_pair_size")
+def test_order_by_cost(mock_get_text_pair_size, tmp_path):
+    sizes = {"0001": 1, "0002": 100, "0003": 10, "0004": None}
+    mock_get_text_pair_size.side_effect = sizes.get
+    cost_model = CostModel(db_path=tmp_path / "costs.json")
+    # 0004 isn't downloaded but was processed before
+    cost_model.record("BO0004", size_kb=20, duration=30.0)
+
+    ordered = order_by_cost(sizes, cost_model)
+
+    assert ordered == ["0002", "0004", "0003", "0001"]
+
+
+def test_get_text_pair_size(tmp_path):
+    for text_id in ["BO0001", "EN0001", "BO0002"]:
+        (tmp_path / text_id).mkdir()
+        (tmp_path / text_id / "text.txt").write_bytes(b"a" * 2048)
+
+    with mock.patch("op_mt_tools.scheduler.config.TEXTS_PATH", tmp_path):
+        assert get_text_pair_size("0001") == 4
+        assert get_text_pair_size("0002") is None
+
+
+def test_get_text_pair_path_size(tmp_path):
+    for text_id in ["BO0001", "EN0001"]:
+        (tmp_path / text_id).mkdir()
+        (tmp_path / text_id / "text.txt").write_bytes(b"a" * 2048)
+    text_pair_path = {"bo": tmp_path / "BO0001", "en": tmp_path / "EN0001"}
+
+    assert get_text_pair_path_size(text_pair_path) == 4
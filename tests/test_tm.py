@@ -1,16 +1,26 @@
+import asyncio
 import json
+import shutil
+import threading
+import time
 from pathlib import Path
 from unittest import mock
 
 import pytest
 from gradio_client.utils import Status as JobStatus
 
+from op_mt_tools.alignment_cache import AlignmentCache, get_text_pair_hash
 from op_mt_tools.tm import (
+    ALIGNERS_VERSION,
     create_request_body,
     create_TM,
+    create_TMs,
+    decode_view_content,
     get_client,
+    get_clients_pool,
     get_raw_github_file_url,
     run_aligner,
+    submit_alignments,
 )
 
 
@@ -25,6 +35,30 @@ def test_get_client_two_client():
     assert client_3 == client_1
 
 
+@mock.patch("op_mt_tools.tm.clients_pool", None)
+@mock.patch("op_mt_tools.tm.AlignerClientPool")
+def test_get_clients_pool_creates_pool_once(mock_pool_cls):
+    def create_pool(*args, **kwargs):
+        time.sleep(0.05)  # connecting to the spaces is slow
+        return mock.DEFAULT
+
+    mock_pool_cls.side_effect = create_pool
+    started = threading.Barrier(8)
+
+    def get_pool():
+        started.wait()
+        get_clients_pool()
+
+    threads = [threading.Thread(target=get_pool) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    mock_pool_cls.assert_called_once()
+    mock_pool_cls.return_value.warm.assert_called_once()
+
+
 def test_get_raw_github_file_url(tmp_path):
     view_path = tmp_path / "C1A81F448/C1A81F448.opc/views/plaintext/O192F059E-bo.txt"
 
@@ -67,6 +101,49 @@ def test_create_request_body(tmp_path):
     }
 
 
+def test_create_request_body_inline(tmp_path):
+    bo_view_path = tmp_path / "O66BF9EDC-bo.txt"
+    en_view_path = tmp_path / "O192F059E-en.txt"
+    bo_view_path.write_text("ཀ་ཁ།\n", encoding="utf-8")
+    en_view_path.write_text("one\n", encoding="utf-8")
+
+    text_pair_view_path = {"bo": bo_view_path, "en": en_view_path}
+    request_body_fn = create_request_body(
+        text_id="text_id",
+        text_pair_view_path=text_pair_view_path,
+        base_dir=tmp_path,
+        inline=True,
+    )
+
+    request_body = json.loads(request_body_fn.read_text())
+    assert request_body["content_encoding"] == "gzip+base64"
+    assert "bo_file_url" not in request_body
+    assert decode_view_content(request_body["bo_file_content"]) == "ཀ་ཁ།\n"
+    assert decode_view_content(request_body["en_file_content"]) == "one\n"
+
+
+@mock.patch("op_mt_tools.tm.create_github_repo_from_dir")
+def test_create_TM_with_local_aligner(mock_create_github_repo_from_dir, tmp_path):
+    bo_view_fn = tmp_path / "O0001-bo.txt"
+    en_view_fn = tmp_path / "O0002-en.txt"
+    bo_view_fn.write_text("ཀ་ཁ་ག་ང་།\nཅ་ཆ་ཇ་ཉ་ཏ་ཐ་ད་ན་།\n", encoding="utf-8")
+    en_view_fn.write_text("one two\nthree four five six\n", encoding="utf-8")
+    text_pair_view_path = {"bo": bo_view_fn, "en": en_view_fn}
+
+    with mock.patch("op_mt_tools.tm.config.TMS_PATH", tmp_path):
+        status = create_TM(text_pair_view_path, text_id="0001", aligner="local")
+
+    assert status == "ALIGNED"
+    assert (tmp_path / "TM0001" / "TM0001-bo.txt").read_text().count("\n") == 1
+    assert (tmp_path / "TM0001" / "TM0001-en.txt").read_text().count("\n") == 1
+    mock_create_github_repo_from_dir.assert_called_once_with(tmp_path / "TM0001")
+
+
+def test_create_TM_with_unknown_aligner():
+    with pytest.raises(ValueError):
+        create_TM({}, text_id="0001", aligner="unknown")
+
+
 @mock.patch("op_mt_tools.tm.create_request_body")
 @mock.patch("op_mt_tools.tm.run_aligner")
 def test_create_monlamAI_TM(mock_run_aligner, mock_create_request_body, tmp_path):
@@ -80,3 +157,131 @@ def test_create_monlamAI_TM(mock_run_aligner, mock_create_request_body, tmp_path
     mock_run_aligner.asssert_called_once_with(tmp_path / "request.json")
     assert mock_create_request_body.call_args[0][0] == "text_id"
     assert mock_create_request_body.call_args[0][1] == text_pair_view_path
+
+
+@mock.patch("op_mt_tools.tm.get_client")
+def test_submit_alignments_limits_in_flight_jobs(mock_get_client):
+    requests = [Path(f"{i}.json") for i in range(5)]
+    submitted_jobs = []
+    waiting_jobs = []
+    max_waiting_jobs = []
+
+    def submit(input_json_fn, api_name):
+        def status():
+            # jobs start once as many jobs as allowed are waiting, so that the
+            # peak doesn't depend on how fast the submissions are
+            if len(waiting_jobs) < 2 and len(submitted_jobs) < len(requests):
+                return mock.MagicMock(code=JobStatus.STARTING)
+            waiting_jobs.remove(input_json_fn)
+            return mock.MagicMock(code=JobStatus.PROCESSING)
+
+        submitted_jobs.append(input_json_fn)
+        waiting_jobs.append(input_json_fn)
+        max_waiting_jobs.append(len(waiting_jobs))
+        job_mock = mock.MagicMock(name="job_mock")
+        job_mock.done.return_value = False
+        job_mock.status.side_effect = status
+        return job_mock
+
+    async def submit_all(requests):
+        futures = await submit_alignments(requests, max_in_flight=2)
+        return await asyncio.gather(*futures)
+
+    mock_get_client.return_value.submit.side_effect = submit
+    sleep = asyncio.sleep
+
+    async def poll_without_delay(delay):
+        await sleep(0)
+
+    with mock.patch("op_mt_tools.tm.asyncio.sleep", new=poll_without_delay):
+        statuses = asyncio.run(submit_all(requests))
+
+    assert statuses == ["PROCESSING"] * 5
+    assert mock_get_client.return_value.submit.call_count == 5
+    assert max(max_waiting_jobs) == 2
+
+
+@mock.patch("op_mt_tools.tm.submit_alignments")
+def test_create_TMs(mock_submit_alignments, tmp_path):
+    async def submit_alignments(requests, max_in_flight):
+        async def status(request):
+            if "0002" in str(request):
+                raise ValueError("space is down")
+            return "PROCESSING"
+
+        return [asyncio.ensure_future(status(request)) for request in requests]
+
+    mock_submit_alignments.side_effect = submit_alignments
+    text_pairs_view_path = {
+        "0001": {"bo": tmp_path / "bo.txt", "en": tmp_path / "en.txt"},
+        "0002": {"bo": tmp_path / "bo.txt", "en": tmp_path / "en.txt"},
+    }
+
+    statuses = create_TMs(text_pairs_view_path)
+
+    assert statuses == {"0001": "PROCESSING", "0002": "FAILED: space is down"}
+
+
+@mock.patch("op_mt_tools.tm.check_repo_exists")
+@mock.patch("op_mt_tools.tm.submit_alignments")
+def test_create_TMs_skips_cached_text_pairs(
+    mock_submit_alignments, mock_check_repo_exists, tmp_path
+):
+    async def submit_alignments(requests, max_in_flight):
+        async def status(request):
+            return "PROCESSING"
+
+        return [asyncio.ensure_future(status(request)) for request in requests]
+
+    mock_submit_alignments.side_effect = submit_alignments
+    mock_check_repo_exists.return_value = True
+    bo_view_fn, en_view_fn = tmp_path / "bo.txt", tmp_path / "en.txt"
+    bo_view_fn.write_text("ཀ་ཁ།", encoding="utf-8")
+    en_view_fn.write_text("one", encoding="utf-8")
+    text_pairs_view_path = {"0001": {"bo": bo_view_fn, "en": en_view_fn}}
+    cache = AlignmentCache(path=tmp_path / "cache")
+
+    first_statuses = create_TMs(text_pairs_view_path, cache=cache)
+    # submitted TM is cached only once its repo is confirmed
+    assert len(cache._entries) == 0
+    cache.put(
+        get_text_pair_hash(text_pairs_view_path["0001"], ALIGNERS_VERSION["remote"]),
+        "0001",
+    )
+    second_statuses = create_TMs(text_pairs_view_path, cache=cache)
+
+    assert first_statuses == {"0001": "PROCESSING"}
+    assert second_statuses == {"0001": "CACHED"}
+    assert mock_submit_alignments.call_count == 1
+    assert AlignmentCache(path=tmp_path / "cache").stats()["hits"] == 1
+
+    # TM repo was deleted since it was cached
+    mock_check_repo_exists.return_value = False
+    third_statuses = create_TMs(text_pairs_view_path, cache=cache)
+
+    assert third_statuses == {"0001": "PROCESSING"}
+    assert mock_submit_alignments.call_count == 2
+
+
+@mock.patch("op_mt_tools.tm.commit_and_push")
+@mock.patch("op_mt_tools.tm.create_github_repo_from_dir")
+def test_create_TM_republishes_cached_local_TM(
+    mock_create_github_repo_from_dir, mock_commit_and_push, tmp_path
+):
+    bo_view_fn = tmp_path / "O0001-bo.txt"
+    en_view_fn = tmp_path / "O0002-en.txt"
+    bo_view_fn.write_text("ཀ་ཁ་ག་ང་།\n", encoding="utf-8")
+    en_view_fn.write_text("one two\n", encoding="utf-8")
+    text_pair_view_path = {"bo": bo_view_fn, "en": en_view_fn}
+    cache = AlignmentCache(path=tmp_path / "cache")
+    tms_path = tmp_path / "tms"
+
+    with mock.patch("op_mt_tools.tm.config.TMS_PATH", tms_path):
+        first_status = create_TM(text_pair_view_path, "0001", "local", cache=cache)
+        shutil.rmtree(tms_path)
+        second_status = create_TM(text_pair_view_path, "0001", "local", cache=cache)
+
+    assert first_status == "ALIGNED"
+    assert second_status == "CACHED"
+    assert (tms_path / "TM0001" / "TM0001-en.txt").read_text() == "one two"
+    assert mock_create_github_repo_from_dir.call_count == 2
@@ -1,11 +1,17 @@
 import tempfile
+import threading
 from pathlib import Path
 from unittest import mock
 
 import pytest
 from git.exc import GitCommandError
 
-from op_mt_tools.utils import clone_or_pull_repo, commit_and_push, create_pecha
+from op_mt_tools.utils import (
+    clone_or_pull_repo,
+    commit_and_push,
+    create_pecha,
+    repo_lock,
+)
 
 
 def test_create_pecha():
@@ -45,3 +51,21 @@ def test_pull_repo(mock_repo_class, tmp_path):
 @mock.patch("op_mt_tools.utils.Repo")
 def test_commit_and_push(mock_repo_class):
     commit_and_push(Path("tests/data/text_pair/BO0001"))
+
+
+def test_repo_lock(tmp_path):
+    (tmp_path / ".git").mkdir()
+    events = []
+
+    def update_repo():
+        with repo_lock(tmp_path):
+            events.append("second")
+
+    with repo_lock(tmp_path):
+        thread = threading.Thread(target=update_repo)
+        thread.start()
+        thread.join(timeout=0.5)
+        events.append("first")
+    thread.join()
+
+    assert events == ["first", "second"]
@@ -0,0 +1,86 @@
+import threading
+
+from op_mt_tools.work_queue import TaskStatus, WorkQueue, run_worker
+
+
+def test_enqueue_ignores_existing_tasks(tmp_path):
+    queue = WorkQueue(db_path=tmp_path / "queue.sqlite", name="test")
+
+    assert queue.enqueue(["0001", "0002"]) == 2
+    assert queue.enqueue(["0002", "0003"]) == 1
+    assert queue.stats() == {TaskStatus.PENDING: 3}
+
+
+def test_lease_and_complete(tmp_path):
+    queue = WorkQueue(db_path=tmp_path / "queue.sqlite", name="test")
+    queue.enqueue(["0001"])
+
+    task_id = queue.lease("worker-1")
+
+    assert task_id == "0001"
+    assert queue.lease("worker-2") is None
+    assert not queue.complete(task_id, "worker-2")
+    assert queue.complete(task_id, "worker-1")
+    assert queue.stats() == {TaskStatus.DONE: 1}
+
+
+def test_expired_lease_is_released(tmp_path):
+    queue = WorkQueue(db_path=tmp_path / "queue.sqlite", name="test", lease_secs=-1)
+    queue.enqueue(["0001"])
+
+    assert queue.lease("worker-1") == "0001"
+    assert queue.lease("worker-2") == "0001"
+    assert not queue.heartbeat("0001", "worker-1")
+
+
+def test_failed_task_is_dead_lettered(tmp_path):
+    queue = WorkQueue(db_path=tmp_path / "queue.sqlite", name="test", max_attempts=2)
+    queue.enqueue(["0001"])
+
+    for _ in range(2):
+        task_id = queue.lease("worker-1")
+        queue.fail(task_id, "worker-1", "boom")
+
+    assert queue.lease("worker-1") is None
+    assert queue.dead_letters() == [("0001", "boom")]
+
+
+def test_concurrent_workers_never_share_task(tmp_path):
+    db_path = tmp_path / "queue.sqlite"
+    task_ids = [f"{i:04}" for i in range(50)]
+    WorkQueue(db_path=db_path, name="test").enqueue(task_ids)
+    processed = []
+    lock = threading.Lock()
+
+    def process(task_id):
+        with lock:
+            processed.append(task_id)
+
+    workers = [
+        threading.Thread(
+            target=run_worker, args=(WorkQueue(db_path=db_path, name="test"), process)
+        )
+        for _ in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert sorted(processed) == task_ids
+
+
+def test_run_worker_retries_failures(tmp_path):
+    queue = WorkQueue(db_path=tmp_path / "queue.sqlite", name="test", max_attempts=3)
+    queue.enqueue(["0001"])
+    calls = []
+
+    def flaky(task_id):
+        calls.append(task_id)
+        if len(calls) < 2:
+            raise ValueError("flaky")
+
+    n_done = run_worker(queue, flaky)
+
+    assert n_done == 1
+    assert calls == ["0001", "0001"]